@@ -0,0 +1,273 @@
+"""
+Convert a directory of AAX files without the web app, Celery or Redis.
+
+Runs AAXProcessor directly in a local process pool. Activation keys are
+resolved once per account before any conversion starts, then every book and
+format is converted in its own worker process. Outputs are recorded in the
+same content-keyed manifest as the web app's, so a book is skipped when an
+output of its content with the same settings and ffmpeg already exists. Each
+result is printed with its per-stage timings as it finishes, followed by
+totals for the whole run.
+
+Usage:
+    python -m aax_convert ~/audible
+    python -m aax_convert ~/audible --jobs 8 --format m4b --format mp3_chapters --profile voice
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+from config import logger
+from services.extract_activation_bytes import MP3_PROFILE, MP3_PROFILES, AAXProcessor
+from services.output_cache import output_cache
+
+CONVERSION_TYPES = ("m4b", "mp3_chapters")
+
+
+def output_path(aax_file: str, conversion_type: str, output_dir: str) -> str:
+    base_name = os.path.splitext(os.path.basename(aax_file))[0]
+    if conversion_type == "m4b":
+        return os.path.join(output_dir, f"{base_name}.m4b")
+    return os.path.join(output_dir, f"{base_name}_chapters.zip")
+
+
+def read_checksums(aax_files, args) -> dict:
+    """Path -> AAX checksum, None where it could not be read"""
+    processor = AAXProcessor(args.tables_path)
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        return dict(
+            zip(aax_files, executor.map(processor.extract_sha1_checksum, aax_files))
+        )
+
+
+def is_up_to_date(
+    aax_file: str,
+    conversion_type: str,
+    result_path: str,
+    checksum: str | None,
+    profile: str,
+) -> bool:
+    """
+    Whether result_path holds this book's content converted with these
+    settings and ffmpeg, according to the output manifest shared with the
+    web app. An identical book's output is hardlinked into place instead.
+    """
+    if checksum is None:
+        return False
+    return output_cache.reuse(
+        aax_file, conversion_type, result_path, checksum=checksum, mp3_profile=profile
+    )
+
+
+def configure_logging(verbose: bool):
+    logger.remove()
+    logger.add(sys.stderr, level="INFO" if verbose else "WARNING")
+
+
+def convert_one(
+    aax_file: str,
+    conversion_type: str,
+    output_dir: str,
+    activation_bytes: str,
+    profile: str,
+    tables_path: str,
+    chapter_workers: int,
+) -> dict:
+    """Convert one book to one format in a pool process and time its stages"""
+    processor = AAXProcessor(tables_path, profile=profile)
+    started = time.monotonic()
+    error = None
+    if conversion_type == "m4b":
+        success = processor.convert_to_m4b(
+            aax_file,
+            output_path(aax_file, "m4b", output_dir),
+            activation_bytes,
+        )
+        if not success:
+            error = "Conversion failed"
+    else:
+        result = processor.convert_to_mp3_chapters_parallel(
+            aax_file, output_dir, activation_bytes, max_workers=chapter_workers
+        )
+        success = result["success"]
+        if not success:
+            error = result.get("error", "MP3 conversion failed")
+        elif result["failed_chapters"]:
+            error = f"Chapters failed: {result['failed_chapters']}"
+
+    return {
+        "aax_file": aax_file,
+        "conversion_type": conversion_type,
+        "success": success,
+        "error": error,
+        "stages": processor.stage_timings,
+        "total": time.monotonic() - started,
+    }
+
+
+def format_stages(stages: dict) -> str:
+    return " ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stages.items())
+
+
+def resolve_keys(aax_files, args) -> dict:
+    """Path -> activation bytes for every book whose key could be found"""
+    if args.activation_bytes:
+        return {aax_file: args.activation_bytes for aax_file in aax_files}
+
+    results = AAXProcessor(args.tables_path).get_activation_bytes_bulk(
+        aax_files, max_workers=args.jobs
+    )
+    keys = {}
+    for aax_file, result in results.items():
+        if "error" in result:
+            print(f"skip  {os.path.basename(aax_file)}: {result['error']}")
+        else:
+            keys[aax_file] = result["activation_bytes"]
+    return keys
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory", help="Directory containing .aax files")
+    parser.add_argument(
+        "--output-dir", help="Where results are written (default: the input directory)"
+    )
+    parser.add_argument(
+        "--format",
+        dest="formats",
+        action="append",
+        choices=CONVERSION_TYPES,
+        help="Output format, may be repeated (default: m4b)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Conversions running at once (default: CPU count)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(MP3_PROFILES),
+        default=MP3_PROFILE,
+        help="MP3 encoder profile",
+    )
+    parser.add_argument(
+        "--chapter-workers",
+        type=int,
+        help="Chapter encodes per MP3 book (default: CPU count / jobs)",
+    )
+    parser.add_argument(
+        "--activation-bytes", help="Use these activation bytes instead of a lookup"
+    )
+    parser.add_argument("--tables-path", default="/app/audible_rainbow_tables")
+    parser.add_argument(
+        "--force", action="store_true", help="Convert even if the output is up to date"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    configure_logging(args.verbose)
+    formats = list(dict.fromkeys(args.formats or ["m4b"]))
+    output_dir = args.output_dir or args.directory
+    os.makedirs(output_dir, exist_ok=True)
+    args.jobs = max(args.jobs, 1)
+    chapter_workers = args.chapter_workers or max((os.cpu_count() or 1) // args.jobs, 1)
+
+    aax_files = sorted(
+        os.path.join(args.directory, f)
+        for f in os.listdir(args.directory)
+        if f.endswith(".aax")
+    )
+    checksums = read_checksums(aax_files, args) if aax_files else {}
+    work = [
+        (aax_file, conversion_type)
+        for aax_file in aax_files
+        for conversion_type in formats
+        if args.force
+        or not is_up_to_date(
+            aax_file,
+            conversion_type,
+            output_path(aax_file, conversion_type, output_dir),
+            checksums[aax_file],
+            args.profile,
+        )
+    ]
+    skipped = len(aax_files) * len(formats) - len(work)
+    if not work:
+        print(f"Nothing to convert ({skipped} outputs up to date)")
+        return 0
+
+    run_started = time.monotonic()
+    started = time.monotonic()
+    books = sorted({aax_file for aax_file, _ in work})
+    keys = resolve_keys(books, args)
+    key_seconds = time.monotonic() - started
+    work = [(aax_file, t) for aax_file, t in work if aax_file in keys]
+    print(f"Resolved keys for {len(keys)} books in {key_seconds:.1f}s")
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=configure_logging,
+        initargs=(args.verbose,),
+    ) as pool:
+        futures = [
+            pool.submit(
+                convert_one,
+                aax_file,
+                conversion_type,
+                output_dir,
+                keys[aax_file],
+                args.profile,
+                args.tables_path,
+                chapter_workers,
+            )
+            for aax_file, conversion_type in work
+        ]
+        try:
+            for done, future in enumerate(
+                concurrent.futures.as_completed(futures), start=1
+            ):
+                result = future.result()
+                results.append(result)
+                if result["success"] and not result["error"]:
+                    output_cache.remember(
+                        result["aax_file"],
+                        result["conversion_type"],
+                        output_path(
+                            result["aax_file"], result["conversion_type"], output_dir
+                        ),
+                        checksum=checksums.get(result["aax_file"]),
+                        mp3_profile=args.profile,
+                    )
+                status = "ok" if result["success"] else "FAIL"
+                print(
+                    f"[{done}/{len(work)}] {status:<4} "
+                    f"{os.path.basename(result['aax_file'])} {result['conversion_type']}: "
+                    f"{format_stages(result['stages'])} total {result['total']:.1f}s"
+                    + (f" ({result['error']})" if result["error"] else "")
+                )
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    wall = time.monotonic() - run_started
+    stage_totals = {"key": key_seconds}
+    for result in results:
+        for stage, seconds in result["stages"].items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    failed = sum(1 for result in results if not result["success"])
+    print(
+        f"\n{len(results) - failed} converted, {failed} failed, {skipped} up to date, "
+        f"{len(books) - len(keys)} without key in {wall:.1f}s "
+        f"({(len(results) - failed) * 3600 / wall:.1f} conversions/hour)"
+    )
+    print(f"Stage totals: {format_stages(stage_totals)}")
+    return 1 if failed or len(keys) < len(books) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
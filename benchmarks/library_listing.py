@@ -0,0 +1,162 @@
+"""
+Measure what listing the library costs per book, full metadata vs summaries.
+
+Builds synthetic ingested books in memory, each with a realistic ffprobe
+output (chapters, long description) and a cover file, then compares the two
+ways of preparing the home page: a complete AudiobookMetadata per book (the
+model the detail page uses, with every Chapter, the base64 cover and the raw
+ffprobe dict) and the BookSummary tuple the list renders from. The report
+gives build time, memory held by the result, and the time and size of
+rendering uploads.html, all scaled to 1k books.
+
+Usage:
+    python -m benchmarks.library_listing
+    python -m benchmarks.library_listing --books 5000 --chapters 60 --cover-kb 200
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+WORDS = "dragon shadow empire night river stone crown winter storm garden".split()
+
+
+def make_books(directory, count, chapters, cover_kb, seed):
+    from models import Book, index_fields
+
+    rng = random.Random(seed)
+    cover = os.urandom(cover_kb * 1024)
+    books = []
+    for i in range(count):
+        cover_path = os.path.join(directory, f"{i}.jpg")
+        with open(cover_path, "wb") as f:
+            f.write(cover)
+        duration = 3600.0 * rng.uniform(2, 30)
+        probe = {
+            "format": {
+                "duration": str(duration),
+                "bit_rate": "64000",
+                "size": str(200 * 1024 * 1024),
+                "tags": {
+                    "title": " ".join(rng.sample(WORDS, 3)).title(),
+                    "artist": f"Author {i % 97}",
+                    "composer": f"Narrator {i % 31}",
+                    "comment": " ".join(rng.choices(WORDS, k=120)),
+                    "genre": "Fantasy",
+                },
+            },
+            "streams": [{"codec_name": "aac", "sample_rate": "44100"}],
+            "chapters": [
+                {
+                    "start_time": str(c * duration / chapters),
+                    "end_time": str((c + 1) * duration / chapters),
+                    "start": c,
+                    "end": c + 1,
+                    "tags": {"title": f"Chapter {c + 1}"},
+                }
+                for c in range(chapters)
+            ],
+        }
+        filename = f"book{i:05d}.aax"
+        books.append(
+            Book(
+                id=i + 1,
+                path=os.path.join(directory, filename),
+                filename=filename,
+                size=200 * 1024 * 1024,
+                mtime=1.0,
+                ingest_status="ready",
+                probe_json=json.dumps(probe),
+                cover_path=cover_path,
+                **index_fields(filename, probe),
+            )
+        )
+    return books
+
+
+def measure(build):
+    """Seconds to build, and bytes still allocated by the result"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, held
+
+
+def render(environment, books):
+    started = time.perf_counter()
+    html = environment.get_template("uploads.html").render(
+        request=None,
+        books=books,
+        listing={
+            "total": len(books),
+            "page": 1,
+            "pages": 1,
+            "per_page": len(books),
+            "sort": "title",
+            "order": "asc",
+            "query": "",
+        },
+    )
+    return time.perf_counter() - started, len(html.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--chapters", type=int, default=30)
+    parser.add_argument("--cover-kb", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from jinja2 import Environment, FileSystemLoader
+
+    from services.ingest import IngestPipeline
+    from services.library import LibraryIndex
+
+    environment = Environment(loader=FileSystemLoader("templates"), autoescape=True)
+    pipeline = IngestPipeline(store=object())
+    scale = 1000 / args.books
+
+    with tempfile.TemporaryDirectory() as directory:
+        books = make_books(
+            directory, args.books, args.chapters, args.cover_kb, args.seed
+        )
+        full, full_seconds, full_bytes = measure(
+            lambda: [pipeline.metadata_for(book) for book in books]
+        )
+        inline_covers = sum(len(metadata.album_art) for metadata in full)
+        del full
+        summaries, summary_seconds, summary_bytes = measure(
+            lambda: [LibraryIndex.summarize(book) for book in books]
+        )
+        render_seconds, html_bytes = render(environment, summaries)
+
+    print(
+        f"{args.books} books, {args.chapters} chapters, {args.cover_kb} KB covers; "
+        "figures per 1k books"
+    )
+    print(f"{'':<22} {'build':>10} {'memory':>12}")
+    print(
+        f"{'AudiobookMetadata':<22} {full_seconds * scale * 1000:>8.0f}ms "
+        f"{full_bytes * scale / 2**20:>10.1f}MB"
+    )
+    print(
+        f"{'BookSummary':<22} {summary_seconds * scale * 1000:>8.0f}ms "
+        f"{summary_bytes * scale / 2**20:>10.1f}MB"
+    )
+    print(
+        f"uploads.html render: {render_seconds * scale * 1000:.0f}ms, "
+        f"{html_bytes * scale / 2**20:.2f}MB of HTML "
+        f"(inline base64 covers would add {inline_covers * scale / 2**20:.1f}MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
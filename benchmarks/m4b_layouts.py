@@ -0,0 +1,148 @@
+"""
+Compare the cost of each M4B layout against ffmpeg's +faststart rewrite.
+
+Converts one input with convert_to_m4b in every M4B_LAYOUTS layout, and once
+more with the standard layout plus ffmpeg's -movflags +faststart, which moves
+the moov to the front by rewriting the whole file when the remux is done.
+The report gives wall time, bytes written by ffmpeg and where the moov ends
+up for each. Without --input, a synthetic AAC book of --hours at --bitrate
+is generated first (ffmpeg ignores the activation bytes for it); use
+--hours 8 --bitrate 320k or more for an input of 1 GB and up.
+
+Usage:
+    python -m benchmarks.m4b_layouts
+    python -m benchmarks.m4b_layouts --hours 8 --bitrate 320k
+    python -m benchmarks.m4b_layouts --input book.aax --activation-bytes 1a2b3c4d
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import tempfile
+import time
+
+
+def synthetic_book(directory, hours, bitrate, chapters):
+    """An M4A of hours of AAC audio with evenly spaced chapters"""
+    path = os.path.join(directory, "synthetic.m4a")
+    seconds = hours * 3600
+    metadata = os.path.join(directory, "chapters.txt")
+    with open(metadata, "w") as f:
+        f.write(";FFMETADATA1\ntitle=Synthetic Book\n")
+        for chapter in range(chapters):
+            f.write(
+                "[CHAPTER]\nTIMEBASE=1/1000\n"
+                f"START={int(chapter * seconds / chapters * 1000)}\n"
+                f"END={int((chapter + 1) * seconds / chapters * 1000)}\n"
+                f"title=Chapter {chapter + 1}\n"
+            )
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+            "-i",
+            metadata,
+            "-map_metadata",
+            "1",
+            "-map_chapters",
+            "1",
+            "-c:a",
+            "aac",
+            "-b:a",
+            bitrate,
+            "-y",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def written_bytes():
+    """Bytes written so far by finished child processes"""
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock * 512
+
+
+def moov_offset(path):
+    from services.extract_activation_bytes import mp4_boxes
+
+    return next((offset for box, offset, _ in mp4_boxes(path) if box == b"moov"), None)
+
+
+def run(label, convert, output):
+    before = written_bytes()
+    started = time.perf_counter()
+    ok = convert()
+    elapsed = time.perf_counter() - started
+    written = written_bytes() - before
+    size = os.path.getsize(output) if ok else 0
+    offset = moov_offset(output) if ok else None
+    print(
+        f"{label:<22} {elapsed:>8.1f}s {written / 2**20:>10.0f}MB "
+        f"{size / 2**20:>10.0f}MB {'-' if offset is None else offset:>12}"
+    )
+    if ok:
+        os.remove(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--input", help="AAX file, a synthetic book if not given")
+    parser.add_argument("--activation-bytes", default="00000000")
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--bitrate", default="128k")
+    parser.add_argument("--chapters", type=int, default=40)
+    args = parser.parse_args()
+
+    from services.extract_activation_bytes import M4B_LAYOUTS, AAXProcessor
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.input or synthetic_book(
+            directory, args.hours, args.bitrate, args.chapters
+        )
+        output = os.path.join(directory, "out.m4b")
+        processor = AAXProcessor()
+        print(f"{os.path.basename(source)}: {os.path.getsize(source) / 2**20:.0f}MB")
+        print(f"{'':<22} {'time':>9} {'written':>12} {'output':>12} {'moov at':>12}")
+        for layout in M4B_LAYOUTS:
+            run(
+                layout,
+                lambda: processor.convert_to_m4b(
+                    source, output, args.activation_bytes, layout=layout
+                ),
+                output,
+            )
+
+        def rewrite():
+            result = subprocess.run(
+                [
+                    "ffmpeg",
+                    "-v",
+                    "error",
+                    "-activation_bytes",
+                    args.activation_bytes,
+                    "-i",
+                    source,
+                    "-c",
+                    "copy",
+                    "-map_chapters",
+                    "0",
+                    "-movflags",
+                    "+faststart",
+                    "-y",
+                    output,
+                ]
+            )
+            return result.returncode == 0
+
+        run("ffmpeg +faststart", rewrite, output)
+
+
+if __name__ == "__main__":
+    main()
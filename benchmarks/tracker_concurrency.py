@@ -0,0 +1,109 @@
+"""
+Hammer ConversionTracker from several processes at once.
+
+Mimics the production layout (one uvicorn process plus prefork Celery workers
+sharing one SQLite file): every process starts, updates and completes its own
+conversions while also polling progress, and the run reports throughput,
+latency percentiles and how many calls failed with "database is locked".
+
+Usage:
+    python -m benchmarks.tracker_concurrency --processes 5 --ops 500
+    python -m benchmarks.tracker_concurrency --journal-mode DELETE --synchronous FULL
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+
+def _worker(db_url: str, worker_index: int, ops: int, result_queue):
+    from sqlalchemy.exc import OperationalError
+
+    from models import ConversionTracker
+
+    tracker = ConversionTracker(db_url)
+    latencies = []
+    locked_errors = 0
+
+    for op in range(ops):
+        filename = f"book_{worker_index}_{op % 10}.aax"
+        started = time.perf_counter()
+        try:
+            if op % 10 == 0:
+                tracker.start_conversion(filename, "m4b")
+            elif op % 10 == 9:
+                tracker.complete_conversion(filename, result_path="out.m4b")
+            elif op % 3 == 0:
+                tracker.get_progress(filename, "m4b")
+            else:
+                tracker.update_progress(filename, float(op % 100), "converting", "m4b")
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked_errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    if result_queue is not None:
+        result_queue.put((latencies, locked_errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--processes", type=int, default=5)
+    parser.add_argument("--ops", type=int, default=500, help="Operations per process")
+    parser.add_argument("--journal-mode", default="WAL")
+    parser.add_argument("--synchronous", default="NORMAL")
+    parser.add_argument("--busy-timeout-ms", type=int, default=10000)
+    args = parser.parse_args()
+
+    # Engine settings are read at import time, so set them before any worker imports models
+    os.environ["SQLITE_JOURNAL_MODE"] = args.journal_mode
+    os.environ["SQLITE_SYNCHRONOUS"] = args.synchronous
+    os.environ["SQLITE_BUSY_TIMEOUT_MS"] = str(args.busy_timeout_ms)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+
+        # Create the schema once up front so workers don't race on it
+        ctx = multiprocessing.get_context("fork")
+        init = ctx.Process(target=_worker, args=(db_url, -1, 0, None))
+        init.start()
+        init.join()
+
+        result_queue = ctx.Queue()
+        workers = [
+            ctx.Process(target=_worker, args=(db_url, i, args.ops, result_queue))
+            for i in range(args.processes)
+        ]
+
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        results = [result_queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(lat for worker_lats, _ in results for lat in worker_lats)
+    locked_errors = sum(errors for _, errors in results)
+    total_ops = len(latencies)
+
+    print(
+        f"journal={args.journal_mode} synchronous={args.synchronous} "
+        f"busy_timeout={args.busy_timeout_ms}ms processes={args.processes}"
+    )
+    print(f"operations:      {total_ops}")
+    print(f"wall time:       {elapsed:.2f}s")
+    print(f"throughput:      {total_ops / elapsed:.0f} ops/s")
+    print(f"p50 latency:     {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"p95 latency:     {latencies[int(total_ops * 0.95)] * 1000:.2f} ms")
+    print(f"p99 latency:     {latencies[int(total_ops * 0.99)] * 1000:.2f} ms")
+    print(f"max latency:     {latencies[-1] * 1000:.2f} ms")
+    print(f"locked errors:   {locked_errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Watch directories for AAX files and ingest them as they arrive.
+
+Every new or changed file gets its checksum, activation bytes, metadata and
+cover stored in the books table as soon as it has finished copying, so the
+library never waits for a page load to probe it.
+
+Usage:
+    python -m ingest_daemon
+    python -m ingest_daemon uploads /mnt/audible --poll --auto-convert m4b
+    python -m ingest_daemon --once
+"""
+
+import argparse
+import signal
+import threading
+
+from config import logger
+from services.ingest import INGEST_DIRS, INGEST_WATCH_MODE, IngestDaemon, IngestPipeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "directories", nargs="*", help="Directories to watch (default: INGEST_DIRS)"
+    )
+    parser.add_argument(
+        "--poll", action="store_true", help="Poll instead of using inotify"
+    )
+    parser.add_argument(
+        "--auto-convert",
+        action="append",
+        choices=("m4b", "mp3_chapters"),
+        help="Queue this conversion for every new book, may be repeated",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="Ingest what is there now and exit"
+    )
+    args = parser.parse_args(argv)
+
+    daemon = IngestDaemon(
+        pipeline=IngestPipeline(auto_convert=args.auto_convert),
+        directories=args.directories or INGEST_DIRS,
+        watch_mode="poll" if args.poll else INGEST_WATCH_MODE,
+    )
+    if args.once:
+        daemon.run_once()
+        return
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping ingest daemon")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    daemon.run(stop_event)
+
+
+if __name__ == "__main__":
+    main()
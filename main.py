@@ -2,23 +2,52 @@ import json
 import os
 import time
 from contextlib import asynccontextmanager
+from urllib.parse import quote
 
 from fastapi import FastAPI, File, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
 from config import logger
+from models import ACTIVE_STATUSES, BatchRequest
 from services import (
-    AAXProcessor,
-    AudiobookMetadataExtractor,
+    batch_service,
+    chapter_stream_cache,
     conversion_orchestrator,
     conversion_service,
+    detail_cache,
+    etag_matches,
+    follow,
+    format_sse,
+    ingest_pipeline,
+    library_index,
+    moov_first,
+    output_cache,
+    progress_events,
+    scratch_space,
+    storage_manager,
+    stuck_job_reaper,
 )
+from services.batch_service import output_path
+from services.extract_activation_bytes import MP3_PROFILE, MP3_PROFILES
+from services.library import LIBRARY_PAGE_SIZE
+from services.scratch import estimate_mp3_bytes
+from tasks.batch_tasks import cancel_batch, start_batch
 from tasks.conversion_tasks import (
-    convert_m4b_task,
-    convert_mp3_chapters_task,
-    mark_queue_failure,
+    cancel_conversion,
+    enqueue_conversion,
+    release_reaped_conversion,
+    requeue_conversion,
 )
+from tasks.ingest_tasks import queue_ingest, request_ingest
 
 
 @asynccontextmanager
@@ -26,9 +55,17 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up AAX Converter...")
     # Services are initialized automatically via their singletons
+    stuck_job_reaper.start(
+        requeue=requeue_conversion,
+        requeue_ingest=queue_ingest,
+        release=release_reaped_conversion,
+    )
+    library_index.start(on_pending=queue_ingest)
+    storage_manager.start()
     yield
     # Shutdown
     logger.info("Shutting down AAX Converter...")
+    conversion_orchestrator.cleanup_conversions()
     # Thread manager handles graceful shutdown automatically
 
 
@@ -36,25 +73,124 @@ app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
 
+def _library_etag(request: Request, template: str | None = None) -> dict:
+    """
+    Headers versioning a library response by the library generation.
+
+    Pages rendered from a template are versioned by its mtime as well, so a
+    deploy that changes the template is not answered with 304. The ETag is
+    left out on databases that keep no generation.
+    """
+    version = (
+        str(int(os.path.getmtime(os.path.join("templates", template))))
+        if template
+        else ""
+    )
+    etag = library_index.etag(
+        request.url.path, request.query_params.multi_items(), version
+    )
+    headers = {"Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    return headers
+
+
 @app.get("/")
-def read_root(request: Request):
-    # Home page now shows uploads list
-    uploads = os.listdir("uploads")
-    uploads = [f for f in uploads if f.endswith(".aax")]
-    # process the file and get the metadata
-    metadata = []
-    for upload in uploads:
-        file_path = os.path.join("uploads", upload)
-
-        extractor = AudiobookMetadataExtractor(file_path)
-        extractor.extract_full_metadata()
-        metadata.append(extractor.get_complete_metadata())
+def read_root(
+    request: Request,
+    sort: str = "title",
+    order: str = "asc",
+    page: int = 1,
+    per_page: int = LIBRARY_PAGE_SIZE,
+    q: str | None = None,
+):
+    # Home page now shows uploads list, one page at a time from the library
+    # index, or the books matching the search box; new files are found and
+    # queued for the ingest job in the background, not in this request
+    headers = _library_etag(request, template="uploads.html")
+    if "ETag" in headers and etag_matches(
+        request.headers.get("if-none-match"), headers["ETag"]
+    ):
+        return Response(status_code=304, headers=headers)
+    try:
+        listing = library_index.page(sort, order, page, per_page, query=q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    books = listing.pop("books")
     return templates.TemplateResponse(
         "uploads.html",
-        {"request": request, "uploads": uploads, "metadata": metadata},
+        {
+            "request": request,
+            # Only what the cards show: chapters, covers and the raw probe
+            # output are loaded by the detail page
+            "books": [library_index.summarize(book) for book in books],
+            "listing": listing,
+        },
+        headers=headers,
     )
 
 
+@app.get("/covers/{filename}")
+def read_cover(filename: str):
+    """A book's cover image, extracted when it was ingested"""
+    book = ingest_pipeline.current_book(os.path.join("uploads", filename))
+    if book is None or not book.cover_path or not os.path.exists(book.cover_path):
+        raise HTTPException(status_code=404, detail="Cover not found")
+    # Listed with a ?v= that changes with the file, so it can be cached
+    return FileResponse(
+        book.cover_path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
+@app.get("/api/books")
+def api_list_books(
+    request: Request,
+    sort: str = "title",
+    order: str = "asc",
+    limit: int = LIBRARY_PAGE_SIZE,
+    cursor: str | None = None,
+    q: str | None = None,
+    fields: str | None = None,
+):
+    """
+    One page of the library as JSON, or search results if q is given.
+
+    Pass next_cursor back as cursor for the following page. Responses carry
+    an ETag, so polling with If-None-Match costs one primary key lookup
+    until a book changes.
+    """
+    headers = _library_etag(request)
+    if "ETag" in headers and etag_matches(
+        request.headers.get("if-none-match"), headers["ETag"]
+    ):
+        return Response(status_code=304, headers=headers)
+    try:
+        body = library_index.api_page(sort, order, limit, cursor, q, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(body, headers=headers)
+
+
+@app.get("/api/books/{book_id}")
+def api_get_book(request: Request, book_id: int, fields: str | None = None):
+    """One book as JSON, including its chapters"""
+    headers = _library_etag(request)
+    if "ETag" in headers and etag_matches(
+        request.headers.get("if-none-match"), headers["ETag"]
+    ):
+        return Response(status_code=304, headers=headers)
+    try:
+        body = library_index.api_book(book_id, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if body is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return JSONResponse(body, headers=headers)
+
+
 @app.get("/uploads")
 def read_uploads(request: Request):
     # Uploads page now shows upload form
@@ -65,37 +201,53 @@ def read_uploads(request: Request):
 
 @app.get("/detail/{filename}")
 def read_detail(request: Request, filename: str):
-    try:
-        file_path = os.path.join("uploads", filename)
-        if not os.path.exists(file_path) or not filename.endswith(".aax"):
-            return templates.TemplateResponse(
-                "detail.html",
-                {"request": request, "filename": filename, "metadata": None},
-            )
-
-        # Extract complete metadata for detailed view
-        processor = AAXProcessor()
-        result = processor.get_activation_bytes(file_path)
-
-        extractor = AudiobookMetadataExtractor(file_path)
-        extractor.extract_full_metadata()
-        metadata = extractor.get_complete_metadata()
+    file_path = os.path.join("uploads", filename)
+    if not os.path.exists(file_path) or not filename.endswith(".aax"):
+        return templates.TemplateResponse(
+            "detail.html",
+            {"request": request, "filename": filename, "metadata": None},
+            status_code=404,
+        )
 
+    # Served from the ingest results; nothing is probed in this request.
+    # A new or changed file is ingested in the background, and until that
+    # finishes the page of its previous ingest is served if there was one.
+    book = ingest_pipeline.current_book(file_path)
+    if book is None:
+        request_ingest(file_path)
+        book = ingest_pipeline.store.get_book(os.path.abspath(file_path))
+    etag = detail_cache.etag(book) if book and book.ingest_status != "error" else None
+    if etag is None:
         return templates.TemplateResponse(
             "detail.html",
             {
                 "request": request,
                 "filename": filename,
-                "metadata": metadata,
-                "activation_bytes": result.get("activation_bytes", "N/A"),
-                "checksum": result.get("checksum", "N/A"),
+                "metadata": None,
+                "ingest_status": book.ingest_status if book else "pending",
+                "ingest_error": book.ingest_error if book else None,
             },
         )
-    except Exception as e:
-        return templates.TemplateResponse(
-            "detail.html",
-            {"request": request, "filename": filename, "metadata": None},
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    body = detail_cache.get(book.path, etag)
+    if body is None:
+        body = (
+            templates.get_template("detail.html")
+            .render(
+                request=request,
+                filename=filename,
+                metadata=ingest_pipeline.metadata_for(book, include_cover=False),
+                cover_url=library_index.cover_url(book),
+                activation_bytes=book.activation_bytes or "N/A",
+                checksum=book.checksum or "N/A",
+            )
+            .encode()
         )
+        detail_cache.put(book.path, etag, body)
+    return HTMLResponse(body, headers=headers)
 
 
 @app.get("/health")
@@ -109,6 +261,8 @@ def delete_file(filename: str):
         file_path = os.path.join("uploads", filename)
         if os.path.exists(file_path) and filename.endswith(".aax"):
             os.remove(file_path)
+            ingest_pipeline.forget(file_path)
+            detail_cache.discard(os.path.abspath(file_path))
             return {"message": "File deleted successfully"}
         else:
             return {"error": "File not found"}, 404
@@ -116,6 +270,31 @@ def delete_file(filename: str):
         return {"error": str(e)}, 500
 
 
+def _check_space(aax_file_path: str, conversion_type: str):
+    """
+    Refuse a conversion no scratch or output filesystem could ever hold.
+    Ones that only have to wait for space are queued; the job waits. Needs
+    the workers' SCRATCH_ROOTS mounted here; roots that are not are left to
+    the workers to check.
+    """
+    if conversion_type == "m4b":
+        # A stream copy, about as large as the AAX file
+        scratch_bytes, output_bytes = 0, os.path.getsize(aax_file_path)
+    else:
+        book = ingest_pipeline.current_book(aax_file_path)
+        if book is None or not book.duration:
+            return
+        scratch_bytes = output_bytes = estimate_mp3_bytes(
+            book.duration,
+            MP3_PROFILES[MP3_PROFILE]["bitrate"],
+            book.chapter_count or 0,
+        )
+    try:
+        scratch_space.check(scratch_bytes, os.path.dirname(aax_file_path), output_bytes)
+    except OSError as e:
+        raise HTTPException(status_code=507, detail=e.strerror)
+
+
 @app.post("/convert/{filename}")
 def start_conversion(filename: str):
     """Start AAX to M4B conversion in background"""
@@ -133,10 +312,10 @@ def start_conversion(filename: str):
         m4b_filename = f"{base_name}.m4b"
         m4b_file_path = os.path.join("uploads", m4b_filename)
 
-        # Check if already converted and up to date
-        if os.path.exists(m4b_file_path) and os.path.getmtime(
-            aax_file_path
-        ) <= os.path.getmtime(m4b_file_path):
+        # Already converted, or the same book was converted under another name
+        if output_cache.reuse(
+            aax_file_path, "m4b", m4b_file_path
+        ) or output_cache.is_up_to_date(aax_file_path, "m4b", m4b_file_path):
             return JSONResponse(
                 {
                     "status": "already_converted",
@@ -145,45 +324,62 @@ def start_conversion(filename: str):
                 }
             )
 
-        # Get activation bytes
-        processor = AAXProcessor()
-        result = processor.get_activation_bytes(aax_file_path)
-
-        if "error" in result:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Could not get activation bytes: {result['error']}",
-            )
-
-        activation_bytes = result["activation_bytes"]
-
-        # Start conversion tracking before queueing Celery task
-        if conversion_service.start_conversion(filename, "m4b"):
-            try:
-                task_result = convert_m4b_task.delay(
-                    filename, aax_file_path, m4b_file_path, activation_bytes
-                )
-            except Exception as task_error:
-                mark_queue_failure(filename, "m4b", f"Queue error: {task_error}")
-                raise
+        _check_space(aax_file_path, "m4b")
 
+        # Claim the conversion before queueing so duplicates never reach Celery.
+        # The activation key is resolved by the job itself, not in this request.
+        task_id = enqueue_conversion(filename, "m4b")
+        if task_id:
             return JSONResponse(
                 {
                     "status": "started",
                     "message": "Conversion started",
-                    "task_id": task_result.id,
+                    "task_id": task_id,
                 }
             )
         else:
+            active = conversion_service.get_progress(filename, "m4b")
             return JSONResponse(
-                {"status": "in_progress", "message": "Conversion already in progress"}
+                {
+                    "status": "in_progress",
+                    "message": "Conversion already in progress",
+                    "task_id": active.get("task_id"),
+                }
             )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting conversion: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.delete("/convert/{filename}")
+def cancel_conversion_request(filename: str, conversion_type: str = "m4b"):
+    """Cancel a queued or running conversion and free its worker slots"""
+    if conversion_type not in ("m4b", "mp3_chapters"):
+        raise HTTPException(status_code=400, detail="Invalid conversion type")
+
+    record = cancel_conversion(filename, conversion_type)
+    if record is None:
+        return JSONResponse(
+            {
+                "status": "not_active",
+                "message": "No active conversion to cancel",
+            },
+            status_code=409,
+        )
+
+    return JSONResponse(
+        {
+            "status": "cancelled",
+            "message": "Conversion cancelled",
+            "task_id": record.get("task_id"),
+            "revoked_tasks": len(record["revoked_tasks"]),
+        }
+    )
+
+
 @app.get("/convert/status/{filename}")
 def get_conversion_status(filename: str, conversion_type: str = "m4b"):
     """Get conversion progress status"""
@@ -199,6 +395,125 @@ def get_active_conversions():
     return JSONResponse(conversion_orchestrator.get_active_conversions())
 
 
+@app.post("/batches")
+def create_batch(request: BatchRequest):
+    """
+    Convert many books at once: by filenames, by glob, or all unconverted.
+
+    Books whose output is already up to date are skipped; the rest are
+    queued a few at a time, at most the batch's concurrency.
+    """
+    try:
+        batch_id = start_batch(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return JSONResponse(
+        {
+            "status": "created",
+            "batch_id": batch_id,
+            "status_url": f"/batches/{batch_id}",
+        },
+        status_code=201,
+    )
+
+
+@app.get("/batches/{batch_id}")
+def get_batch_status(batch_id: str):
+    """Aggregate batch status with per-book progress and throughput"""
+    status = batch_service.get_status(batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return JSONResponse(status)
+
+
+@app.delete("/batches/{batch_id}")
+def cancel_batch_request(batch_id: str):
+    """Cancel a batch and the conversions it has queued"""
+    status = cancel_batch(batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return JSONResponse(status)
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.get("/convert/events/{filename}")
+async def stream_conversion_events(
+    request: Request, filename: str, conversion_type: str = "m4b"
+):
+    """Stream conversion progress as Server-Sent Events, pushed only on change"""
+
+    async def event_stream():
+        events = progress_events.subscribe(filename, conversion_type)
+        try:
+            status = await run_in_threadpool(
+                conversion_orchestrator.get_conversion_status,
+                filename,
+                conversion_type,
+            )
+            yield format_sse(status)
+
+            while status["status"] in ACTIVE_STATUSES:
+                event = await anext(events)
+                if await request.is_disconnected():
+                    break
+
+                if event is None:
+                    # Quiet period: re-check once in case an event was missed
+                    latest = await run_in_threadpool(
+                        conversion_orchestrator.get_conversion_status,
+                        filename,
+                        conversion_type,
+                    )
+                    if (latest["status"], latest.get("progress")) == (
+                        status["status"],
+                        status.get("progress"),
+                    ):
+                        yield ": keepalive\n\n"
+                        continue
+                    status = latest
+                else:
+                    status = conversion_orchestrator.add_download_url(
+                        event, filename, conversion_type
+                    )
+                yield format_sse(status)
+        finally:
+            events.close()
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+@app.get("/convert/events")
+async def stream_active_conversions(request: Request):
+    """Stream a snapshot of active conversions followed by every progress change"""
+
+    async def event_stream():
+        events = progress_events.subscribe()
+        try:
+            snapshot = await run_in_threadpool(
+                conversion_orchestrator.get_active_conversions
+            )
+            yield format_sse(snapshot, event="snapshot")
+
+            async for event in events:
+                if await request.is_disconnected():
+                    break
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield format_sse(event, event="progress")
+        finally:
+            events.close()
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
 @app.get("/download/{filename}")
 def download_m4b(filename: str):
     """Download the converted M4B file"""
@@ -213,39 +528,111 @@ def download_m4b(filename: str):
         if not os.path.exists(m4b_file_path):
             raise HTTPException(status_code=404, detail="Converted file not found")
 
+        if conversion_service.is_conversion_active(filename, "m4b"):
+            # A fragmented M4B is final up to its last written byte, so it is
+            # sent while ffmpeg writes; a standard one is useless until done
+            if not moov_first(m4b_file_path):
+                raise HTTPException(
+                    status_code=409, detail="Conversion is still running"
+                )
+            disposition = f"attachment; filename*=utf-8''{quote(m4b_filename)}"
+            return StreamingResponse(
+                follow(
+                    m4b_file_path,
+                    lambda: conversion_service.is_conversion_active(filename, "m4b"),
+                ),
+                media_type="audio/mp4",
+                headers={"Content-Disposition": disposition},
+            )
+
+        storage_manager.touch(m4b_file_path)
         return FileResponse(
             path=m4b_file_path, filename=m4b_filename, media_type="audio/mp4"
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error downloading file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _streamable_book(filename: str):
+    book = ingest_pipeline.current_book(os.path.join("uploads", filename))
+    if book is None or book.ingest_status != "ready":
+        raise HTTPException(status_code=404, detail="Book not found or not ingested")
+    return book
+
+
+@app.get("/stream/{filename}/chapter/{number}")
+def stream_chapter(filename: str, number: int):
+    """
+    Play one chapter without converting the book.
+
+    The chapter is remuxed on first play and cached; Range requests are
+    answered from the cached file, so players can seek.
+    """
+    book = _streamable_book(filename)
+    try:
+        path = chapter_stream_cache.chapter_path(book, number)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(path, media_type="audio/mp4")
+
+
+@app.get("/hls/{filename}/index.m3u8")
+def hls_playlist(filename: str):
+    """
+    HLS playlist of a whole book, built from its chapters without touching
+    the audio; segments are remuxed as they are requested.
+    """
+    book = _streamable_book(filename)
+    return Response(
+        chapter_stream_cache.playlist(book),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/hls/{filename}/{number}.ts")
+def hls_segment(filename: str, number: int):
+    book = _streamable_book(filename)
+    try:
+        path = chapter_stream_cache.segment_path(book, number)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    # Segment URLs carry the book's mtime, so a segment never changes
+    return FileResponse(
+        path,
+        media_type="video/mp2t",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
 @app.post("/upload/file/aax")
 def upload_file_aax(request: Request, file: UploadFile = File(...)):
     file_path = os.path.join("uploads", file.filename)
     with open(file_path, "wb") as f:
         f.write(file.file.read())
 
-    # Extract metadata using activation bytes
-    processor = AAXProcessor()
-    result = processor.get_activation_bytes(file_path)
-
-    extractor = AudiobookMetadataExtractor(file_path)
-    extractor.get_complete_metadata_using_activation_bytes(result["activation_bytes"])
-
-    metadata = extractor.get_complete_metadata()
-    # return templates.TemplateResponse(
-    #     # "index.html", {"request": request, "metadata": metadata}
-    # )
-    # return metadata
+    # Checksum, activation bytes, metadata and cover are computed by an
+    # ingest job, so the upload returns as soon as the file is written
+    request_ingest(file_path)
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/convert/mp3/{filename}")
-def start_mp3_conversion(filename: str):
-    """Start AAX to MP3 chapters conversion in background"""
+def start_mp3_conversion(request: Request, filename: str, user: str | None = None):
+    """
+    Start AAX to MP3 chapters conversion in background
+
+    Chapter encodes are shared fairly between users, identified by the
+    optional user parameter or else the client address.
+    """
     try:
         # Validate filename
         if not filename.endswith(".aax"):
@@ -255,48 +642,47 @@ def start_mp3_conversion(filename: str):
         if not os.path.exists(aax_file_path):
             raise HTTPException(status_code=404, detail="AAX file not found")
 
-        # Create output directory for zip file
-        output_dir = "uploads"
-
-        # Get activation bytes
-        processor = AAXProcessor()
-        result = processor.get_activation_bytes(aax_file_path)
-
-        if "error" in result:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Could not get activation bytes: {result['error']}",
+        zip_file_path = output_path(filename, "mp3_chapters")
+        if output_cache.reuse(
+            aax_file_path, "mp3_chapters", zip_file_path
+        ) or output_cache.is_up_to_date(aax_file_path, "mp3_chapters", zip_file_path):
+            return JSONResponse(
+                {
+                    "status": "already_converted",
+                    "message": "File already converted",
+                    "download_url": f"/download/mp3/{filename}",
+                }
             )
 
-        activation_bytes = result["activation_bytes"]
-
-        # Start conversion tracking before queueing Celery task
-        if conversion_service.start_conversion(filename, "mp3_chapters"):
-            try:
-                task_result = convert_mp3_chapters_task.delay(
-                    filename, aax_file_path, output_dir, activation_bytes
-                )
-            except Exception as task_error:
-                mark_queue_failure(
-                    filename, "mp3_chapters", f"Queue error: {task_error}"
-                )
-                raise
+        _check_space(aax_file_path, "mp3_chapters")
 
+        # Claim the conversion before queueing so duplicates never reach Celery.
+        # The activation key is resolved by the job itself, not in this request.
+        task_id = enqueue_conversion(
+            filename,
+            "mp3_chapters",
+            owner=user or (request.client and request.client.host),
+        )
+        if task_id:
             return JSONResponse(
                 {
                     "status": "started",
                     "message": "MP3 chapters conversion started",
-                    "task_id": task_result.id,
+                    "task_id": task_id,
                 }
             )
         else:
+            active = conversion_service.get_progress(filename, "mp3_chapters")
             return JSONResponse(
                 {
                     "status": "in_progress",
                     "message": "MP3 conversion already in progress",
+                    "task_id": active.get("task_id"),
                 }
             )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting MP3 conversion: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -314,19 +700,25 @@ def download_mp3_zip(filename: str):
             filename, "mp3_chapters"
         )
 
-        if progress_data["status"] != "completed" or not progress_data.get(
-            "result_path"
+        if progress_data["status"] == "completed" and progress_data.get("result_path"):
+            zip_file_path = progress_data["result_path"]
+        elif output_cache.is_current(
+            os.path.join("uploads", filename),
+            "mp3_chapters",
+            output_path(filename, "mp3_chapters"),
         ):
+            # Reused from the output manifest, without a conversion record
+            zip_file_path = output_path(filename, "mp3_chapters")
+        else:
             raise HTTPException(
                 status_code=404, detail="MP3 conversion not completed or file not found"
             )
 
-        zip_file_path = progress_data["result_path"]
-
         if not os.path.exists(zip_file_path):
             raise HTTPException(status_code=404, detail="Converted zip file not found")
 
         zip_filename = os.path.basename(zip_file_path)
+        storage_manager.touch(zip_file_path)
 
         return FileResponse(
             path=zip_file_path, filename=zip_filename, media_type="application/zip"
@@ -1,2 +1,23 @@
-from .common import ActivationBytes, AudiobookMetadata, Chapter
-from .conversion import Conversion, ConversionTracker
+from .batch import (
+    PENDING_ITEM_STATES,
+    BatchItem,
+    BatchRequest,
+    BatchStore,
+    ConversionBatch,
+)
+from .common import ActivationBytes, AudiobookMetadata, BookSummary, Chapter
+from .conversion import (
+    ACTIVE_STATUSES,
+    HEARTBEAT_TIMEOUT_SECONDS,
+    Conversion,
+    ConversionTracker,
+)
+from .database import dispose_engines, get_engine
+from .library import (
+    LIBRARY_SORTS,
+    PENDING_INGEST_STATUSES,
+    Book,
+    LibraryStore,
+    index_fields,
+)
+from .outputs import ConversionOutput, OutputManifest
@@ -0,0 +1,116 @@
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import update
+from sqlmodel import Field, Session, SQLModel, select
+
+from config import logger
+
+from .database import DEFAULT_DB_PATH, add_missing_columns, get_engine
+
+# Item states that still need a worker; the rest are final
+PENDING_ITEM_STATES = ["pending", "queued"]
+
+
+class BatchRequest(BaseModel):
+    """Body of POST /batches: pick books by name, by glob, or everything not converted"""
+
+    filenames: Optional[List[str]] = None
+    glob: Optional[str] = None
+    all_unconverted: bool = False
+    formats: List[str] = ["m4b"]
+    concurrency: Optional[int] = None
+
+
+class ConversionBatch(SQLModel, table=True):
+    """A group of conversions requested together"""
+
+    __tablename__ = "conversion_batches"
+
+    id: str = Field(primary_key=True)
+    # "resolving_keys", "running", "completed" or "cancelled"
+    status: str = Field(default="resolving_keys", index=True)
+    formats: str  # Comma separated conversion types
+    concurrency: int = Field(default=4)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = Field(default=None)
+
+
+class BatchItem(SQLModel, table=True):
+    """One book and format within a batch"""
+
+    __tablename__ = "conversion_batch_items"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    batch_id: str = Field(index=True, foreign_key="conversion_batches.id")
+    filename: str
+    conversion_type: str = Field(default="m4b")
+    # pending -> queued -> completed/error/cancelled, or skipped when up to date
+    state: str = Field(default="pending", index=True)
+    task_id: Optional[str] = Field(default=None)
+    error_message: Optional[str] = Field(default=None)
+    queued_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+
+
+class BatchStore:
+    """Persistence for batches and their items"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.engine = get_engine(db_path)
+        self.lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """Initialize the batch tables"""
+        tables = [ConversionBatch.__table__, BatchItem.__table__]
+        SQLModel.metadata.create_all(self.engine, tables=tables)
+        for table in tables:
+            add_missing_columns(self.engine, table)
+
+    def create_batch(self, batch: ConversionBatch, items: List[BatchItem]):
+        """Store a new batch with all its items in one transaction"""
+        with Session(self.engine) as session:
+            session.add(batch)
+            # No ORM relationship orders the inserts, so the parent goes first
+            session.flush()
+            session.add_all(items)
+            session.commit()
+            logger.info(f"Created batch {batch.id} with {len(items)} items")
+
+    def get_batch(self, batch_id: str) -> Optional[ConversionBatch]:
+        with Session(self.engine) as session:
+            return session.get(ConversionBatch, batch_id)
+
+    def get_items(
+        self, batch_id: str, states: Optional[List[str]] = None
+    ) -> List[BatchItem]:
+        """Items of a batch in creation order, optionally only in some states"""
+        with Session(self.engine) as session:
+            query = select(BatchItem).where(BatchItem.batch_id == batch_id)
+            if states is not None:
+                query = query.where(BatchItem.state.in_(states))
+            return list(session.exec(query.order_by(BatchItem.id)).all())
+
+    def update_item(self, item_id: int, **values):
+        """Update one item's state and bookkeeping columns"""
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(BatchItem).where(BatchItem.id == item_id).values(**values)
+            )
+
+    def set_status(self, batch_id: str, status: str):
+        """Move a batch to a new status, stamping finished_at for final ones"""
+        now = datetime.utcnow()
+        values: Dict = {"status": status, "updated_at": now}
+        if status in ("completed", "cancelled"):
+            values["finished_at"] = now
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(ConversionBatch)
+                .where(ConversionBatch.id == batch_id)
+                .values(**values)
+            )
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import NamedTuple, Optional
 
 from pydantic import BaseModel
 
@@ -28,6 +28,26 @@ class AudiobookMetadata(BaseModel):
     raw_metadata: Optional[dict] = None
 
 
+class BookSummary(NamedTuple):
+    """
+    What the library list shows for one book.
+
+    A plain tuple rather than a model: a page holds many of them, and none
+    carries chapters, the cover or the raw ffprobe output, which only the
+    detail page loads.
+    """
+
+    filename: str
+    title: Optional[str]
+    author: Optional[str]
+    duration_formatted: Optional[str]
+    size_formatted: Optional[str]
+    bitrate_formatted: Optional[str]
+    chapter_count: Optional[int]
+    cover_url: Optional[str]
+    ingest_status: str
+
+
 class ActivationBytes(BaseModel):
     checksum: Optional[str] = None
     activation_bytes: Optional[str] = None
@@ -1,11 +1,31 @@
+import os
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional
 
-from sqlmodel import Field, Session, SQLModel, UniqueConstraint, create_engine, select
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Field, Session, SQLModel, UniqueConstraint, select
 
 from config import logger
 
+from .database import DEFAULT_DB_PATH, add_missing_columns, get_engine
+
+# Phases of a running job, in order: queued, finding the activation key,
+# reading duration/chapters, waiting for free disk space, running ffmpeg, and
+# zipping the MP3 chapters
+ACTIVE_STATUSES = [
+    "starting",
+    "resolving_key",
+    "probing",
+    "waiting_for_space",
+    "converting",
+    "packaging",
+]
+
+# A conversion whose workers stop heartbeating for this long is considered dead
+HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("HEARTBEAT_TIMEOUT_SECONDS", "90"))
+
 
 class Conversion(SQLModel, table=True):
     """SQLModel table for tracking conversion progress"""
@@ -25,63 +45,164 @@ class Conversion(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     completed_at: Optional[datetime] = Field(default=None)
     result_path: Optional[str] = Field(default=None)  # Path to converted file or zip
+    task_id: Optional[str] = Field(default=None)  # Celery task that owns the job
+    attempts: int = Field(default=1)  # Incremented when a dead job is requeued
+    # Liveness, reported by the workers currently running part of the job
+    heartbeat_at: Optional[datetime] = Field(default=None)
+    worker_id: Optional[str] = Field(default=None)
+    worker_task_id: Optional[str] = Field(default=None)
+    ffmpeg_pid: Optional[int] = Field(default=None)
+    active_leases: int = Field(default=0)  # Number of workers running job steps
+    # Where the job's workers keep scratch files and how many subtasks it fanned out
+    work_dir: Optional[str] = Field(default=None)
+    subtask_count: int = Field(default=0)
+
+
+# Prepared statements, compiled once and reused for every call.
+# The upsert is keyed on the unique_filename_type constraint so starting a
+# conversion is a single round trip instead of a select followed by a write.
+_start_conversion_stmt = sqlite_insert(Conversion).values(
+    filename=bindparam("b_filename"),
+    conversion_type=bindparam("b_conversion_type"),
+    status="starting",
+    progress=0.0,
+    started_at=bindparam("b_now"),
+    updated_at=bindparam("b_now"),
+)
+_start_conversion_stmt = _start_conversion_stmt.on_conflict_do_update(
+    index_elements=[Conversion.filename, Conversion.conversion_type],
+    set_={
+        "status": "starting",
+        "progress": 0.0,
+        "started_at": _start_conversion_stmt.excluded.started_at,
+        "updated_at": _start_conversion_stmt.excluded.updated_at,
+        "error_message": None,
+        "completed_at": None,
+        "result_path": None,
+        "task_id": None,
+        "attempts": 1,
+        "heartbeat_at": None,
+        "worker_id": None,
+        "worker_task_id": None,
+        "ffmpeg_pid": None,
+        "active_leases": 0,
+        "work_dir": None,
+        "subtask_count": 0,
+    },
+)
+
+# Compare-and-set variant: the conflicting row is only overwritten when its
+# job is no longer active, so exactly one concurrent caller wins the claim.
+_claim_conversion_stmt = sqlite_insert(Conversion).values(
+    filename=bindparam("b_filename"),
+    conversion_type=bindparam("b_conversion_type"),
+    status="starting",
+    progress=0.0,
+    started_at=bindparam("b_now"),
+    updated_at=bindparam("b_now"),
+    task_id=bindparam("b_task_id"),
+    attempts=bindparam("b_attempts"),
+    active_leases=0,
+)
+_claim_conversion_stmt = _claim_conversion_stmt.on_conflict_do_update(
+    index_elements=[Conversion.filename, Conversion.conversion_type],
+    set_={
+        "status": "starting",
+        "progress": 0.0,
+        "started_at": _claim_conversion_stmt.excluded.started_at,
+        "updated_at": _claim_conversion_stmt.excluded.updated_at,
+        "error_message": None,
+        "completed_at": None,
+        "result_path": None,
+        "task_id": _claim_conversion_stmt.excluded.task_id,
+        "attempts": _claim_conversion_stmt.excluded.attempts,
+        "heartbeat_at": None,
+        "worker_id": None,
+        "worker_task_id": None,
+        "ffmpeg_pid": None,
+        "active_leases": 0,
+        "work_dir": None,
+        "subtask_count": 0,
+    },
+    where=Conversion.status.not_in(ACTIVE_STATUSES),
+)
+
+_update_progress_stmt = (
+    update(Conversion)
+    .where(
+        Conversion.filename == bindparam("b_filename"),
+        Conversion.conversion_type == bindparam("b_conversion_type"),
+        Conversion.status.in_(ACTIVE_STATUSES),
+    )
+    .values(
+        progress=bindparam("b_progress"),
+        status=bindparam("b_status"),
+        updated_at=bindparam("b_now"),
+    )
+)
 
 
 class ConversionTracker:
-    def __init__(self, db_path="sqlite:///sqlite.db"):
-        self.engine = create_engine(db_path)
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.engine = get_engine(db_path)
         self.lock = threading.Lock()
         self.init_database()
 
     def init_database(self):
         """Initialize the database with required tables"""
-        # Check if the table already exists with the correct schema
-        try:
-            with Session(self.engine) as session:
-                # Try to query the table to see if it exists
-                session.exec(select(Conversion).limit(1))
-                logger.info("Database table already exists, skipping creation")
-        except Exception:
-            # Table doesn't exist or has wrong schema, create it
-            SQLModel.metadata.create_all(self.engine)
-            logger.info("Database initialized successfully")
+        # create_all only creates missing tables; new columns are added separately
+        SQLModel.metadata.create_all(self.engine, tables=[Conversion.__table__])
+        add_missing_columns(self.engine, Conversion.__table__)
+        logger.info("Database initialized successfully")
 
     def start_conversion(self, filename: str, conversion_type: str = "m4b"):
         """Mark conversion as started"""
-        with self.lock:
-            with Session(self.engine) as session:
-                # Check if conversion already exists for this type
-                conversion_id = f"{filename}_{conversion_type}"
-                existing = session.exec(
-                    select(Conversion).where(
-                        Conversion.filename == filename,
-                        Conversion.conversion_type == conversion_type,
-                    )
-                ).first()
-
-                if existing:
-                    # Update existing record
-                    existing.status = "starting"
-                    existing.progress = 0.0
-                    existing.started_at = datetime.utcnow()
-                    existing.updated_at = datetime.utcnow()
-                    existing.error_message = None
-                    existing.completed_at = None
-                    existing.result_path = None
-                else:
-                    # Create new record
-                    conversion = Conversion(
-                        filename=filename,
-                        conversion_type=conversion_type,
-                        status="starting",
-                        progress=0.0,
-                    )
-                    session.add(conversion)
-
-                session.commit()
-                logger.info(
-                    f"Started tracking {conversion_type} conversion for {filename}"
-                )
+        with Session(self.engine) as session:
+            session.execute(
+                _start_conversion_stmt,
+                {
+                    "b_filename": filename,
+                    "b_conversion_type": conversion_type,
+                    "b_now": datetime.utcnow(),
+                },
+            )
+            session.commit()
+            logger.info(f"Started tracking {conversion_type} conversion for {filename}")
+
+    def claim_conversion(
+        self,
+        filename: str,
+        conversion_type: str = "m4b",
+        task_id: Optional[str] = None,
+        attempt: int = 1,
+    ) -> bool:
+        """
+        Atomically start a conversion unless one is already active.
+
+        The decision is made by a single conditional upsert, so it holds across
+        threads, uvicorn workers and Celery processes without any lock.
+
+        Returns:
+            bool: True if the caller won the claim, False if a job is active
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                _claim_conversion_stmt,
+                {
+                    "b_filename": filename,
+                    "b_conversion_type": conversion_type,
+                    "b_now": datetime.utcnow(),
+                    "b_task_id": task_id,
+                    "b_attempts": attempt,
+                },
+            )
+
+        claimed = result.rowcount > 0
+        if claimed:
+            logger.info(
+                f"Claimed {conversion_type} conversion for {filename} (task {task_id})"
+            )
+        return claimed
 
     def update_progress(
         self,
@@ -89,22 +210,25 @@ class ConversionTracker:
         progress: float,
         status: str = "converting",
         conversion_type: str = "m4b",
-    ):
-        """Update conversion progress"""
-        with self.lock:
-            with Session(self.engine) as session:
-                conversion = session.exec(
-                    select(Conversion).where(
-                        Conversion.filename == filename,
-                        Conversion.conversion_type == conversion_type,
-                    )
-                ).first()
-
-                if conversion:
-                    conversion.progress = progress
-                    conversion.status = status
-                    conversion.updated_at = datetime.utcnow()
-                    session.commit()
+    ) -> bool:
+        """
+        Update conversion progress.
+
+        Returns:
+            bool: False if the conversion is no longer active, e.g. cancelled
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                _update_progress_stmt,
+                {
+                    "b_filename": filename,
+                    "b_conversion_type": conversion_type,
+                    "b_progress": progress,
+                    "b_status": status,
+                    "b_now": datetime.utcnow(),
+                },
+            )
+        return result.rowcount > 0
 
     def complete_conversion(
         self,
@@ -113,32 +237,84 @@ class ConversionTracker:
         error_message: Optional[str] = None,
         result_path: Optional[str] = None,
         conversion_type: str = "m4b",
-    ):
-        """Mark conversion as completed or failed"""
-        with self.lock:
-            with Session(self.engine) as session:
-                conversion = session.exec(
-                    select(Conversion).where(
-                        Conversion.filename == filename,
-                        Conversion.conversion_type == conversion_type,
-                    )
-                ).first()
-
-                if conversion:
-                    if success:
-                        conversion.status = "completed"
-                        conversion.progress = 100.0
-                        conversion.completed_at = datetime.utcnow()
-                        conversion.result_path = result_path
-                    else:
-                        conversion.status = "error"
-                        conversion.error_message = error_message
-
-                    conversion.updated_at = datetime.utcnow()
-                    session.commit()
-                    logger.info(
-                        f"{conversion_type} conversion completed for {filename}: {'success' if success else 'failed'}"
-                    )
+    ) -> bool:
+        """
+        Mark conversion as completed or failed.
+
+        Only active conversions are finished, so a worker that outlives a
+        cancel or a reap cannot overwrite the final status.
+
+        Returns:
+            bool: True if the conversion was active and is now finished
+        """
+        now = datetime.utcnow()
+        if success:
+            values = dict(
+                status="completed",
+                progress=100.0,
+                completed_at=now,
+                result_path=result_path,
+            )
+        else:
+            values = dict(status="error", error_message=error_message)
+
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(Conversion)
+                .where(
+                    Conversion.filename == filename,
+                    Conversion.conversion_type == conversion_type,
+                    Conversion.status.in_(ACTIVE_STATUSES),
+                )
+                .values(updated_at=now, **values)
+            )
+
+        if not result.rowcount:
+            return False
+        logger.info(
+            f"{conversion_type} conversion completed for {filename}: {'success' if success else 'failed'}"
+        )
+        return True
+
+    def save_conversion(self, record: dict):
+        """Upsert a complete conversion record, e.g. one finished in another store"""
+
+        def parse(value):
+            return datetime.fromisoformat(value) if value else None
+
+        values = {
+            "filename": record["filename"],
+            "conversion_type": record["conversion_type"],
+            "status": record["status"],
+            "progress": float(record.get("progress", 0.0)),
+            "error_message": record.get("error"),
+            "started_at": parse(record.get("started_at")) or datetime.utcnow(),
+            "updated_at": parse(record.get("updated_at")) or datetime.utcnow(),
+            "completed_at": parse(record.get("completed_at")),
+            "result_path": record.get("result_path"),
+            "task_id": record.get("task_id"),
+            "attempts": int(record.get("attempts", 1)),
+            "heartbeat_at": parse(record.get("heartbeat_at")),
+            "worker_id": record.get("worker_id"),
+            "worker_task_id": record.get("worker_task_id"),
+            "ffmpeg_pid": (
+                int(record["ffmpeg_pid"]) if record.get("ffmpeg_pid") else None
+            ),
+            "active_leases": int(record.get("active_leases", 0)),
+            "work_dir": record.get("work_dir"),
+            "subtask_count": int(record.get("subtask_count", 0)),
+        }
+        stmt = sqlite_insert(Conversion).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Conversion.filename, Conversion.conversion_type],
+            set_={
+                key: value
+                for key, value in values.items()
+                if key not in ("filename", "conversion_type")
+            },
+        )
+        with self.engine.begin() as connection:
+            connection.execute(stmt)
 
     def get_progress(self, filename: str, conversion_type: str = "m4b") -> dict:
         """Get current progress for a file"""
@@ -164,6 +340,15 @@ class ConversionTracker:
                     result["completed_at"] = conversion.completed_at.isoformat()
                 if conversion.result_path:
                     result["result_path"] = conversion.result_path
+                if conversion.work_dir:
+                    result["work_dir"] = conversion.work_dir
+                if conversion.task_id:
+                    result["task_id"] = conversion.task_id
+                if conversion.attempts > 1:
+                    result["attempts"] = conversion.attempts
+                if conversion.heartbeat_at:
+                    result["heartbeat_at"] = conversion.heartbeat_at.isoformat()
+                    result["worker_id"] = conversion.worker_id
                 return result
             else:
                 return {
@@ -175,7 +360,7 @@ class ConversionTracker:
     def is_conversion_active(self, filename: str, conversion_type: str = "m4b") -> bool:
         """Check if conversion is currently active"""
         progress_data = self.get_progress(filename, conversion_type)
-        return progress_data["status"] in ["starting", "converting"]
+        return progress_data["status"] in ACTIVE_STATUSES
 
     def cleanup_old_records(self, days: int = 7):
         """Clean up old conversion records"""
@@ -202,13 +387,14 @@ class ConversionTracker:
         with Session(self.engine) as session:
             active_conversions = session.exec(
                 select(Conversion)
-                .where(Conversion.status.in_(["starting", "converting"]))
+                .where(Conversion.status.in_(ACTIVE_STATUSES))
                 .order_by(Conversion.started_at.desc())
             ).all()
 
             return [
                 {
                     "filename": conversion.filename,
+                    "conversion_type": conversion.conversion_type,
                     "status": conversion.status,
                     "progress": conversion.progress,
                     "started_at": conversion.started_at.isoformat(),
@@ -216,31 +402,159 @@ class ConversionTracker:
                 for conversion in active_conversions
             ]
 
-    def reset_stuck_conversions(self):
-        """Reset conversions that were interrupted during server shutdown"""
-        from datetime import timedelta
+    def record_heartbeat(
+        self,
+        filename: str,
+        conversion_type: str,
+        worker_id: str,
+        worker_task_id: Optional[str] = None,
+        ffmpeg_pid: Optional[int] = None,
+        lease_delta: int = 0,
+    ):
+        """
+        Record that a worker is still running part of an active conversion.
+
+        lease_delta is +1 when a worker starts a step of the job and -1 when it
+        finishes, so a job with no leases is queued rather than dead.
+        """
+        now = datetime.utcnow()
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Conversion)
+                .where(
+                    Conversion.filename == filename,
+                    Conversion.conversion_type == conversion_type,
+                    Conversion.status.in_(ACTIVE_STATUSES),
+                )
+                .values(
+                    heartbeat_at=now,
+                    worker_id=worker_id,
+                    worker_task_id=worker_task_id,
+                    ffmpeg_pid=ffmpeg_pid,
+                    active_leases=func.max(Conversion.active_leases + lease_delta, 0),
+                )
+            )
+
+    def record_subtasks(
+        self,
+        filename: str,
+        conversion_type: str,
+        work_dir: Optional[str],
+        subtask_count: int,
+    ):
+        """Remember the scratch directory and fan-out of an active conversion"""
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Conversion)
+                .where(
+                    Conversion.filename == filename,
+                    Conversion.conversion_type == conversion_type,
+                    Conversion.status.in_(ACTIVE_STATUSES),
+                )
+                .values(work_dir=work_dir, subtask_count=subtask_count)
+            )
+
+    def cancel_conversion(
+        self, filename: str, conversion_type: str = "m4b"
+    ) -> Optional[dict]:
+        """
+        Mark an active conversion as cancelled.
+
+        Returns:
+            dict: What is needed to stop the job's workers (task ids, scratch
+            directory, last ffmpeg PID), or None if it was not active
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(Conversion)
+                .where(
+                    Conversion.filename == filename,
+                    Conversion.conversion_type == conversion_type,
+                    Conversion.status.in_(ACTIVE_STATUSES),
+                )
+                .values(
+                    status="cancelled",
+                    error_message="Cancelled",
+                    updated_at=datetime.utcnow(),
+                    active_leases=0,
+                )
+            )
+            if not result.rowcount:
+                return None
 
-        # Find conversions that have been 'starting' or 'converting' for too long
-        stale_threshold = datetime.utcnow() - timedelta(minutes=5)
+            conversion = connection.execute(
+                select(Conversion).where(
+                    Conversion.filename == filename,
+                    Conversion.conversion_type == conversion_type,
+                )
+            ).first()
 
-        with self.lock:
-            with Session(self.engine) as session:
-                stuck_conversions = session.exec(
-                    select(Conversion).where(
-                        Conversion.status.in_(["starting", "converting"]),
-                        Conversion.updated_at < stale_threshold,
+        logger.info(f"Cancelled {conversion_type} conversion for {filename}")
+        return {
+            "filename": conversion.filename,
+            "conversion_type": conversion.conversion_type,
+            "task_id": conversion.task_id,
+            "work_dir": conversion.work_dir,
+            "subtask_count": conversion.subtask_count,
+            "worker_id": conversion.worker_id,
+            "ffmpeg_pid": conversion.ffmpeg_pid,
+        }
+
+    def reap_expired_conversions(
+        self,
+        expired_before: datetime,
+        error_message: str = "Worker lost: heartbeat expired",
+    ) -> List[dict]:
+        """
+        Mark active conversions whose leased workers stopped heartbeating as dead.
+
+        Each job is re-checked in its own conditional UPDATE, so a heartbeat
+        arriving between the scan and the write keeps the job alive.
+
+        Returns:
+            list: The reaped conversions, for logging and requeueing
+        """
+        expired = (
+            Conversion.status.in_(ACTIVE_STATUSES),
+            Conversion.active_leases > 0,
+            Conversion.heartbeat_at < expired_before,
+        )
+        with Session(self.engine) as session:
+            candidates = session.exec(select(Conversion).where(*expired)).all()
+
+        reaped = []
+        for conversion in candidates:
+            with self.engine.begin() as connection:
+                result = connection.execute(
+                    update(Conversion)
+                    .where(Conversion.id == conversion.id, *expired)
+                    .values(
+                        status="error",
+                        error_message=error_message,
+                        updated_at=datetime.utcnow(),
+                        active_leases=0,
                     )
-                ).all()
+                )
+            if result.rowcount:
+                reaped.append(
+                    {
+                        "filename": conversion.filename,
+                        "conversion_type": conversion.conversion_type,
+                        "task_id": conversion.task_id,
+                        "attempts": conversion.attempts,
+                        "worker_id": conversion.worker_id,
+                        "worker_task_id": conversion.worker_task_id,
+                        "ffmpeg_pid": conversion.ffmpeg_pid,
+                        "work_dir": conversion.work_dir,
+                    }
+                )
 
-                reset_count = 0
-                for conversion in stuck_conversions:
-                    conversion.status = "error"
-                    conversion.error_message = (
-                        "Conversion interrupted - server restarted"
-                    )
-                    conversion.updated_at = datetime.utcnow()
-                    reset_count += 1
+        if reaped:
+            logger.info(f"Reaped {len(reaped)} conversions with expired heartbeats")
+        return reaped
 
-                session.commit()
-                if reset_count > 0:
-                    logger.info(f"Reset {reset_count} stuck conversions")
+    def reset_stuck_conversions(self):
+        """Fail conversions whose workers stopped heartbeating"""
+        self.reap_expired_conversions(
+            datetime.utcnow() - timedelta(seconds=HEARTBEAT_TIMEOUT_SECONDS)
+        )
@@ -0,0 +1,116 @@
+import os
+import threading
+from typing import Dict, List
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlmodel import create_engine
+
+from config import logger
+
+DEFAULT_DB_PATH = os.getenv("DATABASE_URL", "sqlite:///sqlite.db")
+
+# SQLite tuning, overridable per deployment
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "10"))
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configure every new SQLite connection for concurrent multi-process use"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def get_engine(db_path: str = DEFAULT_DB_PATH) -> Engine:
+    """
+    Get the shared engine for a database URL.
+
+    Engines are cached per URL so every tracker or index in a process shares
+    one connection pool. SQLite connections are opened in WAL mode with a busy
+    timeout, so readers never block the writer and concurrent writers from the
+    web process and the Celery workers wait for the lock instead of failing
+    with "database is locked".
+    """
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is not None:
+            return engine
+
+        if db_path.startswith("sqlite"):
+            engine = create_engine(
+                db_path,
+                connect_args={
+                    "check_same_thread": False,
+                    "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+                },
+                pool_size=SQLITE_POOL_SIZE,
+                max_overflow=SQLITE_MAX_OVERFLOW,
+                pool_pre_ping=True,
+            )
+            event.listen(engine, "connect", _apply_sqlite_pragmas)
+            logger.info(
+                f"SQLite engine ready for {db_path} "
+                f"(journal={SQLITE_JOURNAL_MODE}, synchronous={SQLITE_SYNCHRONOUS}, "
+                f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}ms, pool={SQLITE_POOL_SIZE})"
+            )
+        else:
+            engine = create_engine(db_path, pool_pre_ping=True)
+
+        _engines[db_path] = engine
+        return engine
+
+
+def dispose_engines():
+    """Dispose all pooled connections, e.g. after forking a worker process"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=False)
+
+
+def add_missing_columns(engine: Engine, table) -> List[str]:
+    """
+    Add columns and indexes that exist on the model but not yet in the database.
+
+    create_all() never alters existing tables, so databases created by an
+    older release would otherwise fail on every query touching a new column.
+    Only nullable or scalar-defaulted columns are expected to be added this
+    way; scalar defaults become the DEFAULT of the new column. Indexes are
+    created afterwards, since they may cover the columns just added.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" '
+            ddl += column.type.compile(dialect=engine.dialect)
+            if column.default is not None and column.default.is_scalar:
+                ddl += f" DEFAULT {column.default.arg!r}"
+            connection.execute(text(ddl))
+            added.append(column.name)
+
+    if added:
+        logger.info(f"Added columns {added} to {table.name}")
+
+    existing_indexes = {
+        index["name"] for index in inspect(engine).get_indexes(table.name)
+    }
+    for index in table.indexes:
+        if index.name not in existing_indexes:
+            index.create(engine)
+            logger.info(f"Created index {index.name} on {table.name}")
+    return added
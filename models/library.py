@@ -0,0 +1,651 @@
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Index, bindparam, delete, func, or_, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import defer
+from sqlmodel import Field, Session, SQLModel, select
+
+from config import logger
+
+from .database import DEFAULT_DB_PATH, add_missing_columns, get_engine
+
+# Ingest states that still need work; "ready" and "error" are final until
+# the file changes on disk
+PENDING_INGEST_STATUSES = ["pending", "ingesting"]
+
+
+class Book(SQLModel, table=True):
+    """An AAX file in a watched directory and what ingesting it produced"""
+
+    __tablename__ = "books"
+    # One index per library sort order, so a page of a large library is read
+    # straight off an index instead of sorting every row of the directory
+    __table_args__ = (
+        Index("ix_books_directory_sort_title", "directory", "sort_title"),
+        Index("ix_books_directory_author", "directory", "author"),
+        Index("ix_books_directory_duration", "directory", "duration"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(unique=True)
+    filename: str = Field(index=True)
+    # File identity: a change of either means the file has to be ingested again
+    size: int
+    mtime: float
+    # "pending", "ingesting", "ready" or "error"
+    ingest_status: str = Field(default="pending", index=True)
+    ingest_error: Optional[str] = Field(default=None)
+    checksum: Optional[str] = Field(default=None, index=True)
+    activation_bytes: Optional[str] = Field(default=None)
+    probe_json: Optional[str] = Field(default=None)  # Decrypted ffprobe output
+    cover_path: Optional[str] = Field(default=None)
+    # Library index: the columns listed, sorted and filtered on without
+    # touching probe_json. sort_title is the lowercased title, or the
+    # filename until the book is ingested.
+    directory: Optional[str] = Field(default=None, index=True)
+    sort_title: Optional[str] = Field(default=None)
+    title: Optional[str] = Field(default=None)
+    author: Optional[str] = Field(default=None)
+    duration: Optional[float] = Field(default=None)
+    bitrate: Optional[int] = Field(default=None)
+    chapter_count: Optional[int] = Field(default=None)
+    # Up-to-date conversion outputs found next to the file
+    m4b_path: Optional[str] = Field(default=None)
+    mp3_chapters_path: Optional[str] = Field(default=None)
+    ingested_at: Optional[datetime] = Field(default=None)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# Library sort orders -> column
+LIBRARY_SORTS = {
+    "title": Book.sort_title,
+    "author": Book.author,
+    "duration": Book.duration,
+    "added": Book.id,
+}
+
+
+def index_fields(filename: str, probe: Dict[str, Any]) -> Dict[str, Any]:
+    """Library index columns for a book, from its decrypted ffprobe output"""
+    format_info = probe.get("format", {})
+    tags = format_info.get("tags", {})
+    title = tags.get("title")
+    try:
+        duration = float(format_info["duration"])
+    except (KeyError, TypeError, ValueError):
+        duration = None
+    try:
+        bitrate = int(format_info["bit_rate"])
+    except (KeyError, TypeError, ValueError):
+        bitrate = None
+    return {
+        "title": title,
+        "sort_title": (title or filename).lower(),
+        "author": tags.get("artist"),
+        "duration": duration,
+        "bitrate": bitrate,
+        "chapter_count": len(probe.get("chapters", [])),
+    }
+
+
+# Full-text search over the metadata shown on the detail page, one row per
+# book with the book's id as rowid. The prefix indexes make "tolk*" style
+# queries as fast as whole words.
+SEARCH_COLUMNS = (
+    "title",
+    "author",
+    "narrator",
+    "publisher",
+    "description",
+    "genre",
+    "chapters",
+)
+# bm25 weight of each column, in SEARCH_COLUMNS order: a title match ranks
+# above a match buried in a chapter name or the description
+SEARCH_WEIGHTS = (10.0, 6.0, 4.0, 2.0, 1.0, 2.0, 1.0)
+# Tags each column is read from, in order of preference. AAX files store the
+# author as artist and the narrator as composer.
+_SEARCH_TAGS = {
+    "title": ("title",),
+    "author": ("artist", "album_artist"),
+    "narrator": ("narrator", "composer"),
+    "publisher": ("publisher", "label"),
+    "description": ("description", "comment"),
+    "genre": ("genre",),
+}
+
+_create_search_table_stmt = text(
+    "CREATE VIRTUAL TABLE books_fts USING fts5("
+    f"{', '.join(SEARCH_COLUMNS)}, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+_insert_search_stmt = text(
+    f"INSERT INTO books_fts (rowid, {', '.join(SEARCH_COLUMNS)}) "
+    f"VALUES (:b_id, {', '.join(':' + column for column in SEARCH_COLUMNS)})"
+)
+_delete_search_stmt = text("DELETE FROM books_fts WHERE rowid = :b_id")
+# The match is materialized first: joined directly, SQLite walks the books of
+# the directory and runs the full-text query once per book
+_matches_cte = (
+    "WITH matches AS MATERIALIZED ("
+    "SELECT rowid AS book_id, "
+    f"bm25(books_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) AS rank "
+    "FROM books_fts WHERE books_fts MATCH :b_query) "
+)
+_search_stmt = text(
+    _matches_cte + "SELECT books.id, count(*) OVER () FROM matches "
+    "JOIN books ON books.id = matches.book_id WHERE books.directory = :b_directory ORDER BY matches.rank, books.id "
+    "LIMIT :b_limit OFFSET :b_offset"
+)
+_count_search_stmt = text(
+    _matches_cte
+    + "SELECT count(*) FROM matches JOIN books ON books.id = matches.book_id "
+    "WHERE books.directory = :b_directory"
+)
+
+_create_generation_table_stmt = text(
+    "CREATE TABLE IF NOT EXISTS library_generation ("
+    "id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)"
+)
+_init_generation_stmt = text(
+    "INSERT OR IGNORE INTO library_generation (id, generation) VALUES (1, 0)"
+)
+_generation_stmt = text("SELECT generation FROM library_generation WHERE id = 1")
+
+
+def search_document(probe: Dict[str, Any]) -> Dict[str, str]:
+    """The searchable text of a book, from its decrypted ffprobe output"""
+    tags = {
+        key.lower(): value
+        for key, value in probe.get("format", {}).get("tags", {}).items()
+    }
+    document = {
+        column: next((tags[tag] for tag in names if tags.get(tag)), "")
+        for column, names in _SEARCH_TAGS.items()
+    }
+    document["chapters"] = "\n".join(
+        chapter.get("tags", {}).get("title", "")
+        for chapter in probe.get("chapters", [])
+    )
+    return document
+
+
+def match_expression(query: str) -> Optional[str]:
+    """
+    An FTS5 query matching books that contain every word of query as a prefix.
+
+    Words are quoted, so FTS5 syntax typed by a user cannot cause an error.
+
+    Returns:
+        str: The expression, or None if query has no words
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Registering a file is one upsert keyed on its path. An existing row is
+# only reset to "pending" when the file's size or mtime changed, so
+# rescanning an unchanged library writes nothing.
+_register_file_stmt = sqlite_insert(Book).values(
+    path=bindparam("b_path"),
+    filename=bindparam("b_filename"),
+    directory=bindparam("b_directory"),
+    sort_title=bindparam("b_sort_title"),
+    size=bindparam("b_size"),
+    mtime=bindparam("b_mtime"),
+    ingest_status="pending",
+    updated_at=bindparam("b_now"),
+)
+_register_file_stmt = _register_file_stmt.on_conflict_do_update(
+    index_elements=[Book.path],
+    set_={
+        "size": _register_file_stmt.excluded.size,
+        "mtime": _register_file_stmt.excluded.mtime,
+        "ingest_status": "pending",
+        "ingest_error": None,
+        "updated_at": _register_file_stmt.excluded.updated_at,
+    },
+    where=or_(
+        Book.size != _register_file_stmt.excluded.size,
+        Book.mtime != _register_file_stmt.excluded.mtime,
+    ),
+)
+
+_claim_ingest_stmt = (
+    update(Book)
+    .where(Book.path == bindparam("b_path"), Book.ingest_status == "pending")
+    .values(ingest_status="ingesting", updated_at=bindparam("b_now"))
+)
+
+
+def _after_condition(column, descending: bool, value: Any, book_id: int):
+    """Books ordered after (value, book_id), where SQLite sorts NULLs lowest"""
+    if descending:
+        if value is None:
+            return (column.is_(None)) & (Book.id < book_id)
+        return or_(
+            column < value,
+            (column == value) & (Book.id < book_id),
+            column.is_(None),
+        )
+    if value is None:
+        return or_(column.is_(None) & (Book.id > book_id), column.is_not(None))
+    return or_(column > value, (column == value) & (Book.id > book_id))
+
+
+class LibraryStore:
+    """Persistence for the books found in the watched directories"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.engine = get_engine(db_path)
+        self.init_database()
+
+    def init_database(self):
+        """Initialize the books table"""
+        SQLModel.metadata.create_all(self.engine, tables=[Book.__table__])
+        added = add_missing_columns(self.engine, Book.__table__)
+        if {"directory", "bitrate"} & set(added):
+            self._backfill_index()
+        self.search_enabled = self._create_search_table()
+        self.generation_enabled = self._create_generation_counter()
+
+    def _create_generation_counter(self) -> bool:
+        """
+        Create the library generation counter if it does not exist yet.
+
+        Triggers bump it on every insert, update or delete of a book, in the
+        writer's transaction, so anything derived from the books table (API
+        responses, pages) can be versioned by one integer whichever process
+        wrote the change.
+
+        Returns:
+            bool: False on databases other than SQLite, which have no counter
+        """
+        if self.engine.dialect.name != "sqlite":
+            return False
+        with self.engine.begin() as connection:
+            connection.execute(_create_generation_table_stmt)
+            connection.execute(_init_generation_stmt)
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                connection.execute(
+                    text(
+                        f"CREATE TRIGGER IF NOT EXISTS books_generation_{event.lower()} "
+                        f"AFTER {event} ON books BEGIN "
+                        "UPDATE library_generation SET generation = generation + 1; "
+                        "END"
+                    )
+                )
+        return True
+
+    def generation(self) -> Optional[int]:
+        """The library generation, which changes whenever any book does"""
+        if not self.generation_enabled:
+            return None
+        with self.engine.connect() as connection:
+            return connection.execute(_generation_stmt).scalar_one()
+
+    def _create_search_table(self) -> bool:
+        """
+        Create and fill the full-text index if it does not exist yet.
+
+        Returns:
+            bool: False if the database has no FTS5, in which case search
+            falls back to matching titles and authors with LIKE
+        """
+        if self.engine.dialect.name != "sqlite":
+            return False
+        with self.engine.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'")
+            ).first()
+            if exists:
+                return True
+            try:
+                connection.execute(_create_search_table_stmt)
+            except OperationalError as e:
+                logger.warning(f"Full-text search unavailable: {e}")
+                return False
+            rows = connection.execute(
+                select(Book.id, Book.probe_json).where(Book.probe_json.is_not(None))
+            ).all()
+            for book_id, probe_json in rows:
+                connection.execute(
+                    _insert_search_stmt,
+                    {"b_id": book_id, **search_document(json.loads(probe_json))},
+                )
+        logger.info(f"Created the search index for {len(rows)} books")
+        return True
+
+    def _backfill_index(self):
+        """Fill the library index columns of books stored by an older release"""
+        with self.engine.begin() as connection:
+            rows = connection.execute(
+                select(Book.id, Book.path, Book.filename, Book.probe_json)
+            ).all()
+            for book_id, path, filename, probe_json in rows:
+                values = {
+                    "directory": os.path.dirname(path),
+                    "sort_title": filename.lower(),
+                }
+                if probe_json:
+                    values.update(index_fields(filename, json.loads(probe_json)))
+                connection.execute(
+                    update(Book).where(Book.id == book_id).values(**values)
+                )
+        logger.info(f"Indexed {len(rows)} existing books")
+
+    def register_file(self, path: str, filename: str, size: int, mtime: float) -> Book:
+        """Record a file's identity, queueing it for ingest if it is new or changed"""
+        with self.engine.begin() as connection:
+            connection.execute(
+                _register_file_stmt,
+                {
+                    "b_path": path,
+                    "b_filename": filename,
+                    "b_directory": os.path.dirname(path),
+                    "b_sort_title": filename.lower(),
+                    "b_size": size,
+                    "b_mtime": mtime,
+                    "b_now": datetime.utcnow(),
+                },
+            )
+        return self.get_book(path)
+
+    def register_files(self, files: List[Tuple[str, int, float]]) -> List[str]:
+        """
+        Record many files' identities in one transaction.
+
+        Args:
+            files: (absolute path, size, mtime) of each file
+
+        Returns:
+            list: Paths of the files that now need ingesting
+        """
+        if not files:
+            return []
+        now = datetime.utcnow()
+        with self.engine.begin() as connection:
+            connection.execute(
+                _register_file_stmt,
+                [
+                    {
+                        "b_path": path,
+                        "b_filename": os.path.basename(path),
+                        "b_directory": os.path.dirname(path),
+                        "b_sort_title": os.path.basename(path).lower(),
+                        "b_size": size,
+                        "b_mtime": mtime,
+                        "b_now": now,
+                    }
+                    for path, size, mtime in files
+                ],
+            )
+            # Filtered here rather than with an IN list, which could exceed
+            # SQLite's bound parameter limit for a large library
+            registered = {path for path, _, _ in files}
+            pending = connection.execute(
+                select(Book.path).where(
+                    Book.directory.in_({os.path.dirname(path) for path in registered}),
+                    Book.ingest_status == "pending",
+                )
+            ).scalars()
+            return [path for path in pending if path in registered]
+
+    def claim_ingest(self, path: str) -> bool:
+        """Move a pending book to "ingesting"; False if someone else has it"""
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                _claim_ingest_stmt, {"b_path": path, "b_now": datetime.utcnow()}
+            )
+            return result.rowcount > 0
+
+    def finish_ingest(self, path: str, **values) -> bool:
+        """
+        Store ingest results and mark the book ready.
+
+        Returns:
+            bool: False if the file changed while it was being ingested, in
+            which case it is pending again and the results are dropped
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(Book)
+                .where(Book.path == path, Book.ingest_status == "ingesting")
+                .values(
+                    ingest_status="ready",
+                    ingest_error=None,
+                    ingested_at=datetime.utcnow(),
+                    updated_at=datetime.utcnow(),
+                    **values,
+                )
+            )
+            if result.rowcount == 0:
+                return False
+            if self.search_enabled and values.get("probe_json"):
+                book_id = connection.execute(
+                    select(Book.id).where(Book.path == path)
+                ).scalar_one()
+                connection.execute(_delete_search_stmt, {"b_id": book_id})
+                connection.execute(
+                    _insert_search_stmt,
+                    {
+                        "b_id": book_id,
+                        **search_document(json.loads(values["probe_json"])),
+                    },
+                )
+            return True
+
+    def fail_ingest(self, path: str, error_message: str):
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Book)
+                .where(Book.path == path, Book.ingest_status == "ingesting")
+                .values(
+                    ingest_status="error",
+                    ingest_error=error_message,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+
+    def reset_interrupted(self, claimed_before: Optional[datetime] = None) -> List[str]:
+        """
+        Return books left "ingesting" by a stopped ingester to "pending".
+
+        Args:
+            claimed_before: Only books claimed before this, when ingesters
+                that are still running may hold the others
+
+        Returns:
+            list: Paths of the books that are pending again
+        """
+        condition = Book.ingest_status == "ingesting"
+        if claimed_before is not None:
+            condition = condition & (Book.updated_at < claimed_before)
+        with self.engine.begin() as connection:
+            paths = list(
+                connection.execute(select(Book.path).where(condition)).scalars()
+            )
+            if not paths:
+                return []
+            connection.execute(
+                update(Book)
+                .where(condition, Book.path.in_(paths))
+                .values(ingest_status="pending", updated_at=datetime.utcnow())
+            )
+        logger.info(f"Requeued {len(paths)} interrupted ingests")
+        return paths
+
+    def remove_file(self, path: str):
+        with self.engine.begin() as connection:
+            book_id = connection.execute(
+                select(Book.id).where(Book.path == path)
+            ).scalar()
+            if book_id is None:
+                return
+            if self.search_enabled:
+                connection.execute(_delete_search_stmt, {"b_id": book_id})
+            connection.execute(delete(Book).where(Book.id == book_id))
+
+    def get_book(self, path: str) -> Optional[Book]:
+        with Session(self.engine) as session:
+            return session.exec(select(Book).where(Book.path == path)).first()
+
+    def get_book_by_id(self, book_id: int) -> Optional[Book]:
+        with Session(self.engine) as session:
+            return session.get(Book, book_id)
+
+    def get_books(self, statuses: Optional[List[str]] = None) -> List[Book]:
+        """All books ordered by filename, optionally only in some ingest states"""
+        with Session(self.engine) as session:
+            query = select(Book)
+            if statuses is not None:
+                query = query.where(Book.ingest_status.in_(statuses))
+            return list(session.exec(query.order_by(Book.filename)).all())
+
+    def get_index_entries(
+        self, directory: str
+    ) -> Dict[str, Tuple[int, float, Optional[str], Optional[str]]]:
+        """
+        What reconciling a directory compares against, without loading probe_json.
+
+        Returns:
+            dict: Path -> (size, mtime, m4b_path, mp3_chapters_path)
+        """
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(
+                    Book.path,
+                    Book.size,
+                    Book.mtime,
+                    Book.m4b_path,
+                    Book.mp3_chapters_path,
+                ).where(Book.directory == directory)
+            ).all()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def set_outputs(
+        self, path: str, m4b_path: Optional[str], mp3_chapters_path: Optional[str]
+    ):
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Book)
+                .where(Book.path == path)
+                .values(m4b_path=m4b_path, mp3_chapters_path=mp3_chapters_path)
+            )
+
+    def list_books(
+        self,
+        directory: str,
+        sort: str = "title",
+        descending: bool = False,
+        limit: int = 50,
+        offset: int = 0,
+        after: Optional[Tuple[Any, int]] = None,
+    ) -> Tuple[List[Book], int]:
+        """
+        One page of a directory's books in a library sort order.
+
+        Listed books are loaded without probe_json, which only the detail
+        page needs; reading it from them raises DetachedInstanceError.
+
+        Args:
+            after: (sort value, id) of the last book of the previous page.
+                Pages read this way start with an index seek, so they cost
+                the same however deep into the library they are.
+
+        Returns:
+            tuple: (books on the page, books in the directory)
+        """
+        if sort not in LIBRARY_SORTS:
+            raise ValueError(
+                f"Unknown sort {sort!r}, expected one of {', '.join(LIBRARY_SORTS)}"
+            )
+        column = LIBRARY_SORTS[sort]
+        # Book.id breaks ties so pages never overlap
+        order_by = (column.desc(), Book.id.desc()) if descending else (column, Book.id)
+        conditions = [Book.directory == directory]
+        if after is not None:
+            conditions.append(_after_condition(column, descending, *after))
+        with Session(self.engine) as session:
+            total = session.exec(
+                select(func.count())
+                .select_from(Book)
+                .where(Book.directory == directory)
+            ).one()
+            books = session.exec(
+                select(Book)
+                .options(defer(Book.probe_json))
+                .where(*conditions)
+                .order_by(*order_by)
+                .limit(limit)
+                .offset(offset)
+            ).all()
+        return list(books), total
+
+    def search_books(
+        self, directory: str, query: str, limit: int = 50, offset: int = 0
+    ) -> Tuple[List[Book], int]:
+        """
+        One page of a directory's books matching a search, best match first.
+
+        Every word of query must start a word of the book's title, author,
+        narrator, publisher, description, genre or one of its chapter names.
+
+        Returns:
+            tuple: (books on the page, books matching)
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return [], 0
+        if not self.search_enabled:
+            return self._like_search_books(directory, query, limit, offset)
+
+        params = {"b_query": expression, "b_directory": directory}
+        with Session(self.engine) as session:
+            rows = session.execute(
+                _search_stmt, {**params, "b_limit": limit, "b_offset": offset}
+            ).all()
+            ids = [book_id for book_id, _ in rows]
+            if rows:
+                total = rows[0][1]
+            else:
+                # Past the last page the window count has no row to ride on
+                total = session.execute(_count_search_stmt, params).scalar_one()
+            books = {
+                book.id: book
+                for book in session.exec(
+                    select(Book).options(defer(Book.probe_json)).where(Book.id.in_(ids))
+                ).all()
+            }
+        return [books[book_id] for book_id in ids if book_id in books], total
+
+    def _like_search_books(
+        self, directory: str, query: str, limit: int, offset: int
+    ) -> Tuple[List[Book], int]:
+        """Title and author search for databases without FTS5"""
+        conditions = [Book.directory == directory]
+        for word in re.findall(r"\w+", query):
+            pattern = f"%{word}%"
+            conditions.append(
+                or_(Book.title.ilike(pattern), Book.author.ilike(pattern))
+            )
+        with Session(self.engine) as session:
+            total = session.exec(
+                select(func.count()).select_from(Book).where(*conditions)
+            ).one()
+            books = session.exec(
+                select(Book)
+                .options(defer(Book.probe_json))
+                .where(*conditions)
+                .order_by(Book.sort_title, Book.id)
+                .limit(limit)
+                .offset(offset)
+            ).all()
+        return list(books), total
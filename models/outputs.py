@@ -0,0 +1,89 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Index, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Field, Session, SQLModel, select
+
+from .database import DEFAULT_DB_PATH, add_missing_columns, get_engine
+
+
+class ConversionOutput(SQLModel, table=True):
+    """
+    A finished conversion output on disk and the work that produced it.
+
+    The key is the content of the source, not its name: the AAX checksum,
+    the conversion type, the settings profile and the ffmpeg version. Several
+    files may hold the same output, e.g. one hardlink per uploaded copy.
+    """
+
+    __tablename__ = "conversion_outputs"
+    __table_args__ = (
+        Index(
+            "ix_conversion_outputs_key",
+            "checksum",
+            "conversion_type",
+            "profile",
+            "tool_version",
+        ),
+    )
+
+    path: str = Field(primary_key=True)
+    checksum: str
+    conversion_type: str
+    profile: str
+    tool_version: str
+    # Recorded when the output was finished; a different size means the file
+    # was replaced or truncated since
+    size: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class OutputManifest:
+    """Persistence for finished conversion outputs"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.engine = get_engine(db_path)
+        self.init_database()
+
+    def init_database(self):
+        """Initialize the conversion outputs table"""
+        SQLModel.metadata.create_all(self.engine, tables=[ConversionOutput.__table__])
+        add_missing_columns(self.engine, ConversionOutput.__table__)
+
+    def find(
+        self, checksum: str, conversion_type: str, profile: str, tool_version: str
+    ) -> List[ConversionOutput]:
+        """Every file recorded for a key, oldest first"""
+        with Session(self.engine) as session:
+            return list(
+                session.exec(
+                    select(ConversionOutput)
+                    .where(
+                        ConversionOutput.checksum == checksum,
+                        ConversionOutput.conversion_type == conversion_type,
+                        ConversionOutput.profile == profile,
+                        ConversionOutput.tool_version == tool_version,
+                    )
+                    .order_by(ConversionOutput.created_at)
+                ).all()
+            )
+
+    def get(self, path: str) -> Optional[ConversionOutput]:
+        with Session(self.engine) as session:
+            return session.get(ConversionOutput, path)
+
+    def record(self, output: ConversionOutput):
+        """Store an output, replacing whatever was recorded for its path"""
+        values = output.model_dump()
+        stmt = sqlite_insert(ConversionOutput).values(**values)
+        stmt = stmt.on_conflict_do_update(index_elements=["path"], set_=values)
+        with self.engine.begin() as connection:
+            connection.execute(stmt)
+
+    def forget(self, path: str):
+        """Drop a path, e.g. before a conversion overwrites it"""
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(ConversionOutput).where(ConversionOutput.path == path)
+            )
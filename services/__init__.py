@@ -1,8 +1,33 @@
+from .batch_service import BatchService, batch_service
+from .chapter_stream import ChapterStreamCache, chapter_stream_cache
 from .conversion_orchestrator import ConversionOrchestrator, conversion_orchestrator
 from .conversion_service import ConversionService, conversion_service
+from .detail_cache import DetailCache, detail_cache, etag_matches
 from .extract_activation_bytes import AAXProcessor
 from .extract_metadata import AudiobookMetadataExtractor
+from .fair_scheduler import (
+    FairShareScheduler,
+    InMemorySchedulerStore,
+    RedisSchedulerStore,
+    SchedulerStore,
+    create_scheduler,
+)
+from .heartbeat import ConversionHeartbeat
+from .ingest import IngestDaemon, IngestPipeline, ingest_pipeline
+from .library import LibraryIndex, library_index
+from .output_cache import OutputCache, output_cache
+from .progress_events import ProgressEventBus, format_sse, progress_events
+from .progressive_download import follow, moov_first
+from .reaper import StuckJobReaper, stuck_job_reaper
+from .scratch import ScratchSpace, scratch_space
+from .storage import StorageManager, storage_manager
 from .thread_manager import ThreadManager, thread_manager
+from .tracker_backends import (
+    InMemoryTrackerBackend,
+    RedisTrackerBackend,
+    SQLTrackerBackend,
+    TrackerBackend,
+)
 
 __all__ = [
     "AudiobookMetadataExtractor",
@@ -13,4 +38,39 @@ __all__ = [
     "ConversionService",
     "conversion_orchestrator",
     "ConversionOrchestrator",
+    "TrackerBackend",
+    "InMemoryTrackerBackend",
+    "RedisTrackerBackend",
+    "SQLTrackerBackend",
+    "progress_events",
+    "ProgressEventBus",
+    "format_sse",
+    "ConversionHeartbeat",
+    "StuckJobReaper",
+    "stuck_job_reaper",
+    "FairShareScheduler",
+    "SchedulerStore",
+    "InMemorySchedulerStore",
+    "RedisSchedulerStore",
+    "create_scheduler",
+    "BatchService",
+    "batch_service",
+    "IngestPipeline",
+    "IngestDaemon",
+    "ingest_pipeline",
+    "LibraryIndex",
+    "library_index",
+    "DetailCache",
+    "detail_cache",
+    "etag_matches",
+    "ChapterStreamCache",
+    "chapter_stream_cache",
+    "follow",
+    "moov_first",
+    "OutputCache",
+    "output_cache",
+    "StorageManager",
+    "storage_manager",
+    "ScratchSpace",
+    "scratch_space",
 ]
@@ -0,0 +1,279 @@
+import fnmatch
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config import logger
+from models import (
+    PENDING_ITEM_STATES,
+    BatchItem,
+    BatchRequest,
+    BatchStore,
+    ConversionBatch,
+)
+
+from .conversion_service import conversion_service
+from .output_cache import output_cache
+
+# Conversions of one batch running at the same time, unless the request says otherwise
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+CONVERSION_TYPES = ("m4b", "mp3_chapters")
+TERMINAL_STATUSES = ("completed", "error", "cancelled")
+
+
+def output_path(
+    filename: str, conversion_type: str, upload_dir: str = "uploads"
+) -> str:
+    """Where a conversion of an uploaded AAX file writes its result"""
+    base_name = os.path.splitext(filename)[0]
+    if conversion_type == "m4b":
+        return os.path.join(upload_dir, f"{base_name}.m4b")
+    return os.path.join(upload_dir, f"{base_name}_chapters.zip")
+
+
+class BatchService:
+    """
+    Convert many books with one request and track them as one resource.
+
+    A batch selects books by name, glob or "everything not yet converted",
+    skips outputs that are already up to date, and is then fed to the
+    workers by a pump that keeps at most `concurrency` of its conversions
+    queued or running at any time.
+    """
+
+    def __init__(self, store: Optional[BatchStore] = None, upload_dir: str = "uploads"):
+        self._store = store
+        self.upload_dir = upload_dir
+
+    @property
+    def store(self) -> BatchStore:
+        """Lazy BatchStore, so importing the service does not open the database"""
+        if self._store is None:
+            self._store = BatchStore()
+        return self._store
+
+    def is_up_to_date(self, filename: str, conversion_type: str) -> bool:
+        """True if the output holds the current AAX file, see OutputCache"""
+        aax_file_path = os.path.join(self.upload_dir, filename)
+        result_path = output_path(filename, conversion_type, self.upload_dir)
+        return output_cache.is_up_to_date(aax_file_path, conversion_type, result_path)
+
+    def select_files(self, request: BatchRequest) -> List[str]:
+        """Uploaded AAX files picked by the request, in name order"""
+        uploads = sorted(f for f in os.listdir(self.upload_dir) if f.endswith(".aax"))
+        if request.filenames is not None:
+            missing = sorted(set(request.filenames) - set(uploads))
+            if missing:
+                raise ValueError(f"AAX files not found: {', '.join(missing)}")
+            return sorted(set(request.filenames))
+        if request.glob:
+            return [f for f in uploads if fnmatch.fnmatch(f, request.glob)]
+        if request.all_unconverted:
+            return [
+                f
+                for f in uploads
+                if not all(self.is_up_to_date(f, t) for t in request.formats)
+            ]
+        raise ValueError("Give filenames, a glob or all_unconverted")
+
+    def create_batch(self, request: BatchRequest) -> ConversionBatch:
+        """
+        Create a batch for the selected books and formats.
+
+        Books whose output is already up to date are recorded as skipped,
+        so they appear in the batch status without being converted again.
+
+        Raises:
+            ValueError: If the selection or formats are invalid
+        """
+        formats = list(dict.fromkeys(request.formats))
+        unknown = [f for f in formats if f not in CONVERSION_TYPES]
+        if not formats or unknown:
+            raise ValueError(f"Unknown formats: {unknown or formats}")
+
+        filenames = self.select_files(request)
+        if not filenames:
+            raise ValueError("No AAX files match the selection")
+
+        batch = ConversionBatch(
+            id=str(uuid.uuid4()),
+            formats=",".join(formats),
+            concurrency=max(request.concurrency or BATCH_CONCURRENCY, 1),
+        )
+        items = [
+            BatchItem(
+                batch_id=batch.id,
+                filename=filename,
+                conversion_type=conversion_type,
+                state=(
+                    "skipped"
+                    if self.is_up_to_date(filename, conversion_type)
+                    else "pending"
+                ),
+            )
+            for filename in filenames
+            for conversion_type in formats
+        ]
+        self.store.create_batch(batch, items)
+        return batch
+
+    def pending_files(self, batch_id: str) -> List[str]:
+        """AAX paths of books that still have to be converted"""
+        items = self.store.get_items(batch_id, states=["pending"])
+        return sorted({os.path.join(self.upload_dir, item.filename) for item in items})
+
+    def _refresh(self, batch_id: str) -> List[Dict[str, Any]]:
+        """
+        Sync queued items with the conversion tracker.
+
+        Returns:
+            list: Every item with its live tracker status and progress
+        """
+        entries = []
+        for item in self.store.get_items(batch_id):
+            progress: Dict[str, Any] = {}
+            if item.state == "queued":
+                progress = conversion_service.get_progress(
+                    item.filename, item.conversion_type
+                )
+                if progress["status"] in TERMINAL_STATUSES:
+                    item.state = progress["status"]
+                    item.error_message = progress.get("error")
+                    item.finished_at = datetime.utcnow()
+                    self.store.update_item(
+                        item.id,
+                        state=item.state,
+                        error_message=item.error_message,
+                        finished_at=item.finished_at,
+                    )
+            entries.append({"item": item, "progress": progress})
+
+        batch = self.store.get_batch(batch_id)
+        if (
+            batch is not None
+            and batch.status == "running"
+            and not any(e["item"].state in PENDING_ITEM_STATES for e in entries)
+        ):
+            self.store.set_status(batch_id, "completed")
+            logger.info(f"Batch {batch_id} completed")
+        return entries
+
+    def next_items(self, batch_id: str) -> List[BatchItem]:
+        """Pending items that fit within the batch's concurrency right now"""
+        batch = self.store.get_batch(batch_id)
+        if batch is None or batch.status != "running":
+            return []
+
+        items = [entry["item"] for entry in self._refresh(batch_id)]
+        in_flight = sum(1 for item in items if item.state == "queued")
+        pending = [item for item in items if item.state == "pending"]
+        return pending[: max(batch.concurrency - in_flight, 0)]
+
+    def is_running(self, batch_id: str) -> bool:
+        batch = self.store.get_batch(batch_id)
+        return batch is not None and batch.status in ("resolving_keys", "running")
+
+    def mark_queued(self, item: BatchItem, task_id: Optional[str]):
+        self.store.update_item(
+            item.id, state="queued", task_id=task_id, queued_at=datetime.utcnow()
+        )
+
+    def mark_failed(self, item: BatchItem, error_message: str):
+        self.store.update_item(
+            item.id,
+            state="error",
+            error_message=error_message,
+            finished_at=datetime.utcnow(),
+        )
+
+    def cancel_batch(self, batch_id: str) -> Optional[List[BatchItem]]:
+        """
+        Stop a batch: pending items are dropped, queued ones are returned
+        so the caller can cancel their conversions.
+
+        Returns:
+            list: Items whose conversions may still be running, or None if
+            the batch does not exist
+        """
+        batch = self.store.get_batch(batch_id)
+        if batch is None:
+            return None
+
+        self.store.set_status(batch_id, "cancelled")
+        queued = []
+        for item in self.store.get_items(batch_id, states=PENDING_ITEM_STATES):
+            if item.state == "queued":
+                queued.append(item)
+            self.store.update_item(
+                item.id, state="cancelled", finished_at=datetime.utcnow()
+            )
+        logger.info(f"Cancelled batch {batch_id}")
+        return queued
+
+    def get_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Aggregate status: per-book progress, state counts and throughput"""
+        if self.store.get_batch(batch_id) is None:
+            return None
+        entries = self._refresh(batch_id)
+        batch = self.store.get_batch(batch_id)
+
+        counts = {
+            state: 0
+            for state in (
+                "pending",
+                "queued",
+                "completed",
+                "error",
+                "cancelled",
+                "skipped",
+            )
+        }
+        books = []
+        progress_total = 0.0
+        for entry in entries:
+            item, progress = entry["item"], entry["progress"]
+            counts[item.state] = counts.get(item.state, 0) + 1
+            item_progress = (
+                100.0
+                if item.state in ("completed", "skipped")
+                else float(progress.get("progress", 0.0))
+            )
+            progress_total += item_progress
+            book = {
+                "filename": item.filename,
+                "conversion_type": item.conversion_type,
+                "state": item.state,
+                "progress": item_progress,
+            }
+            if progress.get("status"):
+                book["status"] = progress["status"]
+            if item.task_id:
+                book["task_id"] = item.task_id
+            if item.error_message:
+                book["error"] = item.error_message
+            books.append(book)
+
+        end = batch.finished_at or datetime.utcnow()
+        elapsed = max((end - batch.created_at).total_seconds(), 0.001)
+        return {
+            "batch_id": batch.id,
+            "status": batch.status,
+            "formats": batch.formats.split(","),
+            "concurrency": batch.concurrency,
+            "created_at": batch.created_at.isoformat(),
+            "finished_at": batch.finished_at.isoformat() if batch.finished_at else None,
+            "total": len(entries),
+            "counts": counts,
+            "progress": round(progress_total / len(entries), 1) if entries else 100.0,
+            "throughput": {
+                "elapsed_seconds": round(elapsed, 1),
+                "completed": counts["completed"],
+                "conversions_per_hour": round(counts["completed"] * 3600 / elapsed, 2),
+            },
+            "items": books,
+        }
+
+
+# Global instance
+batch_service = BatchService()
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import logger
+from models import Book
+
+from .extract_activation_bytes import AAXProcessor
+
+STREAM_CACHE_DIR = os.getenv("STREAM_CACHE_DIR", "stream_cache")
+# Remuxed chapters and HLS segments kept on disk; the least recently played go first
+STREAM_CACHE_MAX_MB = int(os.getenv("STREAM_CACHE_MAX_MB", "2048"))
+# Longest HLS segment; chapters are split into equal segments no longer than this
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "10"))
+_PARTIAL_SUFFIX = ".partial"
+
+
+class Segment(NamedTuple):
+    start: float
+    duration: float
+    # Title of the chapter the segment starts, None within a chapter
+    chapter: Optional[str]
+
+
+class ChapterStreamCache:
+    """
+    Chapters and HLS segments of ingested books, remuxed on demand for playback.
+
+    A chapter or segment is decrypted and stream-copied the first time it is
+    played, which takes seconds rather than the minutes of a full
+    conversion. The file is then served by the web app and kept until the
+    cache outgrows max_bytes. Files are keyed on the book's path, size and
+    mtime, so a changed book never plays stale audio.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = STREAM_CACHE_DIR,
+        max_bytes: int = STREAM_CACHE_MAX_MB * 1024 * 1024,
+        processor: Optional[AAXProcessor] = None,
+        segment_seconds: float = HLS_SEGMENT_SECONDS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.segment_seconds = segment_seconds
+        self._processor = processor
+        # Remuxes in progress in this process, so concurrent requests for a
+        # chapter wait for one ffmpeg instead of starting their own
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    @property
+    def processor(self) -> AAXProcessor:
+        if self._processor is None:
+            self._processor = AAXProcessor()
+        return self._processor
+
+    @staticmethod
+    def chapter_range(book: Book, number: int) -> Tuple[float, float]:
+        """
+        Start and duration in seconds of a book's chapter, numbered from 1.
+
+        Raises:
+            LookupError: If the book has no such chapter
+        """
+        chapters = json.loads(book.probe_json or "{}").get("chapters", [])
+        if not 1 <= number <= len(chapters):
+            raise LookupError(f"{book.filename} has no chapter {number}")
+        chapter = chapters[number - 1]
+        start = float(chapter.get("start_time", 0))
+        return start, float(chapter.get("end_time", 0)) - start
+
+    def segments(self, book: Book) -> List[Segment]:
+        """
+        HLS segments of a book: every chapter split into equal parts of at
+        most segment_seconds, so chapters always start a segment.
+        """
+        probe = json.loads(book.probe_json or "{}")
+        chapters = [
+            (
+                float(chapter.get("start_time", 0)),
+                float(chapter.get("end_time", 0)),
+                chapter.get("tags", {}).get("title") or f"Chapter {number}",
+            )
+            for number, chapter in enumerate(probe.get("chapters", []), 1)
+        ]
+        if not chapters:
+            duration = float(probe.get("format", {}).get("duration") or 0)
+            chapters = [(0.0, duration, book.title or book.filename)]
+
+        segments = []
+        for start, end, title in chapters:
+            if end <= start:
+                continue
+            count = math.ceil((end - start) / self.segment_seconds)
+            length = (end - start) / count
+            for index in range(count):
+                segments.append(
+                    Segment(
+                        start + index * length, length, title if not index else None
+                    )
+                )
+        return segments
+
+    def playlist(self, book: Book) -> str:
+        """
+        HLS media playlist of a book, built from its chapter table without
+        touching the audio. Segment URIs are relative to the playlist and
+        carry the book's mtime, so clients may cache them.
+        """
+        segments = self.segments(book)
+        target = math.ceil(max((segment.duration for segment in segments), default=0))
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{max(target, 1)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+        ]
+        for number, segment in enumerate(segments):
+            # EXTINF titles mark where chapters start
+            title = (segment.chapter or "").replace(",", " ").replace("\n", " ")
+            lines.append(f"#EXTINF:{segment.duration:.3f},{title}")
+            lines.append(f"{number}.ts?v={int(book.mtime)}")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def _cache_path(self, book: Book, name: str) -> str:
+        identity = f"{book.path}:{book.size}:{book.mtime}"
+        key = hashlib.sha1(identity.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}-{name}")
+
+    def _lock_for(self, path: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def chapter_path(self, book: Book, number: int) -> str:
+        """
+        Path of a ready book's chapter as M4A, remuxing it first if not cached.
+
+        Raises:
+            LookupError: If the book has no such chapter
+            RuntimeError: If ffmpeg could not remux it
+        """
+        start, duration = self.chapter_range(book, number)
+        return self._remuxed(
+            book,
+            f"chapter-{number:03d}.m4a",
+            start,
+            duration,
+            "mp4",
+            f"chapter {number}",
+        )
+
+    def segment_path(self, book: Book, number: int) -> str:
+        """
+        Path of a ready book's HLS segment, numbered from 0, remuxing it first
+        if not cached.
+
+        Raises:
+            LookupError: If the book has no such segment
+            RuntimeError: If ffmpeg could not remux it
+        """
+        segments = self.segments(book)
+        if not 0 <= number < len(segments):
+            raise LookupError(f"{book.filename} has no segment {number}")
+        segment = segments[number]
+        # The segment length is part of the name, as it changes every boundary
+        name = f"hls{self.segment_seconds:g}-{number:05d}.ts"
+        return self._remuxed(
+            book, name, segment.start, segment.duration, "mpegts", f"segment {number}"
+        )
+
+    def _remuxed(
+        self,
+        book: Book,
+        name: str,
+        start: float,
+        duration: float,
+        container: str,
+        description: str,
+    ) -> str:
+        path = self._cache_path(book, name)
+        with self._lock_for(path):
+            if os.path.exists(path):
+                # mtime is the LRU clock; atime is often disabled
+                os.utime(path)
+                return path
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            partial = f"{path}.{uuid.uuid4().hex}{_PARTIAL_SUFFIX}"
+            try:
+                if not self.processor.remux_range(
+                    book.path,
+                    book.activation_bytes,
+                    start,
+                    duration,
+                    partial,
+                    container=container,
+                ):
+                    raise RuntimeError(
+                        f"Could not remux {description} of {book.filename}"
+                    )
+                # Other processes only ever see complete files
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+
+        logger.info(f"Remuxed {description} of {book.filename} for streaming")
+        self.evict()
+        return path
+
+    def evict(self) -> int:
+        """
+        Delete the least recently played files until the cache fits.
+
+        Returns:
+            int: Number of files deleted
+        """
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.cache_dir)
+                if entry.is_file() and not entry.name.endswith(_PARTIAL_SUFFIX)
+            ]
+        except FileNotFoundError:
+            return 0
+        stats = sorted(
+            ((entry.stat(), entry.path) for entry in entries),
+            key=lambda item: item[0].st_mtime,
+        )
+        total = sum(stat.st_size for stat, _ in stats)
+        deleted = 0
+        for stat, path in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+            deleted += 1
+        if deleted:
+            logger.info(f"Evicted {deleted} streamed files from {self.cache_dir}")
+        return deleted
+
+
+# Global instance
+chapter_stream_cache = ChapterStreamCache()
@@ -5,6 +5,7 @@ from config import logger
 
 from .conversion_service import conversion_service
 from .extract_activation_bytes import AAXProcessor
+from .output_cache import output_cache
 from .thread_manager import thread_manager
 
 
@@ -12,8 +13,6 @@ class ConversionOrchestrator:
     """Orchestrates conversion operations with thread management"""
 
     def __init__(self):
-        # Register cleanup callback with thread manager
-        thread_manager.add_cleanup_callback(self._cleanup_conversions)
         self._processor = None
 
     @property
@@ -23,9 +22,15 @@ class ConversionOrchestrator:
             self._processor = AAXProcessor()
         return self._processor
 
-    def _cleanup_conversions(self):
-        """Cleanup callback for thread manager"""
+    def cleanup_conversions(self):
+        """
+        Mark active conversions as interrupted when the web server stops.
+
+        Called from the server's shutdown only: CLI and worker processes that
+        import the services must not fail the server's conversions on exit.
+        """
         conversion_service.cleanup_active_conversions()
+        conversion_service.flush()
 
     def _create_progress_callback(
         self, filename: str, conversion_type: str
@@ -40,9 +45,14 @@ class ConversionOrchestrator:
                 )
                 return False
 
-            conversion_service.update_progress(
+            if not conversion_service.update_progress(
                 filename, round(progress_percent, 1), "converting", conversion_type
-            )
+            ):
+                # Cancelled, or taken over after a reap: stop working on it
+                logger.info(
+                    f"{conversion_type} conversion of {filename} is no longer active, stopping"
+                )
+                return False
             logger.info(
                 f"{conversion_type} conversion progress for {filename}: {progress_percent:.1f}%"
             )
@@ -57,9 +67,13 @@ class ConversionOrchestrator:
         m4b_file_path: str,
         activation_bytes: str,
         start_tracking: bool = True,
+        process_callback: Optional[Callable] = None,
     ):
         """Background function to handle file conversion with progress tracking"""
         try:
+            # Removed rather than overwritten: it may be a hardlink shared
+            # with other books' outputs
+            output_cache.forget(m4b_file_path)
             if os.path.exists(m4b_file_path):
                 os.remove(m4b_file_path)
 
@@ -73,15 +87,21 @@ class ConversionOrchestrator:
             # Create progress callback
             progress_callback = self._create_progress_callback(filename, "m4b")
 
-            # Update status to converting
-            conversion_service.update_progress(filename, 0, "converting", "m4b")
+            # Reading the duration comes first; the first ffmpeg progress
+            # report moves the job on to "converting"
+            conversion_service.update_progress(filename, 0, "probing", "m4b")
 
             success = self.processor.convert_to_m4b(
-                aax_file_path, m4b_file_path, activation_bytes, progress_callback
+                aax_file_path,
+                m4b_file_path,
+                activation_bytes,
+                progress_callback,
+                process_callback,
             )
 
             # Mark conversion as completed or failed
             if success and not thread_manager.is_shutdown_requested():
+                output_cache.remember(aax_file_path, "m4b", m4b_file_path)
                 conversion_service.complete_conversion(
                     filename,
                     success=True,
@@ -151,6 +171,7 @@ class ConversionOrchestrator:
 
             # Mark conversion as completed or failed
             if result["success"] and not thread_manager.is_shutdown_requested():
+                output_cache.remember(aax_file_path, "mp3_chapters", result["zip_path"])
                 conversion_service.complete_conversion(
                     filename,
                     success=True,
@@ -244,8 +265,12 @@ class ConversionOrchestrator:
     def get_conversion_status(self, filename: str, conversion_type: str = "m4b"):
         """Get conversion progress status"""
         progress_data = conversion_service.get_progress(filename, conversion_type)
+        return self.add_download_url(progress_data, filename, conversion_type)
 
-        # If completed, add download URL
+    def add_download_url(
+        self, progress_data: dict, filename: str, conversion_type: str
+    ) -> dict:
+        """Add the download URL to a completed conversion's status"""
         if progress_data["status"] == "completed":
             if conversion_type == "m4b":
                 progress_data["download_url"] = f"/download/{filename}"
@@ -1,8 +1,11 @@
 import threading
+from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 
 from config import logger
-from models import ConversionTracker
+
+from .progress_events import progress_events
+from .tracker_backends import REAPED_ERROR, TrackerBackend, create_tracker_backend
 
 
 class ConversionService:
@@ -19,35 +22,63 @@ class ConversionService:
                     cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self):
+    def __init__(self, backend: Optional[TrackerBackend] = None):
         if hasattr(self, "_initialized"):
             return
 
-        self._tracker = ConversionTracker()
-        self._tracker.cleanup_old_records(days=2)
-        self._tracker.reset_stuck_conversions()
+        self._backend = backend
         self._initialized = True
-        logger.info("ConversionService initialized")
 
-    def start_conversion(self, filename: str, conversion_type: str = "m4b") -> bool:
+    @property
+    def _tracker(self) -> TrackerBackend:
+        """The tracker backend, opened on first use rather than on import"""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    backend = create_tracker_backend()
+                    backend.cleanup_old_records(days=2)
+                    backend.reset_stuck_conversions()
+                    self._backend = backend
+                    logger.info(
+                        f"ConversionService initialized with {type(backend).__name__}"
+                    )
+        return self._backend
+
+    def start_conversion(
+        self,
+        filename: str,
+        conversion_type: str = "m4b",
+        task_id: Optional[str] = None,
+        attempt: int = 1,
+    ) -> bool:
         """
         Start tracking a conversion
 
+        The "start if not active" decision is a single conditional upsert in
+        the tracker, so concurrent callers in different processes cannot both
+        win and queue the same conversion twice.
+
         Args:
             filename: Name of the file being converted
             conversion_type: Type of conversion ("m4b" or "mp3_chapters")
+            task_id: Celery task id that will own the conversion
+            attempt: 1 for a new request, higher when a dead job is requeued
 
         Returns:
             bool: True if conversion started, False if already in progress
         """
-        if self.is_conversion_active(filename, conversion_type):
+        if not self._tracker.claim_conversion(
+            filename, conversion_type, task_id, attempt
+        ):
             logger.warning(
                 f"Conversion already active for {filename} ({conversion_type})"
             )
             return False
 
-        self._tracker.start_conversion(filename, conversion_type)
         logger.info(f"Started tracking {conversion_type} conversion for {filename}")
+        progress_events.publish(
+            filename, conversion_type, {"status": "starting", "progress": 0.0}
+        )
         return True
 
     def update_progress(
@@ -56,9 +87,22 @@ class ConversionService:
         progress: float,
         status: str = "converting",
         conversion_type: str = "m4b",
-    ):
-        """Update conversion progress"""
-        self._tracker.update_progress(filename, progress, status, conversion_type)
+    ) -> bool:
+        """
+        Update conversion progress
+
+        Returns:
+            bool: False if the conversion is no longer active, e.g. it was
+            cancelled, which tells the caller to stop working on it
+        """
+        if not self._tracker.update_progress(
+            filename, progress, status, conversion_type
+        ):
+            return False
+        progress_events.publish(
+            filename, conversion_type, {"status": status, "progress": progress}
+        )
+        return True
 
     def complete_conversion(
         self,
@@ -69,13 +113,54 @@ class ConversionService:
         conversion_type: str = "m4b",
     ):
         """Mark conversion as completed or failed"""
-        self._tracker.complete_conversion(
+        if not self._tracker.complete_conversion(
             filename, success, error_message, result_path, conversion_type
-        )
+        ):
+            logger.info(
+                f"Ignoring result for {filename} ({conversion_type}): no longer active"
+            )
+            return
+        if success:
+            event = {"status": "completed", "progress": 100.0}
+        else:
+            event = {"status": "error", "error": error_message}
+        progress_events.publish(filename, conversion_type, event)
         logger.info(
             f"Completed {conversion_type} conversion for {filename}: {'success' if success else 'failed'}"
         )
 
+    def cancel_conversion(
+        self, filename: str, conversion_type: str = "m4b"
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Mark an active conversion as cancelled
+
+        Workers notice the status change through their heartbeat and stop;
+        the returned record carries the task ids and scratch directory the
+        caller needs to revoke queued work and clean up.
+
+        Returns:
+            dict: The cancelled conversion, or None if it was not active
+        """
+        record = self._tracker.cancel_conversion(filename, conversion_type)
+        if record is not None:
+            progress_events.publish(
+                filename, conversion_type, {"status": "cancelled", "error": "Cancelled"}
+            )
+        return record
+
+    def record_subtasks(
+        self,
+        filename: str,
+        conversion_type: str,
+        work_dir: Optional[str],
+        subtask_count: int,
+    ):
+        """Remember the scratch directory and number of subtasks of a conversion"""
+        self._tracker.record_subtasks(
+            filename, conversion_type, work_dir, subtask_count
+        )
+
     def get_progress(
         self, filename: str, conversion_type: str = "m4b"
     ) -> Dict[str, Any]:
@@ -106,12 +191,48 @@ class ConversionService:
         except Exception as e:
             logger.error(f"Error during conversion cleanup: {e}")
 
+    def record_heartbeat(
+        self,
+        filename: str,
+        conversion_type: str,
+        worker_id: str,
+        worker_task_id: Optional[str] = None,
+        ffmpeg_pid: Optional[int] = None,
+        lease_delta: int = 0,
+    ):
+        """Record that a worker is still running part of a conversion"""
+        self._tracker.record_heartbeat(
+            filename,
+            conversion_type,
+            worker_id,
+            worker_task_id,
+            ffmpeg_pid,
+            lease_delta,
+        )
+
+    def reap_expired_conversions(self, timeout_seconds: float) -> List[Dict[str, Any]]:
+        """Fail conversions whose workers have not heartbeated within the timeout"""
+        reaped = self._tracker.reap_expired_conversions(
+            datetime.utcnow() - timedelta(seconds=timeout_seconds)
+        )
+        for record in reaped:
+            progress_events.publish(
+                record["filename"],
+                record["conversion_type"],
+                {"status": "error", "error": REAPED_ERROR},
+            )
+        return reaped
+
     def cleanup_old_records(self, days: int = 7):
         """Clean up old conversion records"""
         self._tracker.cleanup_old_records(days)
 
+    def flush(self):
+        """Persist any writes the backend has buffered"""
+        self._tracker.flush()
+
     def reset_stuck_conversions(self):
-        """Reset conversions that were interrupted during server shutdown"""
+        """Fail conversions whose workers stopped heartbeating"""
         self._tracker.reset_stuck_conversions()
 
 
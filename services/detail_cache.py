@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from models import Book
+
+# Rendered detail pages kept per process
+DETAIL_CACHE_SIZE = int(os.getenv("DETAIL_CACHE_SIZE", "256"))
+DETAIL_TEMPLATE = os.path.join("templates", "detail.html")
+
+
+class DetailCache:
+    """
+    Rendered detail pages, most recently viewed first.
+
+    A page is a function of the book's ingest results only (conversion state
+    is fetched by the page itself), so it is versioned by an ETag built from
+    the ingest that produced it and the template it was rendered with. When
+    the file changes, the page of the previous ingest stays valid and can be
+    served while the book is ingested again.
+    """
+
+    def __init__(self, max_entries: int = DETAIL_CACHE_SIZE):
+        self.max_entries = max_entries
+        # Path -> (etag, body)
+        self._pages: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        try:
+            self._template_version = int(os.path.getmtime(DETAIL_TEMPLATE))
+        except OSError:
+            self._template_version = 0
+
+    def etag(self, book: Book) -> Optional[str]:
+        """The ETag of a book's detail page, None if it was never ingested"""
+        if book.ingested_at is None or book.probe_json is None:
+            return None
+        version = int(book.ingested_at.timestamp() * 1000)
+        return f'"{book.id}-{version}-{self._template_version}"'
+
+    def get(self, path: str, etag: str) -> Optional[bytes]:
+        with self._lock:
+            cached = self._pages.get(path)
+            if cached is None or cached[0] != etag:
+                return None
+            self._pages.move_to_end(path)
+            return cached[1]
+
+    def put(self, path: str, etag: str, body: bytes):
+        with self._lock:
+            self._pages[path] = (etag, body)
+            self._pages.move_to_end(path)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def discard(self, path: str):
+        with self._lock:
+            self._pages.pop(path, None)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header lists etag, compared weakly"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+# Global instance
+detail_cache = DetailCache()
@@ -2,13 +2,17 @@ import concurrent.futures
 import json
 import os
 import re
+import shutil
+import signal
+import struct
 import subprocess
 import sys
 import tempfile
 import threading
+import time
 import zipfile
 from pathlib import Path
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 
 import requests
 from mutagen.id3 import APIC, ID3, TALB, TCON, TIT2, TPE1, TPE2, TRCK
@@ -16,17 +20,137 @@ from mutagen.mp3 import MP3
 
 from config import logger
 
+from .scratch import estimate_mp3_bytes, scratch_space
+
+# Checksum -> activation bytes cache, shared by every lookup
+ACTIVATION_BYTES_FILE = "activation_bytes.json"
+ACTIVATION_HTTP_TIMEOUT_SECONDS = float(
+    os.getenv("ACTIVATION_HTTP_TIMEOUT_SECONDS", "10")
+)
+
+# MP3 encoder settings by profile name
+MP3_PROFILES = {
+    "standard": {"bitrate": "128k", "sample_rate": "44100"},
+    "high": {"bitrate": "192k", "sample_rate": "44100"},
+    "voice": {"bitrate": "64k", "sample_rate": "22050"},
+}
+MP3_PROFILE = os.getenv("MP3_PROFILE", "standard")
+
+# "faststart" writes the moov atom into space reserved before the audio, so
+# players can start without fetching the tail; "standard" writes it after the
+# audio; "fragmented" writes it first and the audio in fragments, so the M4B
+# can be downloaded while it grows
+M4B_LAYOUTS = ("faststart", "standard", "fragmented")
+M4B_LAYOUT = os.getenv("M4B_LAYOUT", "faststart")
+# Audio per fragment of a fragmented M4B
+M4B_FRAGMENT_SECONDS = 10
+
+
+def mp4_boxes(path: str) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Type, offset and size of the top-level boxes of an MP4 file, read from
+    their headers only. Stops at a truncated or malformed header.
+    """
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= end:
+            f.seek(offset)
+            size, box = struct.unpack(">I4s", f.read(8))
+            if size == 1:
+                largesize = f.read(8)
+                if len(largesize) < 8:
+                    return
+                size = struct.unpack(">Q", largesize)[0]
+            elif size == 0:
+                # Runs to the end of the file
+                size = end - offset
+            if size < 8:
+                return
+            yield box, offset, size
+            offset += size
+
+
+def estimate_moov_size(aax_file: str, duration: Optional[float]) -> int:
+    """
+    Bytes to reserve for the moov atom of an M4B remuxed from aax_file.
+
+    A stream copy keeps every packet, chapter and tag, so the output's sample
+    tables are about as large as the input's. The estimate is the input moov
+    with half again as margin, plus 1 MB for a cover the input keeps outside
+    its moov. Without a readable input moov, it allows 8 bytes (a stsz and a
+    stco entry) for every AAC frame of duration at 48 kHz.
+    """
+    try:
+        moov = next(
+            (size for box, _, size in mp4_boxes(aax_file) if box == b"moov"), None
+        )
+    except OSError:
+        moov = None
+    if moov is None:
+        moov = int((duration or 0) * 48000 / 1024 * 8)
+    return int(moov * 1.5) + 1024 * 1024
+
+
+def terminate_process_group(process: subprocess.Popen, timeout: float = 5.0):
+    """
+    Stop a process started with start_new_session=True and all its children.
+
+    The whole group gets SIGTERM, and SIGKILL if it is still running after
+    the timeout, so no helper process keeps the worker slot busy.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+    except ProcessLookupError:
+        pass
+
 
 class AAXProcessor:
-    def __init__(self, tables_path="/app/audible_rainbow_tables"):
+    def __init__(
+        self,
+        tables_path="/app/audible_rainbow_tables",
+        profile=None,
+        m4b_layout=None,
+    ):
         """
         Initialize AAX processor.
 
         Args:
             tables_path (str): Path to the directory containing rainbow tables (*.rtc files)
+            profile (str): MP3 encoder profile from MP3_PROFILES, MP3_PROFILE if not given
+            m4b_layout (str): M4B layout from M4B_LAYOUTS, M4B_LAYOUT if not given
         """
         self.tables_path = Path(tables_path)
-        self.rcrack_binary = self.find_rcrack_binary()
+        self._rcrack_binary = None
+        profile = profile or MP3_PROFILE
+        if profile not in MP3_PROFILES:
+            raise ValueError(f"Unknown MP3 profile: {profile}")
+        self.mp3_settings = MP3_PROFILES[profile]
+        self.m4b_layout = m4b_layout or M4B_LAYOUT
+        if self.m4b_layout not in M4B_LAYOUTS:
+            raise ValueError(f"Unknown M4B layout: {self.m4b_layout}")
+        # Seconds spent per conversion stage, summed over this processor's calls
+        self.stage_timings: Dict[str, float] = {}
+
+    @property
+    def rcrack_binary(self):
+        """rcrack is only looked up when a key has to be cracked"""
+        if self._rcrack_binary is None:
+            self._rcrack_binary = self.find_rcrack_binary()
+        return self._rcrack_binary
+
+    def _record_stage(self, stage, started):
+        """Add the time since `started` (time.monotonic) to a stage's total"""
+        self.stage_timings[stage] = (
+            self.stage_timings.get(stage, 0.0) + time.monotonic() - started
+        )
 
     def find_rcrack_binary(self):
         """Find the rcrack binary executable."""
@@ -139,6 +263,10 @@ class AAXProcessor:
         except subprocess.CalledProcessError as e:
             logger.error(f"Error running rcrack: {e}")
             return None
+        except FileNotFoundError as e:
+            # No rcrack binary or rainbow tables on this host
+            logger.error(f"Cannot crack checksum: {e}")
+            return None
         finally:
             os.chdir(orginal_dir)
 
@@ -163,17 +291,12 @@ class AAXProcessor:
         if not checksum:
             return {"error": "Could not extract SHA1 checksum"}
 
-        with open("activation_bytes.json", "r+") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {}
-
-            if checksum in data:
-                logger.info(f"Activation bytes already found for checksum: {checksum}")
-                return {"checksum": checksum, "activation_bytes": data[checksum]}
-            else:
-                logger.info(f"Activation bytes not found for checksum: {checksum}")
+        data = self._load_known_activation_bytes()
+        if checksum in data:
+            logger.info(f"Activation bytes already found for checksum: {checksum}")
+            return {"checksum": checksum, "activation_bytes": data[checksum]}
+        else:
+            logger.info(f"Activation bytes not found for checksum: {checksum}")
 
         # Step 2: Recover activation bytes
         activation_bytes = self.recover_activation_bytes(checksum)
@@ -181,14 +304,7 @@ class AAXProcessor:
             return {"checksum": checksum, "error": "Could not recover activation bytes"}
 
         # if activation bytes is found store it in a json file
-        with open("activation_bytes.json", "w+") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {}
-
-            data[checksum] = activation_bytes
-            json.dump(data, f, indent=4)
+        self._save_activation_bytes(checksum, activation_bytes)
 
         return {"checksum": checksum, "activation_bytes": activation_bytes}
 
@@ -197,7 +313,11 @@ class AAXProcessor:
             checksum
         )
         logger.info(f"Getting activation bytes via HTTP API: {url}")
-        response = requests.get(url)
+        try:
+            response = requests.get(url, timeout=ACTIVATION_HTTP_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            logger.error(f"Activation bytes request failed: {e}")
+            return None
         if response.status_code == 200:
             logger.info(f"Activation bytes: {response.text}")
             return response.text
@@ -205,22 +325,38 @@ class AAXProcessor:
             logger.error(f"Failed to get activation bytes: {response.status_code}")
             return None
 
+    def _load_known_activation_bytes(self):
+        """Read the checksum -> activation bytes cache, empty if missing or corrupt"""
+        try:
+            with open(ACTIVATION_BYTES_FILE, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_activation_bytes(self, checksum, activation_bytes):
+        """Remember activation bytes so the next lookup skips HTTP and rcrack"""
+        data = self._load_known_activation_bytes()
+        data[checksum] = activation_bytes
+        tmp_path = f"{ACTIVATION_BYTES_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, ACTIVATION_BYTES_FILE)
+
     def get_activation_bytes(self, aax_file):
         checksum = self.extract_sha1_checksum(aax_file)
         if not checksum:
             return {"checksum": checksum, "error": "Could not extract SHA1 checksum"}
         # check if activation bytes is already in the json file
-        with open("activation_bytes.json", "r") as f:
-            data = json.load(f)
-            if checksum in data:
-                logger.info(
-                    f"Activation bytes already found for checksum {checksum} in json file"
-                )
-                return {"checksum": checksum, "activation_bytes": data[checksum]}
-            else:
-                logger.info(
-                    f"Activation bytes not found for checksum {checksum} in json file"
-                )
+        data = self._load_known_activation_bytes()
+        if checksum in data:
+            logger.info(
+                f"Activation bytes already found for checksum {checksum} in json file"
+            )
+            return {"checksum": checksum, "activation_bytes": data[checksum]}
+        else:
+            logger.info(
+                f"Activation bytes not found for checksum {checksum} in json file"
+            )
 
         activation_bytes = self.get_activation_bytes_via_http_api(checksum)
         if not activation_bytes:
@@ -230,7 +366,155 @@ class AAXProcessor:
             if not activation_bytes:
                 return {"checksum": checksum, "error": "Could not get activation bytes"}
 
-                return {"checksum": checksum, "activation_bytes": activation_bytes}
+        self._save_activation_bytes(checksum, activation_bytes)
+        return {"checksum": checksum, "activation_bytes": activation_bytes}
+
+    def get_activation_bytes_bulk(self, aax_files, max_workers=4):
+        """
+        Resolve activation bytes for many AAX files at once.
+
+        Checksums are read in parallel, and each distinct checksum is looked
+        up only once: every book bought on one account shares a checksum, so
+        a whole library usually needs a single HTTP or rcrack lookup. Found
+        bytes are cached, so the jobs queued afterwards resolve instantly.
+
+        Args:
+            aax_files (list): Paths of the AAX files
+            max_workers (int): Parallel ffprobe processes for the checksums
+
+        Returns:
+            dict: Path -> result in the format of get_activation_bytes
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            checksums = dict(
+                zip(aax_files, pool.map(self.extract_sha1_checksum, aax_files))
+            )
+
+        known = self._load_known_activation_bytes()
+        resolved = {}
+        for checksum in set(checksums.values()) - {None}:
+            if checksum in known:
+                resolved[checksum] = known[checksum]
+                continue
+            activation_bytes = self.get_activation_bytes_via_http_api(
+                checksum
+            ) or self.recover_activation_bytes(checksum)
+            if activation_bytes:
+                self._save_activation_bytes(checksum, activation_bytes)
+                resolved[checksum] = activation_bytes
+
+        results = {}
+        for aax_file, checksum in checksums.items():
+            if not checksum:
+                results[aax_file] = {
+                    "checksum": checksum,
+                    "error": "Could not extract SHA1 checksum",
+                }
+            elif checksum in resolved:
+                results[aax_file] = {
+                    "checksum": checksum,
+                    "activation_bytes": resolved[checksum],
+                }
+            else:
+                results[aax_file] = {
+                    "checksum": checksum,
+                    "error": "Could not get activation bytes",
+                }
+        logger.info(
+            f"Resolved activation bytes for {len(aax_files)} files "
+            f"with {len(set(checksums.values()) - {None})} distinct checksums"
+        )
+        return results
+
+    def _run_process(self, cmd, process_callback=None):
+        """
+        Run a command to completion in its own process group.
+
+        Args:
+            cmd (list): Command and arguments
+            process_callback (callable): Called with the Popen object once started
+
+        Returns:
+            subprocess.CompletedProcess: Result with captured stdout and stderr
+        """
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+        )
+        if process_callback:
+            process_callback(process)
+        stdout, stderr = process.communicate()
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+    def remux_range(
+        self,
+        aax_file,
+        activation_bytes,
+        start,
+        duration,
+        output_path,
+        container="mp4",
+        seek_preroll=30.0,
+    ):
+        """
+        Decrypt one time range of an AAX file into a playable file, without
+        re-encoding.
+
+        MP4 output has its moov atom written first so players can seek as soon
+        as the file starts downloading. MPEG-TS output keeps the range's
+        timestamps, so consecutive ranges play as one stream (HLS segments).
+
+        Args:
+            aax_file (str): Path to the AAX file
+            activation_bytes (str): Activation bytes for the file
+            start (float): Start of the range in seconds
+            duration (float): Length of the range in seconds
+            output_path (str): Where to write the file
+            container (str): "mp4" or "mpegts"
+            seek_preroll (float): Seconds before start that are reached by
+                output seeking; anything earlier is skipped by input seeking
+
+        Returns:
+            bool: True if ffmpeg succeeded
+        """
+        # Output seeking, as for MP3 chapters, is exact but reads every packet
+        # before start, which deep into a long book takes longer than the
+        # range itself. Input seeking jumps to just before the range and the
+        # remaining preroll is output-seeked exactly.
+        skip = max(start - seek_preroll, 0.0)
+        cmd = ["ffmpeg", "-activation_bytes", activation_bytes]
+        if skip:
+            cmd += ["-ss", str(skip)]
+        cmd += [
+            "-i",
+            aax_file,
+            "-map",
+            "0:a:0",
+            "-vn",
+            "-sn",
+            "-dn",
+            "-ss",
+            str(start - skip),
+            "-t",
+            str(duration),
+            "-c:a",
+            "copy",
+        ]
+        if container == "mpegts":
+            cmd += ["-output_ts_offset", str(start), "-f", "mpegts"]
+        else:
+            cmd += ["-movflags", "+faststart", "-f", "mp4"]
+        cmd += ["-y", output_path]
+        result = self._run_process(cmd)
+        if result.returncode != 0:
+            logger.error(
+                f"FFmpeg failed to remux a range of {aax_file}: {result.stderr}"
+            )
+            return False
+        return True
 
     def get_duration(self, aax_file):
         """Get duration of AAX file in seconds using ffprobe."""
@@ -253,7 +537,13 @@ class AAXProcessor:
             return None
 
     def convert_to_m4b(
-        self, aax_file, output_path, activation_bytes, progress_callback=None
+        self,
+        aax_file,
+        output_path,
+        activation_bytes,
+        progress_callback=None,
+        process_callback=None,
+        layout=None,
     ):
         """
         Convert AAX file to M4B format using ffmpeg with progress tracking.
@@ -263,6 +553,8 @@ class AAXProcessor:
             output_path (str): Path for the output M4B file
             activation_bytes (str): Activation bytes for decryption
             progress_callback (callable): Function to call with progress updates
+            process_callback (callable): Called with the ffmpeg Popen object once started
+            layout (str): M4B layout from M4B_LAYOUTS, this processor's if not given
 
         Returns:
             bool: True if conversion successful, False otherwise
@@ -271,7 +563,9 @@ class AAXProcessor:
             logger.info(f"Converting {aax_file} to {output_path}")
 
             # Get total duration for progress calculation
+            started = time.monotonic()
             total_duration = self.get_duration(aax_file)
+            self._record_stage("probe", started)
             if not total_duration:
                 logger.warning("Could not get duration, progress will be estimated")
 
@@ -288,11 +582,29 @@ class AAXProcessor:
                 "0",  # Explicitly preserve chapters from input
                 "-progress",
                 "pipe:1",  # Output progress to stdout
+            ]
+            layout = layout or self.m4b_layout
+            if layout == "faststart":
+                # ffmpeg writes the moov into the reserved space once the
+                # audio is done, instead of +faststart's rewrite of the file
+                moov_size = estimate_moov_size(aax_file, total_duration)
+                cmd += ["-moov_size", str(moov_size)]
+            elif layout == "fragmented":
+                # An empty moov up front, then self-contained fragments, so
+                # every byte written is final and can be downloaded at once
+                cmd += [
+                    "-movflags",
+                    "+empty_moov+default_base_moof",
+                    "-frag_duration",
+                    str(M4B_FRAGMENT_SECONDS * 1000000),
+                ]
+            cmd += [
                 "-y",  # Overwrite output file if it exists
                 output_path,
             ]
 
             # Start ffmpeg process
+            started = time.monotonic()
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
@@ -300,7 +612,10 @@ class AAXProcessor:
                 text=True,
                 bufsize=1,
                 universal_newlines=True,
+                start_new_session=True,  # Own process group, so it can be signalled as a unit
             )
+            if process_callback:
+                process_callback(process)
 
             # Monitor progress
             progress_data = {}
@@ -335,7 +650,7 @@ class AAXProcessor:
                                     logger.info(
                                         "Conversion cancelled by progress callback"
                                     )
-                                    process.terminate()
+                                    terminate_process_group(process)
                                     return False
                             except (ValueError, ZeroDivisionError):
                                 pass
@@ -361,13 +676,14 @@ class AAXProcessor:
                                         logger.info(
                                             "Conversion cancelled by progress callback"
                                         )
-                                        process.terminate()
+                                        terminate_process_group(process)
                                         return False
                             except (ValueError, IndexError, ZeroDivisionError):
                                 pass
 
             # Wait for process to complete
             process.wait()
+            self._record_stage("remux", started)
 
             if process.returncode == 0:
                 logger.info(f"Successfully converted to {output_path}")
@@ -376,6 +692,19 @@ class AAXProcessor:
                 return True
             else:
                 stderr_output = process.stderr.read()
+                if layout == "faststart" and "moov_size is too small" in stderr_output:
+                    logger.warning(
+                        f"Reserved moov space was too small for {aax_file}, "
+                        "converting again with the moov at the end"
+                    )
+                    return self.convert_to_m4b(
+                        aax_file,
+                        output_path,
+                        activation_bytes,
+                        progress_callback=progress_callback,
+                        process_callback=process_callback,
+                        layout="standard",
+                    )
                 logger.error(
                     f"FFmpeg conversion failed with return code {process.returncode}"
                 )
@@ -401,6 +730,7 @@ class AAXProcessor:
         Returns:
             dict: Result containing success status and zip file path
         """
+        temp_dir = None
         try:
             logger.info(f"Converting {aax_file} to MP3 chapters in {output_dir}")
 
@@ -505,7 +835,18 @@ class AAXProcessor:
                 album_art_data = None
 
             # Create temporary directory for MP3 files
-            temp_dir = tempfile.mkdtemp()
+            base_name = os.path.splitext(os.path.basename(aax_file))[0]
+            estimate = estimate_mp3_bytes(
+                float(format_info.get("duration") or 0),
+                self.mp3_settings["bitrate"],
+                len(chapters),
+            )
+            temp_dir = scratch_space.reserve(
+                estimate,
+                prefix=f"{base_name}_mp3_",
+                output_dir=output_dir,
+                output_bytes=estimate,
+            )
             mp3_files = []
 
             total_chapters = len(chapters)
@@ -552,9 +893,9 @@ class AAXProcessor:
                     "-acodec",
                     "libmp3lame",
                     "-ab",
-                    "128k",
+                    self.mp3_settings["bitrate"],
                     "-ar",
-                    "44100",
+                    self.mp3_settings["sample_rate"],
                     "-y",
                     mp3_path,
                 ]
@@ -651,6 +992,10 @@ class AAXProcessor:
             base_name = os.path.splitext(os.path.basename(aax_file))[0]
             zip_filename = f"{base_name}_chapters.zip"
             zip_path = os.path.join(output_dir, zip_filename)
+            # Removed rather than truncated: it may be a hardlink shared with
+            # other books' outputs
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
 
             with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
                 for mp3_file in mp3_files:
@@ -662,7 +1007,6 @@ class AAXProcessor:
             for mp3_file in mp3_files:
                 if os.path.exists(mp3_file):
                     os.remove(mp3_file)
-            os.rmdir(temp_dir)
 
             if progress_callback:
                 progress_callback(100)
@@ -684,6 +1028,11 @@ class AAXProcessor:
         except Exception as e:
             logger.error(f"Error converting AAX to MP3 chapters: {e}")
             return {"success": False, "error": str(e)}
+        finally:
+            # Releases the scratch reservation, with any chapters left behind
+            # when a chapter or the zip failed
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
 
     def _convert_single_chapter(
         self,
@@ -696,6 +1045,7 @@ class AAXProcessor:
         progress_lock: threading.Lock,
         processed_count: list,  # Use list to make it mutable for threading
         progress_callback: Optional[Callable] = None,
+        process_callback: Optional[Callable] = None,
     ) -> Optional[str]:
         """
         Convert a single chapter to MP3 with metadata.
@@ -710,6 +1060,7 @@ class AAXProcessor:
             progress_lock: Threading lock for progress updates
             processed_count: List containing count of processed chapters
             progress_callback: Function to call with progress updates
+            process_callback: Called with the ffmpeg Popen object once started
 
         Returns:
             str: Path to the created MP3 file, or None if failed
@@ -761,14 +1112,14 @@ class AAXProcessor:
                 "-acodec",
                 "libmp3lame",
                 "-ab",
-                "128k",
+                self.mp3_settings["bitrate"],
                 "-ar",
-                "44100",
+                self.mp3_settings["sample_rate"],
                 "-y",
                 mp3_path,
             ]
 
-            result = subprocess.run(chapter_cmd, capture_output=True, text=True)
+            result = self._run_process(chapter_cmd, process_callback)
             if result.returncode != 0:
                 logger.error(f"FFmpeg failed for chapter {i + 1}: {result.stderr}")
                 raise subprocess.CalledProcessError(
@@ -872,6 +1223,7 @@ class AAXProcessor:
         temp_dir: str,
         album_art_data: Optional[bytes],
         total_chapters: int,
+        process_callback: Optional[Callable] = None,
     ) -> Optional[str]:
         """Task-safe wrapper for converting a single chapter."""
         chapter_data = {"index": chapter_index, "chapter": chapter, "tags": tags}
@@ -885,6 +1237,7 @@ class AAXProcessor:
             progress_lock=threading.Lock(),
             processed_count=[0],
             progress_callback=None,
+            process_callback=process_callback,
         )
 
     def convert_to_mp3_chapters_parallel(
@@ -908,6 +1261,7 @@ class AAXProcessor:
         Returns:
             dict: Result containing success status and zip file path
         """
+        temp_dir = None
         try:
             logger.info(
                 f"Converting {aax_file} to MP3 chapters (parallel) in {output_dir}"
@@ -922,6 +1276,7 @@ class AAXProcessor:
             logger.info(f"Using {max_workers} parallel workers for chapter conversion")
 
             # First, extract metadata and chapters using ffprobe
+            started = time.monotonic()
             metadata_cmd = [
                 "ffprobe",
                 "-activation_bytes",
@@ -946,11 +1301,13 @@ class AAXProcessor:
             format_info = metadata.get("format", {})
             tags = format_info.get("tags", {})
             chapters = metadata.get("chapters", [])
+            self._record_stage("probe", started)
 
             if not chapters:
                 return {"success": False, "error": "No chapters found in AAX file"}
 
             # Extract album art using the more reliable method
+            started = time.monotonic()
             album_art_data = None
             try:
                 with tempfile.NamedTemporaryFile(
@@ -1021,8 +1378,21 @@ class AAXProcessor:
                 logger.error(f"Error extracting album art: {e}")
                 album_art_data = None
 
+            self._record_stage("cover", started)
+
             # Create temporary directory for MP3 files
-            temp_dir = tempfile.mkdtemp()
+            base_name = os.path.splitext(os.path.basename(aax_file))[0]
+            estimate = estimate_mp3_bytes(
+                float(format_info.get("duration") or 0),
+                self.mp3_settings["bitrate"],
+                len(chapters),
+            )
+            temp_dir = scratch_space.reserve(
+                estimate,
+                prefix=f"{base_name}_mp3_",
+                output_dir=output_dir,
+                output_bytes=estimate,
+            )
             total_chapters = len(chapters)
 
             # Prepare chapter data for parallel processing
@@ -1036,6 +1406,7 @@ class AAXProcessor:
             processed_count = [0]  # Use list to make it mutable for threading
 
             # Process chapters in parallel
+            started = time.monotonic()
             mp3_files = []
             failed_chapters = []
 
@@ -1074,6 +1445,8 @@ class AAXProcessor:
                         )
                         failed_chapters.append(chapter_index + 1)
 
+            self._record_stage("encode", started)
+
             # Log any failed chapters
             if failed_chapters:
                 logger.warning(f"Failed to convert chapters: {failed_chapters}")
@@ -1082,9 +1455,14 @@ class AAXProcessor:
             mp3_files.sort()
 
             # Create zip file
+            started = time.monotonic()
             base_name = os.path.splitext(os.path.basename(aax_file))[0]
             zip_filename = f"{base_name}_chapters.zip"
             zip_path = os.path.join(output_dir, zip_filename)
+            # Removed rather than truncated: it may be a hardlink shared with
+            # other books' outputs
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
 
             with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
                 for mp3_file in mp3_files:
@@ -1096,7 +1474,7 @@ class AAXProcessor:
             for mp3_file in mp3_files:
                 if os.path.exists(mp3_file):
                     os.remove(mp3_file)
-            os.rmdir(temp_dir)
+            self._record_stage("package", started)
 
             if progress_callback:
                 progress_callback(100)
@@ -1125,3 +1503,8 @@ class AAXProcessor:
         except Exception as e:
             logger.error(f"Error converting AAX to MP3 chapters (parallel): {e}")
             return {"success": False, "error": str(e)}
+        finally:
+            # Releases the scratch reservation, with any chapters left behind
+            # when a chapter or the zip failed
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
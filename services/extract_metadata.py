@@ -17,7 +17,8 @@ class AudiobookMetadataExtractor:
         self.input_file = Path(input_file)
         self.metadata = {}
 
-    def format_duration(self, seconds):
+    @staticmethod
+    def format_duration(seconds):
         """Convert seconds to readable format with appropriate units"""
         try:
             seconds = float(seconds)
@@ -50,7 +51,8 @@ class AudiobookMetadataExtractor:
         except (ValueError, TypeError):
             return "Unknown"
 
-    def format_bitrate(self, bitrate):
+    @staticmethod
+    def format_bitrate(bitrate):
         """Format bitrate to readable format"""
         try:
             bitrate = int(bitrate)
@@ -68,7 +70,8 @@ class AudiobookMetadataExtractor:
         except (ValueError, TypeError):
             return "Unknown"
 
-    def format_file_size(self, size_bytes):
+    @staticmethod
+    def format_file_size(size_bytes):
         """Format file size to MB format like AAX info"""
         try:
             size_bytes = int(size_bytes)
@@ -227,6 +230,26 @@ class AudiobookMetadataExtractor:
                 logger.error(f"Error extracting album art: {e}")
                 return ""
 
+    def save_album_art(self, output_path):
+        """Write the embedded cover to output_path; False if there is none"""
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-i",
+            str(self.input_file),
+            "-an",
+            "-vcodec",
+            "copy",
+            "-map",
+            "0:v:0",
+            str(output_path),
+        ]
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode != 0:
+            logger.warning(f"No album art extracted from {self.input_file.name}")
+            return False
+        return True
+
     def get_complete_metadata_using_activation_bytes(self, activation_bytes):
         """Extract all metadata using ffprobe"""
         try:
@@ -261,8 +284,13 @@ class AudiobookMetadataExtractor:
             logger.error(f"Error parsing metadata: {e}")
             return False
 
-    def get_complete_metadata(self) -> AudiobookMetadata:
-        """Get complete metadata"""
+    def get_complete_metadata(self, album_art=None) -> AudiobookMetadata:
+        """
+        Get complete metadata
+
+        Args:
+            album_art (str): Base64 cover to use instead of extracting it with ffmpeg
+        """
         chapters = []
         if "chapters" in self.metadata:
             for chapter in self.metadata["chapters"]:
@@ -296,6 +324,8 @@ class AudiobookMetadataExtractor:
             size=int(self.metadata["format"]["size"]),
             size_formatted=self.format_file_size(int(self.metadata["format"]["size"])),
             chapters=chapters,
-            album_art=self.get_album_in_base64_string(),
+            album_art=(
+                self.get_album_in_base64_string() if album_art is None else album_art
+            ),
             raw_metadata=self.metadata,
         )
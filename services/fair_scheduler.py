@@ -0,0 +1,397 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import logger
+
+# Chapter tasks released to the broker at once, across all jobs. Keep it a
+# little above the encode workers' total concurrency so no worker idles.
+FAIR_SHARE_SLOTS = int(os.getenv("FAIR_SHARE_SLOTS", "8"))
+# "fair" interleaves jobs and users, "fifo" releases jobs in arrival order
+FAIR_SHARE_POLICY = os.getenv("FAIR_SHARE_POLICY", "fair")
+# Maximum chapters in flight per user, 0 for no quota
+FAIR_SHARE_USER_QUOTA = int(os.getenv("FAIR_SHARE_USER_QUOTA", "0"))
+# Jobs with items in flight but none reported finished for this long are
+# taken to have lost a report; they are dropped and their conversions failed
+FAIR_SHARE_JOB_IDLE_SECONDS = float(os.getenv("FAIR_SHARE_JOB_IDLE_SECONDS", "3600"))
+
+DEFAULT_OWNER = "anonymous"
+
+# A unit of released work: (job id, item index)
+Release = Tuple[str, int]
+
+
+class SchedulerStore(ABC):
+    """Storage for scheduler state shared by every process that releases work"""
+
+    @abstractmethod
+    def locked(self) -> Iterator[Dict[str, Any]]:
+        """Context manager holding the scheduler lock, yielding the mutable state"""
+
+    @abstractmethod
+    def save_spec(self, job_id: str, spec: Dict[str, Any]):
+        """Store what is needed to build a job's tasks"""
+
+    @abstractmethod
+    def load_spec(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Load a job's spec, None if the job is unknown"""
+
+    @abstractmethod
+    def add_result(self, job_id: str, result: Dict[str, Any]):
+        """Append the result of one finished item"""
+
+    @abstractmethod
+    def get_results(self, job_id: str) -> List[Dict[str, Any]]:
+        """Results of all finished items of a job"""
+
+    @abstractmethod
+    def delete_job(self, job_id: str):
+        """Drop a job's spec and results"""
+
+
+class InMemorySchedulerStore(SchedulerStore):
+    """Process-local store, for simulations and single-process use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+        self._specs: Dict[str, Dict[str, Any]] = {}
+        self._results: Dict[str, List[Dict[str, Any]]] = {}
+
+    @contextmanager
+    def locked(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            yield self._state
+
+    def save_spec(self, job_id, spec):
+        self._specs[job_id] = spec
+
+    def load_spec(self, job_id):
+        return self._specs.get(job_id)
+
+    def add_result(self, job_id, result):
+        self._results.setdefault(job_id, []).append(result)
+
+    def get_results(self, job_id):
+        return list(self._results.get(job_id, []))
+
+    def delete_job(self, job_id):
+        self._specs.pop(job_id, None)
+        self._results.pop(job_id, None)
+
+
+class RedisSchedulerStore(SchedulerStore):
+    """
+    Store shared by the web process and all Celery workers.
+
+    The scheduling state is one small JSON document guarded by a Redis lock;
+    it is only touched when a job is submitted, cancelled or finishes an
+    item, so the lock is never hot. Specs and results live in their own keys
+    so the state stays small however large the jobs are.
+    """
+
+    STATE_KEY = "fair_scheduler:state"
+    LOCK_KEY = "fair_scheduler:lock"
+    SPEC_PREFIX = "fair_scheduler:spec"
+    RESULTS_PREFIX = "fair_scheduler:results"
+    JOB_TTL = 60 * 60 * 24
+
+    def __init__(self, redis_url: Optional[str] = None, client=None):
+        import redis
+
+        self.client = client or redis.Redis.from_url(
+            redis_url or os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+            decode_responses=True,
+        )
+
+    @contextmanager
+    def locked(self) -> Iterator[Dict[str, Any]]:
+        with self.client.lock(self.LOCK_KEY, timeout=30, blocking_timeout=30):
+            raw = self.client.get(self.STATE_KEY)
+            state = json.loads(raw) if raw else {}
+            yield state
+            self.client.set(self.STATE_KEY, json.dumps(state))
+
+    def save_spec(self, job_id, spec):
+        self.client.set(
+            f"{self.SPEC_PREFIX}:{job_id}", json.dumps(spec), ex=self.JOB_TTL
+        )
+
+    def load_spec(self, job_id):
+        raw = self.client.get(f"{self.SPEC_PREFIX}:{job_id}")
+        return json.loads(raw) if raw else None
+
+    def add_result(self, job_id, result):
+        key = f"{self.RESULTS_PREFIX}:{job_id}"
+        pipe = self.client.pipeline()
+        pipe.rpush(key, json.dumps(result))
+        pipe.expire(key, self.JOB_TTL)
+        pipe.execute()
+
+    def get_results(self, job_id):
+        return [
+            json.loads(raw)
+            for raw in self.client.lrange(f"{self.RESULTS_PREFIX}:{job_id}", 0, -1)
+        ]
+
+    def delete_job(self, job_id):
+        self.client.delete(
+            f"{self.SPEC_PREFIX}:{job_id}", f"{self.RESULTS_PREFIX}:{job_id}"
+        )
+
+
+class FairShareScheduler:
+    """
+    Release the items of many jobs to workers in a fair order.
+
+    Jobs are submitted with all their items pending, and only `slots` items
+    are in flight at any time. Whenever a slot frees up, the next item comes
+    from the user with the least service so far, and within that user from
+    the job with the least service relative to its weight (stride
+    scheduling). Equal weights give plain round robin; a new job starts level
+    with the jobs already running, so it is served right away without
+    jumping ahead of everyone. With the "fifo" policy items are released in
+    arrival order instead, which reproduces a plain queue for comparison.
+
+    The scheduler only decides what to release; callers send the released
+    items to workers and report each finished item back with complete().
+    on_expire is called with the id of every job dropped as idle.
+    """
+
+    POLICIES = ("fair", "fifo")
+
+    def __init__(
+        self,
+        store: SchedulerStore,
+        slots: int = FAIR_SHARE_SLOTS,
+        policy: str = FAIR_SHARE_POLICY,
+        user_quota: int = FAIR_SHARE_USER_QUOTA,
+        idle_timeout: float = FAIR_SHARE_JOB_IDLE_SECONDS,
+        clock: Callable[[], float] = time.time,
+        on_expire: Optional[Callable[[str], None]] = None,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.store = store
+        self.slots = max(slots, 1)
+        self.policy = policy
+        self.user_quota = user_quota
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.on_expire = on_expire
+
+    def submit(
+        self,
+        job_id: str,
+        item_count: int,
+        owner: Optional[str] = None,
+        weight: float = 1.0,
+        spec: Optional[Dict[str, Any]] = None,
+    ) -> List[Release]:
+        """
+        Add a job with item_count pending items.
+
+        Returns:
+            list: Items to send to workers now
+        """
+        if spec is not None:
+            self.store.save_spec(job_id, spec)
+
+        owner = owner or DEFAULT_OWNER
+        with self.store.locked() as state:
+            jobs = state.setdefault("jobs", {})
+            owners = state.setdefault("owners", {})
+            seq = state.get("seq", 0)
+            state["seq"] = seq + 1
+
+            if owner not in owners or not self._owner_has_pending(jobs, owner):
+                # Join at the current level instead of the saved pass, so
+                # an idle user neither hoards credit nor is penalised
+                owners[owner] = {"pass": self._min_pass(owners, jobs), "seq": seq}
+
+            jobs[job_id] = {
+                "owner": owner,
+                "weight": max(float(weight), 0.01),
+                "pending": list(range(item_count)),
+                "in_flight": 0,
+                "done": [],
+                "total": item_count,
+                "pass": self._min_job_pass(jobs, owner),
+                "seq": seq,
+                "updated": self.clock(),
+            }
+            logger.info(f"Scheduled job {job_id} with {item_count} items for {owner}")
+            return self._release(state)
+
+    def complete(
+        self, job_id: str, index: int, result: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[Release], bool]:
+        """
+        Report one finished item, successful or not.
+
+        Redelivered items are only counted once.
+
+        Returns:
+            tuple: Items to send to workers now, and whether this completed
+            the job (only ever True for one caller)
+        """
+        with self.store.locked() as state:
+            job = state.get("jobs", {}).get(job_id)
+            if job is None:
+                # Cancelled or expired: its slots were already given back
+                return self._release(state), False
+
+            finished = False
+            if index not in job["done"]:
+                job["done"].append(index)
+                job["in_flight"] = max(job["in_flight"] - 1, 0)
+                job["updated"] = self.clock()
+                if result is not None:
+                    self.store.add_result(job_id, result)
+                if len(job["done"]) >= job["total"]:
+                    del state["jobs"][job_id]
+                    finished = True
+
+            return self._release(state), finished
+
+    def cancel(self, job_id: str) -> List[Release]:
+        """
+        Drop a job and give its slots to the others.
+
+        Returns:
+            list: Items of other jobs to send to workers now
+        """
+        with self.store.locked() as state:
+            removed = state.get("jobs", {}).pop(job_id, None)
+            released = self._release(state)
+        self.store.delete_job(job_id)
+        if removed is not None:
+            logger.info(f"Removed job {job_id} from the scheduler")
+        return released
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per-job pending, in-flight and done counts, for monitoring"""
+        with self.store.locked() as state:
+            return {
+                job_id: {
+                    "owner": job["owner"],
+                    "pending": len(job["pending"]),
+                    "in_flight": job["in_flight"],
+                    "done": len(job["done"]),
+                    "total": job["total"],
+                }
+                for job_id, job in state.get("jobs", {}).items()
+            }
+
+    @staticmethod
+    def _owner_has_pending(jobs: Dict[str, Any], owner: str) -> bool:
+        return any(job["owner"] == owner and job["pending"] for job in jobs.values())
+
+    @staticmethod
+    def _min_pass(owners: Dict[str, Any], jobs: Dict[str, Any]) -> float:
+        waiting = {job["owner"] for job in jobs.values() if job["pending"]}
+        return min(
+            (owners[owner]["pass"] for owner in waiting if owner in owners),
+            default=0.0,
+        )
+
+    @staticmethod
+    def _min_job_pass(jobs: Dict[str, Any], owner: str) -> float:
+        return min(
+            (
+                job["pass"]
+                for job in jobs.values()
+                if job["owner"] == owner and job["pending"]
+            ),
+            default=0.0,
+        )
+
+    def _expire_idle(self, state: Dict[str, Any]):
+        """
+        Drop jobs whose items were released but not one reported finished
+        for idle_timeout, e.g. because a worker lost a report: their in-flight
+        count would hold slots forever. Jobs only waiting for slots are kept.
+        """
+        cutoff = self.clock() - self.idle_timeout
+        jobs = state.get("jobs", {})
+        for job_id in [
+            job_id
+            for job_id, job in jobs.items()
+            if (job["in_flight"] or not job["pending"]) and job["updated"] < cutoff
+        ]:
+            logger.warning(f"Dropping idle job {job_id} from the scheduler")
+            del jobs[job_id]
+            if self.on_expire is not None:
+                try:
+                    self.on_expire(job_id)
+                except Exception as e:
+                    logger.error(f"Could not fail idle job {job_id}: {e}")
+
+    def _release(self, state: Dict[str, Any]) -> List[Release]:
+        """Pick items to fill the free slots; must be called with the lock held"""
+        self._expire_idle(state)
+        jobs = state.get("jobs", {})
+        owners = state.setdefault("owners", {})
+
+        in_flight = sum(job["in_flight"] for job in jobs.values())
+        owner_in_flight: Dict[str, int] = {}
+        for job in jobs.values():
+            owner_in_flight[job["owner"]] = (
+                owner_in_flight.get(job["owner"], 0) + job["in_flight"]
+            )
+
+        released: List[Release] = []
+        while in_flight < self.slots:
+            candidates = [
+                (job_id, job)
+                for job_id, job in jobs.items()
+                if job["pending"]
+                and not (
+                    self.user_quota
+                    and owner_in_flight.get(job["owner"], 0) >= self.user_quota
+                )
+            ]
+            if not candidates:
+                break
+
+            if self.policy == "fifo":
+                job_id, job = min(candidates, key=lambda c: c[1]["seq"])
+            else:
+                owner = min(
+                    {job["owner"] for _, job in candidates},
+                    key=lambda o: (owners[o]["pass"], owners[o]["seq"]),
+                )
+                job_id, job = min(
+                    (c for c in candidates if c[1]["owner"] == owner),
+                    key=lambda c: (c[1]["pass"], c[1]["seq"]),
+                )
+                owners[owner]["pass"] += 1.0
+                job["pass"] += 1.0 / job["weight"]
+
+            released.append((job_id, job["pending"].pop(0)))
+            job["in_flight"] += 1
+            job["updated"] = self.clock()
+            in_flight += 1
+            owner_in_flight[job["owner"]] = owner_in_flight.get(job["owner"], 0) + 1
+
+        # Forget users with nothing left, so the state stays small
+        active_owners = {job["owner"] for job in jobs.values()}
+        for owner in [o for o in owners if o not in active_owners]:
+            del owners[owner]
+        return released
+
+
+def create_scheduler(
+    name: Optional[str] = None, on_expire: Optional[Callable[[str], None]] = None
+) -> FairShareScheduler:
+    """Build the scheduler with the store selected by FAIR_SHARE_STORE"""
+    name = (name or os.getenv("FAIR_SHARE_STORE", "redis")).lower()
+    if name == "redis":
+        return FairShareScheduler(RedisSchedulerStore(), on_expire=on_expire)
+    if name == "memory":
+        return FairShareScheduler(InMemorySchedulerStore(), on_expire=on_expire)
+    raise ValueError(f"Unknown scheduler store: {name}")
@@ -0,0 +1,160 @@
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+from typing import List, Optional
+
+from config import logger
+from models import ACTIVE_STATUSES
+
+from .conversion_service import conversion_service
+
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "15"))
+# How quickly a running step notices that its conversion was cancelled
+CANCEL_POLL_INTERVAL_SECONDS = float(os.getenv("CANCEL_POLL_INTERVAL_SECONDS", "0.5"))
+
+
+def current_worker_id() -> str:
+    """Identify this worker process as host:pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ConversionHeartbeat:
+    """
+    Report liveness for a conversion while a worker runs one step of it.
+
+    Used as a context manager around each task body. Entering takes a lease
+    on the conversion and a background thread heartbeats every interval, even
+    while a long ffmpeg encode reports no progress. Exiting releases the
+    lease, so a job whose steps are only waiting in the queue is never
+    mistaken for a dead one.
+
+    Between heartbeats the thread polls the conversion status. Once the
+    conversion is cancelled, failed (e.g. reaped) or superseded by a requeued
+    attempt, every process the step started is killed along with its process
+    group, which frees the worker slot within one poll, and cancelled is set
+    so the step stops.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        conversion_type: str,
+        task_id: Optional[str] = None,
+        interval: float = HEARTBEAT_INTERVAL_SECONDS,
+        poll_interval: float = CANCEL_POLL_INTERVAL_SECONDS,
+    ):
+        self.filename = filename
+        self.conversion_type = conversion_type
+        self.task_id = task_id
+        self.interval = interval
+        self.poll_interval = min(poll_interval, interval)
+        self.worker_id = current_worker_id()
+        self.ffmpeg_pid: Optional[int] = None
+        self._processes: List[subprocess.Popen] = []
+        # Attempt of the conversion this step belongs to, from the first poll
+        self._attempt: Optional[int] = None
+        self._cancelled = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def beat(self, lease_delta: int = 0):
+        """Send one heartbeat, never raising into the conversion"""
+        try:
+            conversion_service.record_heartbeat(
+                self.filename,
+                self.conversion_type,
+                self.worker_id,
+                self.task_id,
+                self.ffmpeg_pid,
+                lease_delta,
+            )
+        except Exception as e:
+            logger.warning(f"Heartbeat failed for {self.filename}: {e}")
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check_cancelled(self) -> bool:
+        """
+        Poll the conversion status, stopping this step's processes once the
+        conversion is no longer running. Completed conversions are left
+        alone: the step that completed them may still be in this context.
+        """
+        if self._cancelled.is_set():
+            return True
+        try:
+            progress = conversion_service.get_progress(
+                self.filename, self.conversion_type
+            )
+        except Exception as e:
+            logger.warning(f"Cancellation check failed for {self.filename}: {e}")
+            return False
+        status = progress["status"]
+        attempt = int(progress.get("attempts") or 1)
+        if self._attempt is None:
+            self._attempt = attempt
+        if attempt != self._attempt:
+            status = f"superseded by attempt {attempt}"
+        elif status in ACTIVE_STATUSES or status == "completed":
+            return False
+
+        logger.info(
+            f"{self.conversion_type} conversion of {self.filename} is {status}, "
+            f"stopping this step"
+        )
+        self._cancelled.set()
+        self._kill_processes()
+        return True
+
+    def _kill_processes(self):
+        for process in self._processes:
+            if process.poll() is not None:
+                continue
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+                logger.info(f"Killed process group {process.pid} of {self.filename}")
+            except ProcessLookupError:
+                pass
+
+    def process_started(self, process: subprocess.Popen):
+        """Process callback for AAXProcessor: report the running ffmpeg PID"""
+        self._processes = [p for p in self._processes if p.poll() is None]
+        self._processes.append(process)
+        if self._cancelled.is_set():
+            self._kill_processes()
+            return
+        self.ffmpeg_pid = process.pid
+        self.beat()
+
+    def _run(self):
+        next_beat = time.monotonic() + self.interval
+        while not self._stop.wait(self.poll_interval):
+            if self.check_cancelled():
+                return
+            if time.monotonic() >= next_beat:
+                self.beat()
+                next_beat = time.monotonic() + self.interval
+
+    def __enter__(self):
+        self.beat(lease_delta=1)
+        if self.check_cancelled():
+            return self
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"heartbeat_{self.conversion_type}_{self.filename}",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+        self.ffmpeg_pid = None
+        self.beat(lease_delta=-1)
+        return False
@@ -0,0 +1,368 @@
+import base64
+import concurrent.futures
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import logger
+from models import AudiobookMetadata, Book, LibraryStore, index_fields
+
+from .extract_activation_bytes import AAXProcessor
+from .extract_metadata import AudiobookMetadataExtractor
+
+# Directories watched for new AAX files, comma separated
+INGEST_DIRS = [d for d in os.getenv("INGEST_DIRS", "uploads").split(",") if d]
+# A file is ingested once its size and mtime have not changed for this long,
+# so half-copied files from SMB or rsync are never probed
+INGEST_SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", "5"))
+# "auto" uses inotify and falls back to polling if it fails, "poll" always
+# polls (needed for network mounts whose writes happen on another host)
+INGEST_WATCH_MODE = os.getenv("INGEST_WATCH_MODE", "auto").lower()
+INGEST_POLL_INTERVAL_MS = int(os.getenv("INGEST_POLL_INTERVAL_MS", "1000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Conversion types queued for every newly ingested book, comma separated
+INGEST_AUTO_CONVERT = [t for t in os.getenv("INGEST_AUTO_CONVERT", "").split(",") if t]
+COVERS_DIR = os.getenv("COVERS_DIR", "covers")
+# An ingest claimed this long ago is taken to have died with its worker
+INGEST_TIMEOUT_SECONDS = float(os.getenv("INGEST_TIMEOUT_SECONDS", "1800"))
+
+
+class IngestPipeline:
+    """
+    Prepare one AAX file for the library.
+
+    Ingesting a file resolves its checksum and activation bytes, stores the
+    decrypted ffprobe output, extracts the cover into COVERS_DIR and
+    optionally queues conversions. Results are kept in the books table,
+    keyed on the file's absolute path and invalidated when its size or
+    mtime change.
+    """
+
+    def __init__(
+        self,
+        store: Optional[LibraryStore] = None,
+        covers_dir: str = COVERS_DIR,
+        auto_convert: Optional[List[str]] = None,
+    ):
+        self._store = store
+        self.covers_dir = covers_dir
+        self.auto_convert = (
+            INGEST_AUTO_CONVERT if auto_convert is None else auto_convert
+        )
+
+    @property
+    def store(self) -> LibraryStore:
+        if self._store is None:
+            self._store = LibraryStore()
+        return self._store
+
+    def register(self, path: str) -> Optional[Book]:
+        """
+        Record a file's current identity.
+
+        Returns:
+            Book: The book if it needs ingesting, None if it is up to date or gone
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.store.remove_file(path)
+            return None
+
+        book = self.store.register_file(
+            path, os.path.basename(path), stat.st_size, stat.st_mtime
+        )
+        return book if book.ingest_status == "pending" else None
+
+    @staticmethod
+    def _is_current(book: Optional[Book], path: str) -> bool:
+        """True if the book was registered with the file's current size and mtime"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return book is not None and (book.size, book.mtime) == (
+            stat.st_size,
+            stat.st_mtime,
+        )
+
+    def current_book(self, path: str) -> Optional[Book]:
+        book = self.store.get_book(os.path.abspath(path))
+        return book if self._is_current(book, path) else None
+
+    def metadata_for(self, book: Book, include_cover: bool = True) -> AudiobookMetadata:
+        """
+        Build a ready book's metadata from its stored probe output and cover.
+
+        Args:
+            include_cover (bool): Embed the cover as base64; pages that link
+                to /covers instead leave album_art empty
+        """
+        extractor = AudiobookMetadataExtractor(book.path)
+        extractor.metadata = json.loads(book.probe_json)
+        album_art = ""
+        if include_cover and book.cover_path and os.path.exists(book.cover_path):
+            with open(book.cover_path, "rb") as f:
+                album_art = base64.b64encode(f.read()).decode("utf-8")
+        return extractor.get_complete_metadata(album_art=album_art)
+
+    def forget(self, path: str):
+        """Drop a deleted file's book and cover"""
+        book = self.store.get_book(os.path.abspath(path))
+        if book is None:
+            return
+        if book.cover_path and os.path.exists(book.cover_path):
+            os.remove(book.cover_path)
+        self.store.remove_file(book.path)
+        logger.info(f"Removed {book.filename} from the library")
+
+    def ingest(self, path: str) -> bool:
+        """
+        Run every ingest step for a registered, pending file.
+
+        Returns:
+            bool: True if the book is now ready
+        """
+        path = os.path.abspath(path)
+        if not self.store.claim_ingest(path):
+            return False
+        filename = os.path.basename(path)
+        timings: Dict[str, float] = {}
+
+        started = time.monotonic()
+        try:
+            key = AAXProcessor().get_activation_bytes(path)
+        except Exception as e:
+            key = {"error": str(e)}
+        timings["key"] = time.monotonic() - started
+        if "error" in key:
+            self.store.fail_ingest(
+                path, f"Could not get activation bytes: {key['error']}"
+            )
+            logger.warning(f"Ingest of {filename} failed: {key['error']}")
+            return False
+
+        started = time.monotonic()
+        extractor = AudiobookMetadataExtractor(path)
+        if not extractor.get_complete_metadata_using_activation_bytes(
+            key["activation_bytes"]
+        ):
+            self.store.fail_ingest(path, "Could not read metadata")
+            return False
+        timings["metadata"] = time.monotonic() - started
+
+        started = time.monotonic()
+        book = self.store.get_book(path)
+        os.makedirs(self.covers_dir, exist_ok=True)
+        cover_path = os.path.join(self.covers_dir, f"{book.id}.jpg")
+        if not extractor.save_album_art(cover_path):
+            cover_path = None
+        timings["cover"] = time.monotonic() - started
+
+        if not self.store.finish_ingest(
+            path,
+            checksum=key["checksum"],
+            activation_bytes=key["activation_bytes"],
+            probe_json=json.dumps(extractor.metadata),
+            cover_path=cover_path,
+            **index_fields(filename, extractor.metadata),
+        ):
+            logger.info(f"{filename} changed while being ingested, will retry")
+            return False
+
+        logger.info(
+            f"Ingested {filename} in {sum(timings.values()):.1f}s ("
+            + ", ".join(f"{step} {seconds:.1f}s" for step, seconds in timings.items())
+            + ")"
+        )
+        self._auto_convert(path)
+        return True
+
+    def _auto_convert(self, path: str):
+        if not self.auto_convert:
+            return
+        if os.path.dirname(path) != os.path.abspath("uploads"):
+            # Conversions read their source from uploads/
+            logger.info(f"Not auto-converting {path}: not in uploads")
+            return
+
+        # Imported here so the pipeline can run without Celery configured
+        from tasks.conversion_tasks import enqueue_conversion
+
+        for conversion_type in self.auto_convert:
+            try:
+                task_id = enqueue_conversion(os.path.basename(path), conversion_type)
+            except Exception as e:
+                logger.error(f"Could not queue {conversion_type} of {path}: {e}")
+                continue
+            if task_id:
+                logger.info(f"Queued {conversion_type} conversion of {path}")
+
+
+class IngestDaemon:
+    """
+    Watch directories and ingest AAX files as they arrive.
+
+    Changes are reported by inotify through watchfiles, or by polling when
+    inotify is unavailable. A changed file is only ingested after its size
+    and mtime have been stable for settle_seconds.
+    """
+
+    def __init__(
+        self,
+        pipeline: Optional[IngestPipeline] = None,
+        directories: Optional[List[str]] = None,
+        settle_seconds: float = INGEST_SETTLE_SECONDS,
+        watch_mode: str = INGEST_WATCH_MODE,
+        workers: int = INGEST_WORKERS,
+    ):
+        self.pipeline = pipeline or IngestPipeline()
+        self.directories = [os.path.abspath(d) for d in directories or INGEST_DIRS]
+        self.settle_seconds = settle_seconds
+        self.watch_mode = watch_mode
+        self.workers = workers
+        # Path -> (size, mtime) when last seen changing, and since when stable
+        self._settling: Dict[str, Tuple[Optional[Tuple[int, float]], float]] = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def _aax_files(self) -> List[str]:
+        files = []
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                files.extend(
+                    entry.path
+                    for entry in entries
+                    if entry.name.endswith(".aax") and entry.is_file()
+                )
+        return files
+
+    def scan(self):
+        """Pick up files that arrived while the daemon was not running"""
+        present = set(self._aax_files())
+        for book in self.pipeline.store.get_books():
+            if (
+                os.path.dirname(book.path) in self.directories
+                and book.path not in present
+            ):
+                self.pipeline.forget(book.path)
+        for path in present:
+            self._track(path)
+        logger.info(f"Watching {len(present)} AAX files in {self.directories}")
+
+    def _track(self, path: str):
+        with self._lock:
+            self._settling[path] = (None, time.monotonic())
+
+    def _settle(self):
+        """Ingest files whose identity has stopped changing"""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, (identity, since) in list(self._settling.items()):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del self._settling[path]
+                    continue
+                current = (stat.st_size, stat.st_mtime)
+                if current != identity:
+                    self._settling[path] = (current, now)
+                elif now - since >= self.settle_seconds:
+                    del self._settling[path]
+                    ready.append(path)
+
+        for path in ready:
+            self._submit(path)
+
+    def _submit(self, path: str):
+        with self._lock:
+            if path in self._in_flight:
+                # Changed again while ingesting; check it once more afterwards
+                self._settling[path] = (None, time.monotonic())
+                return
+            if self.pipeline.register(path) is None:
+                return
+            self._in_flight.add(path)
+        self._executor.submit(self._ingest, path)
+
+    def _ingest(self, path: str):
+        try:
+            self.pipeline.ingest(path)
+        except Exception as e:
+            logger.error(f"Ingest of {path} failed: {e}")
+            self.pipeline.store.fail_ingest(path, str(e))
+        finally:
+            with self._lock:
+                self._in_flight.discard(path)
+
+    def _handle_changes(self, changes):
+        from watchfiles import Change
+
+        for change, path in changes:
+            if change == Change.deleted:
+                with self._lock:
+                    self._settling.pop(path, None)
+                self.pipeline.forget(path)
+            else:
+                self._track(path)
+
+    def _reset_stale_claims(self):
+        # Younger claims may belong to Celery ingest tasks still running
+        self.pipeline.store.reset_interrupted(
+            claimed_before=datetime.utcnow() - timedelta(seconds=INGEST_TIMEOUT_SECONDS)
+        )
+
+    def run_once(self):
+        """Ingest every new or changed file now, without waiting for changes"""
+        self._reset_stale_claims()
+        self.scan()
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            self._executor = executor
+            with self._lock:
+                paths = list(self._settling)
+                self._settling.clear()
+            for path in paths:
+                self._submit(path)
+
+    def run(self, stop_event: Optional[threading.Event] = None):
+        """Watch until stop_event is set"""
+        import watchfiles
+
+        self._reset_stale_claims()
+        force_polling = self.watch_mode == "poll"
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            self._executor = executor
+            self.scan()
+            while True:
+                try:
+                    for changes in watchfiles.watch(
+                        *self.directories,
+                        watch_filter=lambda change, path: path.endswith(".aax"),
+                        stop_event=stop_event,
+                        force_polling=force_polling,
+                        poll_delay_ms=INGEST_POLL_INTERVAL_MS,
+                        recursive=False,
+                        # Wake up every second to check settling files
+                        rust_timeout=1000,
+                        yield_on_timeout=True,
+                        raise_interrupt=False,
+                    ):
+                        self._handle_changes(changes)
+                        self._settle()
+                    return
+                except (OSError, RuntimeError) as e:
+                    if force_polling or self.watch_mode != "auto":
+                        raise
+                    # e.g. the inotify watch limit is reached
+                    logger.warning(f"inotify unavailable ({e}), polling instead")
+                    force_polling = True
+
+
+# Global instance
+ingest_pipeline = IngestPipeline()
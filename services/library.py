@@ -0,0 +1,396 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from config import logger
+from models import LIBRARY_SORTS, Book, BookSummary
+
+from .batch_service import output_path
+from .extract_metadata import AudiobookMetadataExtractor
+from .ingest import IngestPipeline, ingest_pipeline
+from .thread_manager import thread_manager
+
+# How often the web process rescans the uploads directory
+LIBRARY_RECONCILE_SECONDS = float(os.getenv("LIBRARY_RECONCILE_SECONDS", "10"))
+LIBRARY_PAGE_SIZE = int(os.getenv("LIBRARY_PAGE_SIZE", "48"))
+LIBRARY_MAX_PAGE_SIZE = 500
+
+# Fields of a book in the JSON API, selectable with ?fields=
+API_FIELDS = (
+    "id",
+    "filename",
+    "title",
+    "author",
+    "duration",
+    "bitrate",
+    "chapter_count",
+    "size",
+    "ingest_status",
+    "cover_url",
+    "downloads",
+)
+# /api/books/{id} adds the fields that need the stored probe output
+API_DETAIL_FIELDS = API_FIELDS + ("checksum", "ingest_error", "chapters")
+
+
+def _select_fields(fields: Optional[str], allowed: Tuple[str, ...]) -> List[str]:
+    if not fields:
+        return list(allowed)
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(selected) - set(allowed))
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {', '.join(unknown)}, expected any of {', '.join(allowed)}"
+        )
+    return selected
+
+
+def _encode_cursor(position: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        position = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+class LibraryIndex:
+    """
+    The books of one directory, listed from the books table.
+
+    Listing never touches the filesystem. Instead a background thread
+    reconciles the directory with the table every reconcile_seconds: one
+    scandir is compared against the stored size and mtime of each file, and
+    only new, changed or removed files and outputs that appeared or went
+    stale cause a write.
+    """
+
+    def __init__(
+        self,
+        pipeline: Optional[IngestPipeline] = None,
+        directory: str = "uploads",
+        reconcile_seconds: float = LIBRARY_RECONCILE_SECONDS,
+    ):
+        self.pipeline = pipeline or ingest_pipeline
+        self.directory = directory
+        self.reconcile_seconds = reconcile_seconds
+        self._last_reconcile: Optional[float] = None
+        self._on_pending: Optional[Callable[[str], Any]] = None
+        self._started = False
+
+    @property
+    def store(self):
+        return self.pipeline.store
+
+    def reconcile(
+        self, on_pending: Optional[Callable[[str], Any]] = None
+    ) -> Dict[str, int]:
+        """
+        Bring the books table in line with the directory.
+
+        Args:
+            on_pending: Called with the path of every file that was
+                registered and needs ingesting, e.g. to queue its ingest
+
+        Returns:
+            dict: Number of files registered, removed and whose outputs changed
+        """
+        started = time.monotonic()
+        directory = os.path.abspath(self.directory)
+        known = self.store.get_index_entries(directory)
+        with os.scandir(directory) as entries:
+            files = {entry.name: entry for entry in entries if entry.is_file()}
+
+        counts = {"registered": 0, "removed": 0, "outputs": 0}
+        present = set()
+        changed = []
+        outputs_changed = []
+        for name, entry in files.items():
+            if not name.endswith(".aax"):
+                continue
+            present.add(entry.path)
+            stat = entry.stat()
+            stored = known.get(entry.path, (None, None, None, None))
+            if stored[:2] != (stat.st_size, stat.st_mtime):
+                changed.append((entry.path, stat.st_size, stat.st_mtime))
+
+            # Same rule as batches use to skip conversions: an output counts
+            # when it is at least as new as the AAX file
+            outputs = []
+            for conversion_type in ("m4b", "mp3_chapters"):
+                output = files.get(os.path.basename(output_path(name, conversion_type)))
+                if output is not None and output.stat().st_mtime >= stat.st_mtime:
+                    outputs.append(output.path)
+                else:
+                    outputs.append(None)
+            if tuple(outputs) != stored[2:]:
+                outputs_changed.append((entry.path, *outputs))
+
+        # A whole new library is registered in one transaction
+        counts["registered"] = len(changed)
+        for path in self.store.register_files(changed):
+            if on_pending:
+                on_pending(path)
+        counts["outputs"] = len(outputs_changed)
+        for path, m4b_path, mp3_chapters_path in outputs_changed:
+            self.store.set_outputs(path, m4b_path, mp3_chapters_path)
+
+        for path in known.keys() - present:
+            counts["removed"] += 1
+            self.pipeline.forget(path)
+
+        self._last_reconcile = time.monotonic()
+        if any(counts.values()):
+            logger.info(
+                f"Reconciled {len(present)} books in {directory} in "
+                f"{(self._last_reconcile - started) * 1000:.0f}ms: {counts}"
+            )
+        return counts
+
+    def start(self, on_pending: Optional[Callable[[str], Any]] = None):
+        """Start the reconcile thread; safe to call more than once"""
+        self._on_pending = on_pending
+        if self._started:
+            return
+        self._started = True
+        thread_manager.start_thread(target=self._run, name="library_reconciler")
+
+    def _run(self):
+        while not thread_manager.is_shutdown_requested():
+            try:
+                self.reconcile(self._on_pending)
+            except Exception as e:
+                logger.error(f"Library reconcile failed: {e}")
+            thread_manager.wait_for_shutdown(self.reconcile_seconds)
+
+    def page(
+        self,
+        sort: str = "title",
+        order: str = "asc",
+        page: int = 1,
+        per_page: int = LIBRARY_PAGE_SIZE,
+        query: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        One page of the library, or of the books matching a search query.
+
+        Search results are ranked by relevance and ignore sort and order.
+
+        Raises:
+            ValueError: If sort or order is not recognised
+        """
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unknown order {order!r}, expected asc or desc")
+        page = max(page, 1)
+        per_page = min(max(per_page, 1), LIBRARY_MAX_PAGE_SIZE)
+        directory = os.path.abspath(self.directory)
+        offset = (page - 1) * per_page
+        if query:
+            books, total = self.store.search_books(
+                directory, query, limit=per_page, offset=offset
+            )
+        else:
+            books, total = self.store.list_books(
+                directory,
+                sort=sort,
+                descending=order == "desc",
+                limit=per_page,
+                offset=offset,
+            )
+        return {
+            "books": books,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "pages": max(math.ceil(total / per_page), 1),
+            "sort": sort,
+            "order": order,
+            "query": query or "",
+        }
+
+    @staticmethod
+    def summarize(book: Book) -> BookSummary:
+        """A listed book as the library page shows it"""
+        formatter = AudiobookMetadataExtractor
+        return BookSummary(
+            filename=book.filename,
+            title=book.title,
+            author=book.author,
+            duration_formatted=(
+                formatter.format_duration(book.duration)
+                if book.duration is not None
+                else None
+            ),
+            size_formatted=formatter.format_file_size(book.size),
+            bitrate_formatted=(
+                formatter.format_bitrate(book.bitrate) if book.bitrate else None
+            ),
+            chapter_count=book.chapter_count,
+            cover_url=LibraryIndex.cover_url(book),
+            ingest_status=book.ingest_status,
+        )
+
+    @staticmethod
+    def cover_url(book: Book) -> Optional[str]:
+        # The version changes with the file, so browsers may cache covers
+        if not book.cover_path:
+            return None
+        return f"/covers/{quote(book.filename)}?v={int(book.mtime)}"
+
+    def etag(
+        self, path: str, params: Iterable[Tuple[str, str]], version: str = ""
+    ) -> Optional[str]:
+        """
+        Strong ETag of a library response: the library generation, which
+        changes with any book, and the request that picked the representation.
+
+        Args:
+            version: Anything else the response depends on, e.g. a template
+
+        Returns:
+            str: The ETag, or None if the database keeps no generation
+        """
+        generation = self.store.generation()
+        if generation is None:
+            return None
+        request = f"{path}?{urlencode(sorted(params))}#{version}"
+        return f'"{generation}-{hashlib.sha1(request.encode()).hexdigest()[:16]}"'
+
+    def api_page(
+        self,
+        sort: str = "title",
+        order: str = "asc",
+        limit: int = LIBRARY_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        query: Optional[str] = None,
+        fields: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        One page of the JSON library API.
+
+        Listing pages continue from the sort value and id of the previous
+        page's last book, so deep pages cost the same as the first; search
+        pages, ranked by relevance, continue from an offset. Either way the
+        position is handed out as an opaque next_cursor.
+
+        Raises:
+            ValueError: On an unknown sort, order or field, or a cursor that
+            is invalid or was issued for another sort
+        """
+        selected = _select_fields(fields, API_FIELDS)
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unknown order {order!r}, expected asc or desc")
+        if sort not in LIBRARY_SORTS:
+            raise ValueError(
+                f"Unknown sort {sort!r}, expected one of {', '.join(LIBRARY_SORTS)}"
+            )
+        limit = min(max(limit, 1), LIBRARY_MAX_PAGE_SIZE)
+        directory = os.path.abspath(self.directory)
+        position = _decode_cursor(cursor) if cursor else {}
+        # One extra book tells whether there is a next page
+        if query:
+            offset = position.get("offset", 0)
+            if not isinstance(offset, int) or offset < 0:
+                raise ValueError("Invalid cursor")
+            books, total = self.store.search_books(
+                directory, query, limit=limit + 1, offset=offset
+            )
+            next_position = {"offset": offset + limit}
+        else:
+            after = position.get("after")
+            if after is not None and not (
+                isinstance(after, list)
+                and len(after) == 2
+                and isinstance(after[0], (str, int, float, type(None)))
+                and isinstance(after[1], int)
+            ):
+                raise ValueError("Invalid cursor")
+            if after is not None and position.get("sort") != [sort, order]:
+                raise ValueError("Cursor was issued for another sort")
+            books, total = self.store.list_books(
+                directory,
+                sort=sort,
+                descending=order == "desc",
+                limit=limit + 1,
+                after=tuple(after) if after else None,
+            )
+            if len(books) > limit:
+                last = books[limit - 1]
+                next_position = {
+                    "sort": [sort, order],
+                    "after": [getattr(last, LIBRARY_SORTS[sort].key), last.id],
+                }
+
+        return {
+            "books": [self.to_api(book, selected) for book in books[:limit]],
+            "total": total,
+            "next_cursor": (
+                _encode_cursor(next_position) if len(books) > limit else None
+            ),
+        }
+
+    def api_book(self, book_id: int, fields: Optional[str] = None) -> Optional[dict]:
+        """
+        One book of the JSON library API, None if the library has no such book
+
+        Raises:
+            ValueError: On an unknown field
+        """
+        selected = _select_fields(fields, API_DETAIL_FIELDS)
+        book = self.store.get_book_by_id(book_id)
+        if book is None or book.directory != os.path.abspath(self.directory):
+            return None
+        return self.to_api(book, selected)
+
+    @staticmethod
+    def to_api(book: Book, fields: List[str]) -> Dict[str, Any]:
+        """A book as the JSON library API returns it, limited to fields"""
+        values = {
+            "id": lambda: book.id,
+            "filename": lambda: book.filename,
+            "title": lambda: book.title,
+            "author": lambda: book.author,
+            "duration": lambda: book.duration,
+            "bitrate": lambda: book.bitrate,
+            "chapter_count": lambda: book.chapter_count,
+            "size": lambda: book.size,
+            "ingest_status": lambda: book.ingest_status,
+            "cover_url": lambda: LibraryIndex.cover_url(book),
+            "downloads": lambda: {
+                "m4b": f"/download/{book.filename}" if book.m4b_path else None,
+                "mp3_chapters": (
+                    f"/download/mp3/{book.filename}" if book.mp3_chapters_path else None
+                ),
+            },
+            "checksum": lambda: book.checksum,
+            "ingest_error": lambda: book.ingest_error,
+            "chapters": lambda: [
+                {
+                    "title": chapter.get("tags", {}).get("title"),
+                    "start_time": float(chapter.get("start_time", 0)),
+                    "end_time": float(chapter.get("end_time", 0)),
+                }
+                for chapter in (
+                    json.loads(book.probe_json).get("chapters", [])
+                    if book.probe_json
+                    else []
+                )
+            ],
+        }
+        return {field: values[field]() for field in fields}
+
+
+# Global instance
+library_index = LibraryIndex()
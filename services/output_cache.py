@@ -0,0 +1,208 @@
+import os
+import shutil
+import subprocess
+import uuid
+from typing import Optional
+
+from config import logger
+from models import ConversionOutput, OutputManifest
+
+from .extract_activation_bytes import M4B_LAYOUT, MP3_PROFILE, MP3_PROFILES
+from .ingest import IngestPipeline, ingest_pipeline
+
+
+class OutputCache:
+    """
+    Finished conversions, reused for any file with the same content.
+
+    Outputs are recorded in the manifest under the checksum of the AAX file
+    they came from, the conversion type, the settings profile and the
+    ffmpeg version, so a touched, copied or renamed book is recognised and a
+    change of settings or ffmpeg is not. When another file needs an output
+    the manifest already has, it is hardlinked (copied across filesystems)
+    instead of converted.
+    """
+
+    def __init__(
+        self,
+        manifest: Optional[OutputManifest] = None,
+        pipeline: Optional[IngestPipeline] = None,
+    ):
+        self._manifest = manifest
+        self.pipeline = pipeline or ingest_pipeline
+        self._tool_version: Optional[str] = None
+
+    @property
+    def manifest(self) -> OutputManifest:
+        if self._manifest is None:
+            self._manifest = OutputManifest()
+        return self._manifest
+
+    @property
+    def tool_version(self) -> str:
+        """First line of ffmpeg -version, read once per process"""
+        if self._tool_version is None:
+            try:
+                result = subprocess.run(
+                    ["ffmpeg", "-version"], capture_output=True, text=True, check=True
+                )
+                self._tool_version = result.stdout.splitlines()[0].strip()
+            except (OSError, subprocess.CalledProcessError, IndexError):
+                self._tool_version = "unknown"
+        return self._tool_version
+
+    @staticmethod
+    def profile(conversion_type: str, mp3_profile: str = MP3_PROFILE) -> str:
+        """The settings an output of conversion_type is made with"""
+        if conversion_type == "m4b":
+            return f"layout={M4B_LAYOUT}"
+        settings = MP3_PROFILES.get(mp3_profile, {})
+        return ",".join(
+            [f"profile={mp3_profile}"]
+            + [f"{name}={value}" for name, value in sorted(settings.items())]
+        )
+
+    def _checksum(self, aax_path: str) -> Optional[str]:
+        # Only ingested books have a checksum; others are simply converted
+        book = self.pipeline.current_book(aax_path)
+        return book.checksum if book is not None else None
+
+    def _is_intact(self, output: ConversionOutput) -> bool:
+        try:
+            return os.path.getsize(output.path) == output.size
+        except OSError:
+            return False
+
+    def reuse(
+        self,
+        aax_path: str,
+        conversion_type: str,
+        destination: str,
+        checksum: Optional[str] = None,
+        mp3_profile: str = MP3_PROFILE,
+    ) -> bool:
+        """
+        Make destination hold the output of converting aax_path, if the
+        manifest has it.
+
+        Args:
+            checksum (str): The AAX checksum, for books that were not ingested
+            mp3_profile (str): MP3 encoder profile the output must be made with
+
+        Returns:
+            bool: True if destination is now an up-to-date output, False if
+            the book has to be converted
+        """
+        checksum = checksum or self._checksum(aax_path)
+        if checksum is None:
+            return False
+        destination = os.path.abspath(destination)
+        key = (checksum, conversion_type, self.profile(conversion_type, mp3_profile))
+        candidates = []
+        for output in self.manifest.find(*key, self.tool_version):
+            if not self._is_intact(output):
+                self.manifest.forget(output.path)
+            elif output.path == destination:
+                return True
+            else:
+                candidates.append(output)
+        if not candidates:
+            return False
+
+        source = candidates[0]
+        partial = f"{destination}.{uuid.uuid4().hex}.partial"
+        try:
+            try:
+                os.link(source.path, partial)
+            except OSError:
+                # Another filesystem, or links not supported
+                shutil.copyfile(source.path, partial)
+            os.replace(partial, destination)
+        except OSError as e:
+            logger.warning(f"Could not reuse {source.path} for {destination}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            return False
+        # Newer than the AAX file, like a fresh conversion, for the mtime
+        # checks of the library listing
+        os.utime(destination)
+        self.manifest.record(
+            ConversionOutput(
+                path=destination,
+                checksum=checksum,
+                conversion_type=conversion_type,
+                profile=key[2],
+                tool_version=self.tool_version,
+                size=source.size,
+            )
+        )
+        logger.info(f"Reused {source.path} as {destination}, skipping conversion")
+        return True
+
+    def remember(
+        self,
+        aax_path: str,
+        conversion_type: str,
+        path: str,
+        checksum: Optional[str] = None,
+        mp3_profile: str = MP3_PROFILE,
+    ):
+        """Record a finished conversion of aax_path, written to path"""
+        checksum = checksum or self._checksum(aax_path)
+        path = os.path.abspath(path)
+        if checksum is None or not os.path.exists(path):
+            return
+        self.manifest.record(
+            ConversionOutput(
+                path=path,
+                checksum=checksum,
+                conversion_type=conversion_type,
+                profile=self.profile(conversion_type, mp3_profile),
+                tool_version=self.tool_version,
+                size=os.path.getsize(path),
+            )
+        )
+
+    def forget(self, path: str):
+        """Stop offering a file that is about to be overwritten or deleted"""
+        self.manifest.forget(os.path.abspath(path))
+
+    def is_current(
+        self,
+        aax_path: str,
+        conversion_type: str,
+        path: str,
+        checksum: Optional[str] = None,
+        mp3_profile: str = MP3_PROFILE,
+    ) -> Optional[bool]:
+        """
+        Whether path holds the output of converting aax_path as it is now.
+
+        Returns:
+            bool: None if the manifest knows nothing of path, e.g. an output
+            written before the manifest existed
+        """
+        output = self.manifest.get(os.path.abspath(path))
+        if output is None:
+            return None
+        return (
+            self._is_intact(output)
+            and output.checksum == (checksum or self._checksum(aax_path))
+            and output.conversion_type == conversion_type
+            and output.profile == self.profile(conversion_type, mp3_profile)
+            and output.tool_version == self.tool_version
+        )
+
+    def is_up_to_date(self, aax_path: str, conversion_type: str, path: str) -> bool:
+        """True if path holds the output of converting aax_path as it is now"""
+        current = self.is_current(aax_path, conversion_type, path)
+        if current is not None:
+            return current
+        # Outputs from before the manifest: trusted when newer than the AAX file
+        return os.path.exists(path) and os.path.getmtime(aax_path) <= os.path.getmtime(
+            path
+        )
+
+
+# Global instance
+output_cache = OutputCache()
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from config import logger
+from models import ACTIVE_STATUSES
+
+from .thread_manager import thread_manager
+
+ALL_CONVERSIONS = "*"
+
+
+class ProgressEventBus:
+    """
+    Publish/subscribe hub for conversion progress events.
+
+    Publishers (ConversionService, in any process) call publish(). Events are
+    deduplicated per conversion so only real changes go out. With the Redis
+    transport every event is published on one Redis channel, and each web
+    process runs a single listener thread that fans events out to its local
+    subscribers, so any number of SSE watchers costs one Redis subscription.
+    Without Redis, events are delivered directly to subscribers in the
+    publishing process.
+    """
+
+    CHANNEL = "conversion_events"
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self._subscribers: Dict[
+            str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]
+        ] = {}
+        self._last_published: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self._listener_started = False
+
+        if redis_url is None and self._use_redis():
+            redis_url = os.getenv(
+                "TRACKER_REDIS_URL",
+                os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+            )
+        self._redis_url = redis_url
+        self._client = None
+
+    @staticmethod
+    def _use_redis() -> bool:
+        # Workers publish from their own processes, so events have to go
+        # through Redis whenever one is configured, whatever the tracker
+        # backend. Without a broker URL there are no workers to hear from.
+        broker = os.getenv("CELERY_BROKER_URL", "")
+        default = (
+            "redis"
+            if broker.startswith(("redis://", "rediss://"))
+            or os.getenv("CONVERSION_TRACKER_BACKEND", "sql").lower() == "redis"
+            else "local"
+        )
+        return os.getenv("PROGRESS_EVENTS_BACKEND", default).lower() == "redis"
+
+    @property
+    def client(self):
+        """Lazy Redis client, only created when the Redis transport is used"""
+        if self._client is None and self._redis_url:
+            import redis
+
+            self._client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+        return self._client
+
+    def publish(self, filename: str, conversion_type: str, payload: Dict[str, Any]):
+        """Publish a progress event if it differs from the last one for this conversion"""
+        event = dict(payload, filename=filename, conversion_type=conversion_type)
+        message = json.dumps(event, sort_keys=True, default=str)
+
+        with self._lock:
+            if self._last_published.get((filename, conversion_type)) == message:
+                return
+            self._last_published[(filename, conversion_type)] = message
+            if event.get("status") not in ACTIVE_STATUSES:
+                # Terminal events end the conversion; don't keep them forever
+                self._last_published.pop((filename, conversion_type), None)
+
+        if self.client is not None:
+            try:
+                self.client.publish(self.CHANNEL, message)
+                return
+            except Exception as e:
+                logger.warning(f"Could not publish progress event to Redis: {e}")
+
+        self._dispatch(event)
+
+    def _dispatch(self, event: Dict[str, Any]):
+        """Deliver an event to local subscribers of that conversion and of all conversions"""
+        key = self._key(event["filename"], event["conversion_type"])
+        with self._lock:
+            targets = list(self._subscribers.get(key, ())) + list(
+                self._subscribers.get(ALL_CONVERSIONS, ())
+            )
+
+        for loop, event_queue in targets:
+            try:
+                loop.call_soon_threadsafe(event_queue.put_nowait, event)
+            except RuntimeError:
+                # Subscriber's event loop is already closed
+                pass
+
+    @staticmethod
+    def _key(filename: str, conversion_type: str) -> str:
+        return f"{conversion_type}|{filename}"
+
+    def _ensure_listener(self):
+        """Start the Redis listener thread on first subscription"""
+        if self.client is None:
+            return
+        with self._lock:
+            if self._listener_started:
+                return
+            self._listener_started = True
+        thread_manager.start_thread(
+            target=self._redis_listener, name="progress_events_listener"
+        )
+
+    def _redis_listener(self):
+        """Forward events from the Redis channel to local subscribers"""
+        while not thread_manager.is_shutdown_requested():
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                while not thread_manager.is_shutdown_requested():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self._dispatch(json.loads(message["data"]))
+            except Exception as e:
+                logger.warning(f"Progress event listener error, reconnecting: {e}")
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    def subscribe(
+        self,
+        filename: Optional[str] = None,
+        conversion_type: str = "m4b",
+        timeout: float = 15.0,
+    ) -> "ProgressSubscription":
+        """
+        Subscribe to one conversion, or to all conversions when filename is None.
+
+        Must be called from a running event loop. The subscription is
+        registered immediately, so no event published after this call is
+        missed while the caller reads the current status.
+        """
+        self._ensure_listener()
+        key = (
+            ALL_CONVERSIONS
+            if filename is None
+            else self._key(filename, conversion_type)
+        )
+        subscription = ProgressSubscription(self, key, timeout)
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscription.target)
+        return subscription
+
+    def _unsubscribe(self, key: str, target):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(target)
+                if not subscribers:
+                    del self._subscribers[key]
+
+
+class ProgressSubscription:
+    """
+    Async iterator over events for one subscription.
+
+    Yields None whenever no event arrived within the timeout, so consumers
+    can send keepalives and notice disconnected clients.
+    """
+
+    def __init__(self, bus: ProgressEventBus, key: str, timeout: float):
+        self._bus = bus
+        self._key = key
+        self._timeout = timeout
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.target = (asyncio.get_running_loop(), self._queue)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), self._timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self._bus._unsubscribe(self._key, self.target)
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Encode a payload as a Server-Sent Events message"""
+    message = f"data: {json.dumps(data, default=str)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+
+# Global instance
+progress_events = ProgressEventBus()
@@ -0,0 +1,58 @@
+import asyncio
+from typing import AsyncIterator, Callable
+
+from .extract_activation_bytes import mp4_boxes
+
+# How often a download that caught up with the conversion checks for more
+PROGRESSIVE_POLL_SECONDS = 0.5
+PROGRESSIVE_CHUNK_SIZE = 1024 * 1024
+
+
+def moov_first(path: str) -> bool:
+    """
+    True if an MP4 file's moov atom comes before its audio. While ffmpeg is
+    still writing, that only holds for a fragmented M4B, whose every byte on
+    disk is already final.
+
+    Only the top-level box headers at the start of the file are read.
+    """
+    try:
+        for box, _, _ in mp4_boxes(path):
+            if box == b"moov":
+                return True
+            if box in (b"mdat", b"moof"):
+                return False
+    except OSError:
+        pass
+    return False
+
+
+async def follow(
+    path: str,
+    still_writing: Callable[[], bool],
+    chunk_size: int = PROGRESSIVE_CHUNK_SIZE,
+    poll_seconds: float = PROGRESSIVE_POLL_SECONDS,
+) -> AsyncIterator[bytes]:
+    """
+    Yield a file's bytes as they are written, until the writer is done.
+
+    Args:
+        still_writing: Called, in a worker thread, whenever the reader has
+            caught up; the file is read to its end once more after it
+            returns False, so nothing written before that is missed
+    """
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        writing = True
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if chunk:
+                yield chunk
+                continue
+            if not writing:
+                return
+            writing = await asyncio.to_thread(still_writing)
+            if writing:
+                await asyncio.sleep(poll_seconds)
+    finally:
+        f.close()
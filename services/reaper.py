@@ -0,0 +1,118 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from config import logger
+from models import HEARTBEAT_TIMEOUT_SECONDS
+
+from .conversion_service import conversion_service
+from .ingest import INGEST_TIMEOUT_SECONDS, ingest_pipeline
+from .thread_manager import thread_manager
+
+REAPER_INTERVAL_SECONDS = float(os.getenv("REAPER_INTERVAL_SECONDS", "30"))
+MAX_CONVERSION_ATTEMPTS = int(os.getenv("MAX_CONVERSION_ATTEMPTS", "3"))
+
+
+class StuckJobReaper:
+    """
+    Periodically fail conversions whose workers stopped heartbeating.
+
+    Only jobs with at least one leased step and an expired heartbeat are
+    reaped, so jobs still waiting in the queue and long encodes that report
+    no progress are left alone. Every reaped job is handed to the release
+    callback, which frees what it still holds such as scheduler slots and
+    scratch space, then to the requeue callback until MAX_CONVERSION_ATTEMPTS
+    is hit.
+    Books left "ingesting" for ingest_timeout are made pending again and
+    handed to the requeue_ingest callback. Each run also flushes the
+    conversion tracker, moving conversions that workers finished into the
+    web process's history.
+
+    The reaper never signals a reaped job's processes: the PID it recorded
+    belongs to another host or PID namespace and may have been reused.
+    """
+
+    def __init__(
+        self,
+        interval: float = REAPER_INTERVAL_SECONDS,
+        timeout: float = HEARTBEAT_TIMEOUT_SECONDS,
+        max_attempts: int = MAX_CONVERSION_ATTEMPTS,
+        ingest_timeout: float = INGEST_TIMEOUT_SECONDS,
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.ingest_timeout = ingest_timeout
+        self._release: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._requeue: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._requeue_ingest: Optional[Callable[[str], Any]] = None
+        self._started = False
+
+    def start(
+        self,
+        requeue: Optional[Callable[[Dict[str, Any]], None]] = None,
+        requeue_ingest: Optional[Callable[[str], Any]] = None,
+        release: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        """Start the reaper thread; safe to call more than once"""
+        self._release = release
+        self._requeue = requeue
+        self._requeue_ingest = requeue_ingest
+        if self._started:
+            return
+        self._started = True
+        thread_manager.start_thread(target=self._run, name="stuck_job_reaper")
+
+    def _run(self):
+        while not thread_manager.is_shutdown_requested():
+            try:
+                self.run_once()
+                self.reset_stuck_ingests()
+                # Persist conversions that workers finished since the last run
+                conversion_service.flush()
+            except Exception as e:
+                logger.error(f"Stuck job reaper failed: {e}")
+            thread_manager.wait_for_shutdown(self.interval)
+
+    def run_once(self) -> List[Dict[str, Any]]:
+        """Reap expired conversions once and requeue the ones with attempts left"""
+        reaped = conversion_service.reap_expired_conversions(self.timeout)
+        for record in reaped:
+            logger.warning(
+                f"Reaped {record['conversion_type']} conversion of {record['filename']} "
+                f"(worker {record.get('worker_id')}, task {record.get('worker_task_id')})"
+            )
+            if self._release is not None:
+                try:
+                    self._release(record)
+                except Exception as e:
+                    logger.error(f"Could not release {record['filename']}: {e}")
+
+            if self._requeue is None:
+                continue
+            if record.get("attempts", 1) >= self.max_attempts:
+                logger.warning(
+                    f"Not requeueing {record['filename']}: "
+                    f"{record.get('attempts', 1)} attempts used"
+                )
+                continue
+            try:
+                self._requeue(record)
+            except Exception as e:
+                logger.error(f"Could not requeue {record['filename']}: {e}")
+        return reaped
+
+    def reset_stuck_ingests(self) -> List[str]:
+        """Make ingests that outlived ingest_timeout pending and queue them again"""
+        paths = ingest_pipeline.store.reset_interrupted(
+            claimed_before=datetime.utcnow() - timedelta(seconds=self.ingest_timeout)
+        )
+        for path in paths:
+            logger.warning(f"Ingest of {path} timed out, queueing it again")
+            if self._requeue_ingest is not None:
+                self._requeue_ingest(path)
+        return paths
+
+
+# Global instance
+stuck_job_reaper = StuckJobReaper()
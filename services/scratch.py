@@ -0,0 +1,306 @@
+import errno
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from config import logger
+
+# Parent of every conversion's scratch directory. Workers that share chapter
+# scratch directories must share it too, like TMPDIR.
+SCRATCH_DIR = os.getenv(
+    "SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "aax-converter")
+)
+# Free space never handed out on a scratch or output filesystem
+SCRATCH_HEADROOM_MB = int(os.getenv("SCRATCH_HEADROOM_MB", "256"))
+# How long a job waits for free space before it fails
+SCRATCH_WAIT_SECONDS = float(os.getenv("SCRATCH_WAIT_SECONDS", "900"))
+SCRATCH_POLL_SECONDS = 5.0
+
+# Embedded cover art allowance per MP3 chapter
+_CHAPTER_ART_BYTES = 64 * 1024
+# Holds the number of bytes a scratch directory was reserved for
+_RESERVATION_FILE = ".reservation"
+_LOCK_FILE = ".lock"
+
+
+class ScratchRoot(NamedTuple):
+    """A filesystem scratch directories are made in"""
+
+    path: str
+    # Largest estimate the root takes, None for any
+    max_bytes: Optional[int]
+
+
+def parse_scratch_roots(value: str) -> List[ScratchRoot]:
+    """
+    Scratch roots from a comma separated list of paths, each optionally
+    followed by =MB, the largest book it takes, e.g.
+    "/dev/shm/aax-converter=512,/mnt/nvme/aax-converter".
+    """
+    roots = []
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        path, _, max_mb = entry.partition("=")
+        roots.append(
+            ScratchRoot(path, int(float(max_mb) * 1024 * 1024) if max_mb else None)
+        )
+    return roots
+
+
+# Tried in order; a book goes to the first root that takes its size and has
+# room for it
+SCRATCH_ROOTS = parse_scratch_roots(os.getenv("SCRATCH_ROOTS", "")) or [
+    ScratchRoot(SCRATCH_DIR, None)
+]
+
+
+def parse_bitrate(bitrate: str) -> int:
+    """Bits per second of an ffmpeg bitrate such as "128k" """
+    bitrate = bitrate.strip().lower()
+    if bitrate.endswith("k"):
+        return int(float(bitrate[:-1]) * 1000)
+    if bitrate.endswith("m"):
+        return int(float(bitrate[:-1]) * 1000000)
+    return int(float(bitrate))
+
+
+def estimate_mp3_bytes(duration: float, bitrate: str, chapters: int = 0) -> int:
+    """Size of a book's MP3 chapters: bitrate × duration, plus cover art"""
+    return int(duration * parse_bitrate(bitrate) / 8) + chapters * _CHAPTER_ART_BYTES
+
+
+def _directory_bytes(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class ScratchSpace:
+    """
+    Scratch directories with free space reserved before a job writes to them.
+
+    A job estimates what it will write and reserves that much on the first
+    root that takes books of its size and has room for it: free space minus
+    what earlier reservations have not written yet, minus headroom. The
+    reservation is a file in the scratch directory, so every process sharing
+    the roots sees it, and removing the directory releases it. A job that
+    could never fit is rejected at once; one that fits once other jobs finish
+    waits up to wait_seconds. Output directories are checked too, for the zip
+    or M4B written there, but without reservations.
+    """
+
+    def __init__(
+        self,
+        roots: Optional[List[ScratchRoot]] = None,
+        headroom_bytes: int = SCRATCH_HEADROOM_MB * 1024 * 1024,
+        wait_seconds: float = SCRATCH_WAIT_SECONDS,
+        poll_seconds: float = SCRATCH_POLL_SECONDS,
+    ):
+        self.roots = roots or SCRATCH_ROOTS
+        self.headroom_bytes = headroom_bytes
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+
+    def outstanding(self, root: str) -> int:
+        """Bytes reserved in root that have not been written yet"""
+        total = 0
+        try:
+            entries = [entry for entry in os.scandir(root) if entry.is_dir()]
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                with open(os.path.join(entry.path, _RESERVATION_FILE)) as f:
+                    reserved = int(f.read() or 0)
+            except (OSError, ValueError):
+                continue
+            total += max(0, reserved - _directory_bytes(entry.path))
+        return total
+
+    def _free(self, path: str) -> int:
+        return shutil.disk_usage(path).free - self.headroom_bytes
+
+    def _capacity(self, path: str) -> int:
+        return shutil.disk_usage(path).total - self.headroom_bytes
+
+    def _output_need(
+        self,
+        root: Optional[str],
+        output_dir: str,
+        output_bytes: int,
+        scratch_bytes: int,
+    ) -> int:
+        # Chapters and the zip coexist while zipping on a shared filesystem
+        if root is not None and os.stat(root).st_dev == os.stat(output_dir).st_dev:
+            return output_bytes + scratch_bytes
+        return output_bytes
+
+    def _eligible(self, scratch_bytes: int) -> List[ScratchRoot]:
+        return [
+            root
+            for root in self.roots
+            if root.max_bytes is None or scratch_bytes <= root.max_bytes
+        ]
+
+    def check(
+        self,
+        scratch_bytes: int,
+        output_dir: Optional[str] = None,
+        output_bytes: int = 0,
+    ):
+        """
+        Reject a job that could never fit, even on empty filesystems.
+
+        Roots that do not exist here are not judged: they may be mounted only
+        on the workers, which create them and check again when reserving.
+
+        Raises:
+            OSError: ENOSPC if no scratch root or the output directory is too
+            small for the estimates
+        """
+        if scratch_bytes:
+            roots = self._eligible(scratch_bytes)
+            fits = any(
+                not os.path.isdir(root.path)
+                or scratch_bytes <= self._capacity(root.path)
+                for root in roots
+            )
+            if not fits:
+                raise OSError(
+                    errno.ENOSPC,
+                    f"No scratch space can hold {scratch_bytes / 2**20:.0f} MB",
+                )
+        if output_dir and output_bytes > self._capacity(output_dir):
+            raise OSError(
+                errno.ENOSPC,
+                f"{output_dir} cannot hold {output_bytes / 2**20:.0f} MB",
+            )
+
+    def _wait(
+        self,
+        attempt: Callable,
+        what: str,
+        cancelled: Optional[Callable[[], bool]],
+        on_wait: Optional[Callable[[], None]],
+    ):
+        deadline = time.monotonic() + self.wait_seconds
+        waiting = False
+        while True:
+            result = attempt()
+            if result is not None:
+                return result
+            if cancelled is not None and cancelled():
+                return None
+            if time.monotonic() >= deadline:
+                raise OSError(
+                    errno.ENOSPC,
+                    f"Not enough free space for {what} after waiting "
+                    f"{self.wait_seconds:.0f}s",
+                )
+            if not waiting:
+                waiting = True
+                logger.info(f"Waiting for free space for {what}")
+                if on_wait is not None:
+                    on_wait()
+            time.sleep(self.poll_seconds)
+
+    def _try_reserve(
+        self,
+        root: ScratchRoot,
+        scratch_bytes: int,
+        prefix: str,
+        output_dir: Optional[str],
+        output_bytes: int,
+    ) -> Optional[str]:
+        os.makedirs(root.path, exist_ok=True)
+        # Serializes the check and the reservation between processes
+        with open(os.path.join(root.path, _LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if scratch_bytes > self._free(root.path) - self.outstanding(root.path):
+                return None
+            if output_dir and self._output_need(
+                root.path, output_dir, output_bytes, scratch_bytes
+            ) > self._free(output_dir):
+                return None
+            directory = tempfile.mkdtemp(prefix=prefix, dir=root.path)
+            with open(os.path.join(directory, _RESERVATION_FILE), "w") as f:
+                f.write(str(scratch_bytes))
+            return directory
+
+    def reserve(
+        self,
+        scratch_bytes: int,
+        prefix: str = "",
+        output_dir: Optional[str] = None,
+        output_bytes: int = 0,
+        cancelled: Optional[Callable[[], bool]] = None,
+        on_wait: Optional[Callable[[], None]] = None,
+    ) -> Optional[str]:
+        """
+        Create a scratch directory with scratch_bytes reserved in it.
+
+        Waits while no root has room, calling on_wait once when it starts to.
+        Removing the directory releases the reservation.
+
+        Returns:
+            str: The scratch directory, or None if cancelled while waiting
+
+        Raises:
+            OSError: ENOSPC if the job could never fit, or space did not
+            free up within wait_seconds
+        """
+        roots = self._eligible(scratch_bytes)
+        for root in roots:
+            os.makedirs(root.path, exist_ok=True)
+        self.check(scratch_bytes, output_dir, output_bytes)
+
+        def attempt():
+            for root in roots:
+                directory = self._try_reserve(
+                    root, scratch_bytes, prefix, output_dir, output_bytes
+                )
+                if directory is not None:
+                    return directory
+            return None
+
+        return self._wait(
+            attempt, f"{scratch_bytes / 2**20:.0f} MB of scratch", cancelled, on_wait
+        )
+
+    def admit(
+        self,
+        output_dir: str,
+        output_bytes: int,
+        cancelled: Optional[Callable[[], bool]] = None,
+        on_wait: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """
+        Wait until output_dir has room for output_bytes, for jobs that write
+        their output directly.
+
+        Returns:
+            bool: False if cancelled while waiting
+
+        Raises:
+            OSError: ENOSPC as for reserve
+        """
+        self.check(0, output_dir, output_bytes)
+        return bool(
+            self._wait(
+                lambda: True if output_bytes <= self._free(output_dir) else None,
+                f"{output_bytes / 2**20:.0f} MB in {output_dir}",
+                cancelled,
+                on_wait,
+            )
+        )
+
+
+# Global instance
+scratch_space = ScratchSpace()
@@ -0,0 +1,239 @@
+import os
+import shutil
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from config import logger
+
+from .batch_service import output_path
+from .chapter_stream import STREAM_CACHE_DIR
+from .conversion_service import conversion_service
+from .ingest import COVERS_DIR
+from .output_cache import output_cache
+from .scratch import SCRATCH_ROOTS
+from .thread_manager import thread_manager
+
+# Bytes of converted outputs, streamed chapters and covers kept on disk, 0 for
+# no limit
+STORAGE_QUOTA_MB = int(os.getenv("STORAGE_QUOTA_MB", "0"))
+STORAGE_GC_INTERVAL_SECONDS = float(os.getenv("STORAGE_GC_INTERVAL_SECONDS", "600"))
+# A scratch directory nothing was written to for this long, and that no
+# active conversion claims, was left behind by a crashed job
+SCRATCH_ORPHAN_SECONDS = float(os.getenv("SCRATCH_ORPHAN_SECONDS", "3600"))
+
+_OUTPUT_SUFFIXES = (".m4b", "_chapters.zip")
+
+
+class Artifact(NamedTuple):
+    """One converted output on disk, with every hardlink to it"""
+
+    paths: Tuple[str, ...]
+    size: int
+    # mtime, which downloads bump
+    last_used: float
+
+
+class StorageManager:
+    """
+    Keep derived files within a byte quota and remove abandoned scratch space.
+
+    Converted outputs in the upload directory, chapters in the stream cache
+    and cover images share one quota; when they outgrow it, the least
+    recently used outputs are deleted first. The stream cache is counted but
+    evicted by ChapterStreamCache alone, within its own limit, so two LRU
+    policies never compete for its files. Covers are counted but kept: they
+    are only extracted at ingest, so a deleted cover would stay missing until
+    the book is ingested again. Source AAX files and the outputs of running
+    conversions are never evicted. Scratch directories under the scratch
+    roots that no active conversion claims and that have been idle for
+    orphan_seconds are deleted. Both run on startup and then every interval
+    seconds.
+    """
+
+    def __init__(
+        self,
+        upload_dir: str = "uploads",
+        stream_cache_dir: str = STREAM_CACHE_DIR,
+        covers_dir: str = COVERS_DIR,
+        scratch_dirs: Optional[List[str]] = None,
+        quota_bytes: int = STORAGE_QUOTA_MB * 1024 * 1024,
+        interval: float = STORAGE_GC_INTERVAL_SECONDS,
+        orphan_seconds: float = SCRATCH_ORPHAN_SECONDS,
+    ):
+        self.upload_dir = upload_dir
+        self.stream_cache_dir = stream_cache_dir
+        self.covers_dir = covers_dir
+        self.scratch_dirs = scratch_dirs or [root.path for root in SCRATCH_ROOTS]
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.orphan_seconds = orphan_seconds
+        self._started = False
+
+    def start(self):
+        """Start the storage thread; safe to call more than once"""
+        if self._started:
+            return
+        self._started = True
+        thread_manager.start_thread(target=self._run, name="storage_manager")
+
+    def _run(self):
+        while not thread_manager.is_shutdown_requested():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Storage manager failed: {e}")
+            thread_manager.wait_for_shutdown(self.interval)
+
+    def run_once(self) -> Dict[str, int]:
+        """Collect orphaned scratch directories, then enforce the quota"""
+        counts = {"scratch_dirs": self.collect_scratch()}
+        counts["evicted"], counts["freed_bytes"] = self.enforce_quota()
+        return counts
+
+    @staticmethod
+    def touch(path: str):
+        """Mark a derived file as just used, e.g. on download"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _active_conversions(self) -> List[Dict]:
+        return conversion_service.get_all_active_conversions()
+
+    def collect_scratch(self) -> int:
+        """
+        Delete scratch directories left behind by crashed jobs.
+
+        Returns:
+            int: Number of directories deleted
+        """
+        claimed = set()
+        for record in self._active_conversions():
+            work_dir = conversion_service.get_progress(
+                record["filename"], record["conversion_type"]
+            ).get("work_dir")
+            if work_dir:
+                claimed.add(os.path.abspath(work_dir))
+
+        entries = []
+        for scratch_dir in self.scratch_dirs:
+            try:
+                entries.extend(
+                    entry for entry in os.scandir(scratch_dir) if entry.is_dir()
+                )
+            except FileNotFoundError:
+                pass
+        deleted = 0
+        now = time.time()
+        for entry in entries:
+            if os.path.abspath(entry.path) in claimed:
+                continue
+            if now - self._last_written(entry.path) < self.orphan_seconds:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            deleted += 1
+            logger.info(f"Removed orphaned scratch directory {entry.path}")
+        return deleted
+
+    @staticmethod
+    def _last_written(directory: str) -> float:
+        """Newest mtime of a directory and the files in it"""
+        newest = os.stat(directory).st_mtime
+        for root, _, files in os.walk(directory):
+            for name in files:
+                try:
+                    newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+                except FileNotFoundError:
+                    pass
+        return newest
+
+    def _protected(self) -> Set[str]:
+        """Outputs that running conversions are writing"""
+        return {
+            os.path.abspath(
+                output_path(
+                    record["filename"], record["conversion_type"], self.upload_dir
+                )
+            )
+            for record in self._active_conversions()
+        }
+
+    def artifacts(self) -> List[Artifact]:
+        """Every evictable output, least recently used first"""
+        protected = self._protected()
+        # Hardlinked outputs are one file on disk and are evicted together
+        by_inode: Dict[Tuple[int, int], List] = {}
+        try:
+            entries = list(os.scandir(self.upload_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(_OUTPUT_SUFFIXES):
+                continue
+            path = os.path.abspath(entry.path)
+            stat = entry.stat()
+            group = by_inode.setdefault(
+                (stat.st_dev, stat.st_ino), [[], stat.st_size, 0.0]
+            )
+            group[0].append(path)
+            group[2] = max(group[2], stat.st_mtime)
+
+        artifacts = [
+            Artifact(tuple(paths), size, last_used)
+            for paths, size, last_used in by_inode.values()
+            if not protected.intersection(paths)
+        ]
+        return sorted(artifacts, key=lambda artifact: artifact.last_used)
+
+    def kept_bytes(self) -> int:
+        """Bytes under the quota that are not evicted here: chapters and covers"""
+        total = 0
+        for directory in (self.stream_cache_dir, self.covers_dir):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".partial"):
+                    try:
+                        total += entry.stat().st_size
+                    except FileNotFoundError:
+                        pass
+        return total
+
+    def enforce_quota(self) -> Tuple[int, int]:
+        """
+        Evict the least recently used outputs until derived files fit the
+        quota.
+
+        Returns:
+            tuple: Number of outputs evicted and bytes freed
+        """
+        if self.quota_bytes <= 0:
+            return 0, 0
+        artifacts = self.artifacts()
+        total = sum(artifact.size for artifact in artifacts) + self.kept_bytes()
+        evicted = freed = 0
+        for artifact in artifacts:
+            if total <= self.quota_bytes:
+                break
+            for path in artifact.paths:
+                output_cache.forget(path)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= artifact.size
+            freed += artifact.size
+            evicted += 1
+        if evicted:
+            logger.info(
+                f"Evicted {evicted} outputs ({freed / 2**20:.0f} MB) "
+                f"to stay within {self.quota_bytes / 2**20:.0f} MB"
+            )
+        return evicted, freed
+
+
+# Global instance
+storage_manager = StorageManager()
@@ -29,17 +29,28 @@ class ThreadManager:
         self._shutdown_event = threading.Event()
         self._thread_lock = threading.Lock()
         self._cleanup_callbacks: List[Callable] = []
+        self._signal_handlers_registered = False
         self._initialized = True
 
-        # Register signal handlers
-        self._register_signal_handlers()
         atexit.register(self._cleanup_on_exit)
 
     def _register_signal_handlers(self):
-        """Register signal handlers for graceful shutdown"""
+        """
+        Register signal handlers for graceful shutdown when the first thread
+        starts, so merely importing services leaves signals alone. Handlers a
+        server such as uvicorn already installed are kept; it shuts down
+        itself and atexit stops the threads.
+        """
+        if self._signal_handlers_registered:
+            return
+        self._signal_handlers_registered = True
         try:
-            signal.signal(signal.SIGTERM, self._signal_handler)
-            signal.signal(signal.SIGINT, self._signal_handler)
+            for signum, default in (
+                (signal.SIGTERM, signal.SIG_DFL),
+                (signal.SIGINT, signal.default_int_handler),
+            ):
+                if signal.getsignal(signum) is default:
+                    signal.signal(signum, self._signal_handler)
             logger.info("Signal handlers registered for graceful shutdown")
         except Exception as e:
             logger.warning(f"Could not register signal handlers: {e}")
@@ -94,6 +105,8 @@ class ThreadManager:
         self, target: Callable, args: tuple = (), kwargs: dict = None, name: str = None
     ) -> threading.Thread:
         """Create and start a new thread"""
+        with self._thread_lock:
+            self._register_signal_handlers()
         thread = self.create_thread(target, args, kwargs, name)
         thread.start()
         logger.info(f"Started thread: {thread.name}")
@@ -103,6 +116,10 @@ class ThreadManager:
         """Check if shutdown has been requested"""
         return self._shutdown_event.is_set()
 
+    def wait_for_shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Sleep up to timeout seconds, waking early if shutdown is requested"""
+        return self._shutdown_event.wait(timeout)
+
     def shutdown(self, timeout: float = 5.0):
         """Initiate graceful shutdown of all threads"""
         logger.info("Initiating graceful shutdown...")
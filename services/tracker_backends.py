@@ -0,0 +1,697 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from config import logger
+from models import ACTIVE_STATUSES, HEARTBEAT_TIMEOUT_SECONDS, ConversionTracker
+
+REAPED_ERROR = "Worker lost: heartbeat expired"
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class TrackerBackend(ABC):
+    """Storage interface behind ConversionService"""
+
+    @abstractmethod
+    def claim_conversion(
+        self,
+        filename: str,
+        conversion_type: str = "m4b",
+        task_id: Optional[str] = None,
+        attempt: int = 1,
+    ) -> bool:
+        """Atomically start a conversion unless one is already active"""
+
+    @abstractmethod
+    def update_progress(
+        self,
+        filename: str,
+        progress: float,
+        status: str = "converting",
+        conversion_type: str = "m4b",
+    ) -> bool:
+        """Update progress of an active conversion, False if it is no longer active"""
+
+    @abstractmethod
+    def complete_conversion(
+        self,
+        filename: str,
+        success: bool = True,
+        error_message: Optional[str] = None,
+        result_path: Optional[str] = None,
+        conversion_type: str = "m4b",
+    ) -> bool:
+        """Mark an active conversion as completed or failed, False if it was not active"""
+
+    @abstractmethod
+    def get_progress(self, filename: str, conversion_type: str = "m4b") -> dict:
+        """Get current progress for a file"""
+
+    @abstractmethod
+    def get_all_active_conversions(self) -> List[dict]:
+        """Get all currently active conversions"""
+
+    @abstractmethod
+    def record_heartbeat(
+        self,
+        filename: str,
+        conversion_type: str,
+        worker_id: str,
+        worker_task_id: Optional[str] = None,
+        ffmpeg_pid: Optional[int] = None,
+        lease_delta: int = 0,
+    ):
+        """Record that a worker is still running part of an active conversion"""
+
+    @abstractmethod
+    def reap_expired_conversions(self, expired_before: datetime) -> List[dict]:
+        """Fail leased conversions whose last heartbeat is older than expired_before"""
+
+    @abstractmethod
+    def record_subtasks(
+        self,
+        filename: str,
+        conversion_type: str,
+        work_dir: Optional[str],
+        subtask_count: int,
+    ):
+        """Remember the scratch directory and fan-out of an active conversion"""
+
+    @abstractmethod
+    def cancel_conversion(
+        self, filename: str, conversion_type: str = "m4b"
+    ) -> Optional[dict]:
+        """Mark an active conversion as cancelled and return its record, or None"""
+
+    def is_conversion_active(self, filename: str, conversion_type: str = "m4b") -> bool:
+        """Check if conversion is currently active"""
+        return self.get_progress(filename, conversion_type)["status"] in ACTIVE_STATUSES
+
+    def cleanup_old_records(self, days: int = 7):
+        """Clean up old conversion records"""
+
+    def reset_stuck_conversions(self):
+        """Fail conversions whose workers stopped heartbeating"""
+        self.reap_expired_conversions(
+            datetime.utcnow() - timedelta(seconds=HEARTBEAT_TIMEOUT_SECONDS)
+        )
+
+    def flush(self):
+        """Persist any buffered writes"""
+
+
+class InMemoryTrackerBackend(TrackerBackend):
+    """Process-local backend, intended for tests and single-process use"""
+
+    def __init__(self):
+        self._records: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def claim_conversion(
+        self, filename, conversion_type="m4b", task_id=None, attempt=1
+    ) -> bool:
+        with self._lock:
+            existing = self._records.get((filename, conversion_type))
+            if existing and existing["status"] in ACTIVE_STATUSES:
+                return False
+
+            now = _now()
+            self._records[(filename, conversion_type)] = {
+                "filename": filename,
+                "conversion_type": conversion_type,
+                "status": "starting",
+                "progress": 0.0,
+                "started_at": now,
+                "updated_at": now,
+                "task_id": task_id,
+                "attempts": attempt,
+                "active_leases": 0,
+            }
+            return True
+
+    def update_progress(
+        self, filename, progress, status="converting", conversion_type="m4b"
+    ):
+        with self._lock:
+            record = self._records.get((filename, conversion_type))
+            if not record or record["status"] not in ACTIVE_STATUSES:
+                return False
+            record.update(progress=progress, status=status, updated_at=_now())
+            return True
+
+    def complete_conversion(
+        self,
+        filename,
+        success=True,
+        error_message=None,
+        result_path=None,
+        conversion_type="m4b",
+    ):
+        with self._lock:
+            record = self._records.get((filename, conversion_type))
+            if not record or record["status"] not in ACTIVE_STATUSES:
+                return False
+            if success:
+                record.update(
+                    status="completed",
+                    progress=100.0,
+                    completed_at=_now(),
+                    result_path=result_path,
+                )
+            else:
+                record.update(status="error", error=error_message)
+            record["updated_at"] = _now()
+            return True
+
+    def get_progress(self, filename, conversion_type="m4b") -> dict:
+        with self._lock:
+            record = self._records.get((filename, conversion_type))
+            if not record:
+                return {
+                    "status": "not_started",
+                    "progress": 0,
+                    "conversion_type": conversion_type,
+                }
+            result = {k: v for k, v in record.items() if v is not None}
+            result.pop("filename", None)
+            return result
+
+    def get_all_active_conversions(self) -> List[dict]:
+        with self._lock:
+            active = [
+                {
+                    "filename": record["filename"],
+                    "conversion_type": record["conversion_type"],
+                    "status": record["status"],
+                    "progress": record["progress"],
+                    "started_at": record["started_at"],
+                }
+                for record in self._records.values()
+                if record["status"] in ACTIVE_STATUSES
+            ]
+        return sorted(active, key=lambda r: r["started_at"], reverse=True)
+
+    def record_heartbeat(
+        self,
+        filename,
+        conversion_type,
+        worker_id,
+        worker_task_id=None,
+        ffmpeg_pid=None,
+        lease_delta=0,
+    ):
+        with self._lock:
+            record = self._records.get((filename, conversion_type))
+            if not record or record["status"] not in ACTIVE_STATUSES:
+                return
+            record.update(
+                heartbeat_at=_now(),
+                worker_id=worker_id,
+                worker_task_id=worker_task_id,
+                ffmpeg_pid=ffmpeg_pid,
+                active_leases=max(record["active_leases"] + lease_delta, 0),
+            )
+
+    def reap_expired_conversions(self, expired_before: datetime) -> List[dict]:
+        threshold = expired_before.isoformat()
+        reaped = []
+        with self._lock:
+            for record in self._records.values():
+                if (
+                    record["status"] in ACTIVE_STATUSES
+                    and record["active_leases"] > 0
+                    and record.get("heartbeat_at", "") < threshold
+                ):
+                    record.update(
+                        status="error",
+                        error=REAPED_ERROR,
+                        updated_at=_now(),
+                        active_leases=0,
+                    )
+                    reaped.append(dict(record))
+        return reaped
+
+    def record_subtasks(self, filename, conversion_type, work_dir, subtask_count):
+        with self._lock:
+            record = self._records.get((filename, conversion_type))
+            if record and record["status"] in ACTIVE_STATUSES:
+                record.update(work_dir=work_dir, subtask_count=subtask_count)
+
+    def cancel_conversion(self, filename, conversion_type="m4b") -> Optional[dict]:
+        with self._lock:
+            record = self._records.get((filename, conversion_type))
+            if not record or record["status"] not in ACTIVE_STATUSES:
+                return None
+            record.update(
+                status="cancelled",
+                error="Cancelled",
+                updated_at=_now(),
+                active_leases=0,
+            )
+            return dict(record)
+
+
+class SQLTrackerBackend(TrackerBackend):
+    """Durable backend storing every conversion in the SQL database"""
+
+    def __init__(self, tracker: Optional[ConversionTracker] = None):
+        self.tracker = tracker or ConversionTracker()
+
+    def claim_conversion(
+        self, filename, conversion_type="m4b", task_id=None, attempt=1
+    ) -> bool:
+        return self.tracker.claim_conversion(
+            filename, conversion_type, task_id, attempt
+        )
+
+    def update_progress(
+        self, filename, progress, status="converting", conversion_type="m4b"
+    ):
+        return self.tracker.update_progress(filename, progress, status, conversion_type)
+
+    def complete_conversion(
+        self,
+        filename,
+        success=True,
+        error_message=None,
+        result_path=None,
+        conversion_type="m4b",
+    ):
+        return self.tracker.complete_conversion(
+            filename, success, error_message, result_path, conversion_type
+        )
+
+    def get_progress(self, filename, conversion_type="m4b") -> dict:
+        return self.tracker.get_progress(filename, conversion_type)
+
+    def get_all_active_conversions(self) -> List[dict]:
+        return self.tracker.get_all_active_conversions()
+
+    def record_heartbeat(
+        self,
+        filename,
+        conversion_type,
+        worker_id,
+        worker_task_id=None,
+        ffmpeg_pid=None,
+        lease_delta=0,
+    ):
+        self.tracker.record_heartbeat(
+            filename,
+            conversion_type,
+            worker_id,
+            worker_task_id,
+            ffmpeg_pid,
+            lease_delta,
+        )
+
+    def reap_expired_conversions(self, expired_before: datetime) -> List[dict]:
+        return self.tracker.reap_expired_conversions(expired_before, REAPED_ERROR)
+
+    def record_subtasks(self, filename, conversion_type, work_dir, subtask_count):
+        self.tracker.record_subtasks(filename, conversion_type, work_dir, subtask_count)
+
+    def cancel_conversion(self, filename, conversion_type="m4b") -> Optional[dict]:
+        return self.tracker.cancel_conversion(filename, conversion_type)
+
+    def cleanup_old_records(self, days: int = 7):
+        self.tracker.cleanup_old_records(days)
+
+    def save_record(self, record: Dict[str, Any]):
+        """Persist a full conversion record, e.g. a terminal record from Redis"""
+        self.tracker.save_conversion(record)
+
+
+# Claim is SADD on the active set: only the caller that adds the member wins,
+# and the hash is rewritten in the same atomic script.
+_CLAIM_SCRIPT = """
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+return 1
+"""
+
+# Field updates only apply while the conversion is still active
+_UPDATE_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+return 1
+"""
+
+# Appends the terminal record in KEYS[1] to the history list in KEYS[3], in
+# the same script that finishes it, so no finished conversion is left out
+_PUSH_HISTORY = """
+local fields = redis.call('HGETALL', KEYS[1])
+local record = {}
+for i = 1, #fields, 2 do record[fields[i]] = fields[i + 1] end
+if record['started_at'] then
+    redis.call('RPUSH', KEYS[3], cjson.encode(record))
+end
+"""
+
+# Leaving the active set decides who finishes a conversion: completion,
+# failure and cancellation race here and only the first one is applied.
+_FINISH_SCRIPT = (
+    """
+if redis.call('SREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+    + _PUSH_HISTORY
+    + "return 1"
+)
+
+# Heartbeats only touch conversions that are still active
+_HEARTBEAT_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+local leases = tonumber(redis.call('HGET', KEYS[1], 'active_leases') or '0') + tonumber(ARGV[2])
+if leases < 0 then leases = 0 end
+redis.call('HSET', KEYS[1], 'active_leases', leases, unpack(ARGV, 3))
+return 1
+"""
+
+# Re-check expiry atomically so a heartbeat racing the reaper keeps the job alive
+_REAP_SCRIPT = (
+    """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+local leases = tonumber(redis.call('HGET', KEYS[1], 'active_leases') or '0')
+local beat = redis.call('HGET', KEYS[1], 'heartbeat_at')
+if leases <= 0 or not beat or beat >= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', 'error', 'error', ARGV[3], 'updated_at', ARGV[4], 'active_leases', 0)
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+"""
+    + _PUSH_HISTORY
+    + "return 1"
+)
+
+
+class RedisTrackerBackend(TrackerBackend):
+    """
+    Live conversion state in Redis hashes, terminal records in SQL.
+
+    Each conversion is one hash, and active conversions are members of one
+    set, so status lookups and the active list are served without touching
+    SQLite and work for Celery workers on other hosts. Completed and failed
+    records are appended to a history list in Redis by the same script that
+    finishes them; the web process drains the list into its SQL history
+    backend with flush(), so history lands in one database whichever worker
+    finished the conversion and survives a crash of that worker.
+    """
+
+    KEY_PREFIX = "conversion"
+    ACTIVE_KEY = "conversions:active"
+    HISTORY_KEY = "conversions:history"
+    # Records moved to SQL per round trip when draining the history list
+    HISTORY_BATCH = 100
+    TERMINAL_TTL = 60 * 60 * 24
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        history: Optional[SQLTrackerBackend] = None,
+        client=None,
+    ):
+        import redis
+
+        self.client = client or redis.Redis.from_url(
+            redis_url
+            or os.getenv(
+                "TRACKER_REDIS_URL",
+                os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+            ),
+            decode_responses=True,
+        )
+        self.history = history or SQLTrackerBackend()
+        self._claim = self.client.register_script(_CLAIM_SCRIPT)
+        self._update = self.client.register_script(_UPDATE_SCRIPT)
+        self._finish = self.client.register_script(_FINISH_SCRIPT)
+        self._heartbeat = self.client.register_script(_HEARTBEAT_SCRIPT)
+        self._reap = self.client.register_script(_REAP_SCRIPT)
+
+    def _key(self, filename: str, conversion_type: str) -> str:
+        return f"{self.KEY_PREFIX}:{conversion_type}:{filename}"
+
+    @staticmethod
+    def _member(filename: str, conversion_type: str) -> str:
+        return f"{conversion_type}|{filename}"
+
+    def claim_conversion(
+        self, filename, conversion_type="m4b", task_id=None, attempt=1
+    ) -> bool:
+        now = _now()
+        fields = {
+            "filename": filename,
+            "conversion_type": conversion_type,
+            "status": "starting",
+            "progress": 0.0,
+            "started_at": now,
+            "updated_at": now,
+            "task_id": task_id or "",
+            "attempts": attempt,
+            "active_leases": 0,
+        }
+        args = [self._member(filename, conversion_type)] + self._flatten(fields)
+
+        claimed = bool(
+            self._claim(
+                keys=[self._key(filename, conversion_type), self.ACTIVE_KEY], args=args
+            )
+        )
+        if claimed:
+            logger.info(
+                f"Claimed {conversion_type} conversion for {filename} (task {task_id})"
+            )
+        return claimed
+
+    @staticmethod
+    def _flatten(fields: Dict[str, Any]) -> List[Any]:
+        args: List[Any] = []
+        for field, value in fields.items():
+            args.extend([field, value])
+        return args
+
+    def update_progress(
+        self, filename, progress, status="converting", conversion_type="m4b"
+    ):
+        return bool(
+            self._update(
+                keys=[self._key(filename, conversion_type), self.ACTIVE_KEY],
+                args=[self._member(filename, conversion_type)]
+                + self._flatten(
+                    {"progress": progress, "status": status, "updated_at": _now()}
+                ),
+            )
+        )
+
+    def _finish_conversion(
+        self, filename: str, conversion_type: str, fields: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Move an active conversion to a terminal status and queue it for history"""
+        key = self._key(filename, conversion_type)
+        if not self._finish(
+            keys=[key, self.ACTIVE_KEY, self.HISTORY_KEY],
+            args=[self._member(filename, conversion_type), self.TERMINAL_TTL]
+            + self._flatten(fields),
+        ):
+            return None
+
+        return self._decode(self.client.hgetall(key))
+
+    def complete_conversion(
+        self,
+        filename,
+        success=True,
+        error_message=None,
+        result_path=None,
+        conversion_type="m4b",
+    ):
+        now = _now()
+        if success:
+            fields = {
+                "status": "completed",
+                "progress": 100.0,
+                "completed_at": now,
+                "result_path": result_path or "",
+            }
+        else:
+            fields = {"status": "error", "error": error_message or ""}
+        fields["updated_at"] = now
+
+        if self._finish_conversion(filename, conversion_type, fields) is None:
+            return False
+
+        logger.info(
+            f"{conversion_type} conversion completed for {filename}: {'success' if success else 'failed'}"
+        )
+        return True
+
+    @staticmethod
+    def _decode(record: Dict[str, str]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {k: v for k, v in record.items() if v != ""}
+        if "progress" in result:
+            result["progress"] = float(result["progress"])
+        for field in ("attempts", "active_leases", "ffmpeg_pid", "subtask_count"):
+            if field in result:
+                result[field] = int(result[field])
+        return result
+
+    def get_progress(self, filename, conversion_type="m4b") -> dict:
+        record = self.client.hgetall(self._key(filename, conversion_type))
+        if not record:
+            # Fall back to the durable history once the live hash has expired
+            return self.history.get_progress(filename, conversion_type)
+
+        result = self._decode(record)
+        result.pop("filename", None)
+        return result
+
+    def get_all_active_conversions(self) -> List[dict]:
+        members = self.client.smembers(self.ACTIVE_KEY)
+        if not members:
+            return []
+
+        pipe = self.client.pipeline()
+        for member in members:
+            conversion_type, filename = member.split("|", 1)
+            pipe.hgetall(self._key(filename, conversion_type))
+
+        active = []
+        for record in pipe.execute():
+            if not record or record.get("status") not in ACTIVE_STATUSES:
+                continue
+            record = self._decode(record)
+            active.append(
+                {
+                    "filename": record["filename"],
+                    "conversion_type": record["conversion_type"],
+                    "status": record["status"],
+                    "progress": record.get("progress", 0.0),
+                    "started_at": record.get("started_at"),
+                }
+            )
+        return sorted(active, key=lambda r: r["started_at"] or "", reverse=True)
+
+    def cleanup_old_records(self, days: int = 7):
+        # Live hashes expire on their own; only the SQL history needs pruning
+        self.history.cleanup_old_records(days)
+
+    def record_heartbeat(
+        self,
+        filename,
+        conversion_type,
+        worker_id,
+        worker_task_id=None,
+        ffmpeg_pid=None,
+        lease_delta=0,
+    ):
+        self._heartbeat(
+            keys=[self._key(filename, conversion_type), self.ACTIVE_KEY],
+            args=[
+                self._member(filename, conversion_type),
+                lease_delta,
+                "heartbeat_at",
+                _now(),
+                "worker_id",
+                worker_id,
+                "worker_task_id",
+                worker_task_id or "",
+                "ffmpeg_pid",
+                ffmpeg_pid or "",
+            ],
+        )
+
+    def reap_expired_conversions(self, expired_before: datetime) -> List[dict]:
+        threshold = expired_before.isoformat()
+        reaped = []
+        for member in self.client.smembers(self.ACTIVE_KEY):
+            conversion_type, filename = member.split("|", 1)
+            key = self._key(filename, conversion_type)
+            if not self._reap(
+                keys=[key, self.ACTIVE_KEY, self.HISTORY_KEY],
+                args=[member, threshold, REAPED_ERROR, _now(), self.TERMINAL_TTL],
+            ):
+                continue
+
+            reaped.append(self._decode(self.client.hgetall(key)))
+
+        if reaped:
+            logger.info(f"Reaped {len(reaped)} conversions with expired heartbeats")
+        return reaped
+
+    def record_subtasks(self, filename, conversion_type, work_dir, subtask_count):
+        self._update(
+            keys=[self._key(filename, conversion_type), self.ACTIVE_KEY],
+            args=[self._member(filename, conversion_type)]
+            + self._flatten(
+                {"work_dir": work_dir or "", "subtask_count": subtask_count}
+            ),
+        )
+
+    def cancel_conversion(self, filename, conversion_type="m4b") -> Optional[dict]:
+        record = self._finish_conversion(
+            filename,
+            conversion_type,
+            {
+                "status": "cancelled",
+                "error": "Cancelled",
+                "updated_at": _now(),
+                "active_leases": 0,
+            },
+        )
+        if record is not None:
+            logger.info(f"Cancelled {conversion_type} conversion for {filename}")
+        return record
+
+    def flush(self):
+        """
+        Move finished records from the Redis history list to SQL.
+
+        Only the web process calls this. Records leave the list once they
+        are saved, so a crash in between saves them again, which the upsert
+        makes harmless, and records that could not be saved are retried on
+        the next flush.
+        """
+        while True:
+            raw = self.client.lrange(self.HISTORY_KEY, 0, self.HISTORY_BATCH - 1)
+            saved = 0
+            try:
+                for item in raw:
+                    self.history.save_record(self._decode(json.loads(item)))
+                    saved += 1
+            except Exception as e:
+                logger.error(f"Could not persist conversion history: {e}")
+            if saved:
+                self.client.ltrim(self.HISTORY_KEY, saved, -1)
+            if saved < len(raw) or not raw:
+                return
+
+
+def create_tracker_backend(name: Optional[str] = None) -> TrackerBackend:
+    """Build the backend selected by CONVERSION_TRACKER_BACKEND"""
+    name = (name or os.getenv("CONVERSION_TRACKER_BACKEND", "sql")).lower()
+    if name == "redis":
+        return RedisTrackerBackend()
+    if name == "memory":
+        return InMemoryTrackerBackend()
+    if name == "sql":
+        return SQLTrackerBackend()
+    raise ValueError(f"Unknown conversion tracker backend: {name}")
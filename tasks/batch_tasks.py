@@ -0,0 +1,93 @@
+import os
+
+from config import logger
+from models import BatchRequest
+from services import AAXProcessor, batch_service, conversion_service
+
+from .celery_app import celery_app
+from .conversion_tasks import cancel_conversion, enqueue_conversion
+
+# How often a running batch checks for finished conversions and queues more
+BATCH_PUMP_INTERVAL_SECONDS = float(os.getenv("BATCH_PUMP_INTERVAL_SECONDS", "5"))
+
+
+def start_batch(request: BatchRequest) -> str:
+    """
+    Create a batch and queue its key resolution.
+
+    Returns:
+        str: The batch id
+
+    Raises:
+        ValueError: If the selection or formats are invalid
+    """
+    batch = batch_service.create_batch(request)
+    resolve_batch_keys_task.delay(batch.id)
+    return batch.id
+
+
+def cancel_batch(batch_id: str) -> dict | None:
+    """
+    Cancel a batch and every conversion it queued.
+
+    Returns:
+        dict: The batch status after cancelling, or None if it does not exist
+    """
+    queued = batch_service.cancel_batch(batch_id)
+    if queued is None:
+        return None
+
+    for item in queued:
+        record = conversion_service.get_progress(item.filename, item.conversion_type)
+        # Only cancel the job this batch queued, not a later one for the same book
+        if record.get("task_id") == item.task_id:
+            cancel_conversion(item.filename, item.conversion_type)
+    return batch_service.get_status(batch_id)
+
+
+@celery_app.task(name="tasks.resolve_batch_keys")
+def resolve_batch_keys_task(batch_id: str):
+    """
+    Resolve the activation keys of a whole batch up front.
+
+    Books from one account share a key, so every distinct checksum is looked
+    up once and cached; the jobs then find their key in the cache.
+    """
+    aax_files = batch_service.pending_files(batch_id)
+    try:
+        results = AAXProcessor().get_activation_bytes_bulk(aax_files)
+        failed = [path for path, result in results.items() if "error" in result]
+        if failed:
+            # Their jobs try again and fail with the error in their own status
+            logger.warning(f"Batch {batch_id}: no activation bytes for {failed}")
+    except Exception as e:
+        logger.warning(f"Batch {batch_id}: bulk key resolution failed: {e}")
+
+    if batch_service.is_running(batch_id):
+        batch_service.store.set_status(batch_id, "running")
+        pump_batch_task.delay(batch_id)
+
+
+@celery_app.task(name="tasks.pump_batch")
+def pump_batch_task(batch_id: str):
+    """Queue pending books up to the batch's concurrency, then check back later"""
+    for item in batch_service.next_items(batch_id):
+        try:
+            task_id = enqueue_conversion(
+                item.filename, item.conversion_type, owner=f"batch:{batch_id}"
+            )
+        except Exception as e:
+            batch_service.mark_failed(item, f"Queue error: {e}")
+            continue
+
+        if task_id is None:
+            # Already converting, e.g. started from the UI: follow that job
+            task_id = conversion_service.get_progress(
+                item.filename, item.conversion_type
+            ).get("task_id")
+        batch_service.mark_queued(item, task_id)
+
+    if batch_service.is_running(batch_id):
+        pump_batch_task.apply_async(
+            args=(batch_id,), countdown=BATCH_PUMP_INTERVAL_SECONDS
+        )
@@ -1,6 +1,31 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
+from kombu import Queue
+
+# Short I/O-bound work and CPU-heavy encodes live on separate queues, so a
+# stream-copy remux never waits behind another book's chapter backlog.
+# Workers pick the queues they serve with -Q and size concurrency per queue.
+REMUX_QUEUE = "remux"
+PROBE_QUEUE = "probe"
+ENCODE_QUEUE = "encode"
+FINALIZE_QUEUE = "finalize"
+
+# Priorities within a queue; with the Redis broker 0 is served first
+PRIORITY_STEPS = 10
+
+TASK_ROUTES = {
+    "tasks.prepare_m4b": {"queue": PROBE_QUEUE},
+    "tasks.convert_m4b": {"queue": REMUX_QUEUE},
+    "tasks.convert_mp3_chapters": {"queue": PROBE_QUEUE},
+    "tasks.convert_mp3_chapter": {"queue": ENCODE_QUEUE},
+    "tasks.finalize_mp3_chapters": {"queue": FINALIZE_QUEUE},
+    "tasks.cleanup_cancelled_conversion": {"queue": FINALIZE_QUEUE},
+    "tasks.resolve_batch_keys": {"queue": PROBE_QUEUE},
+    "tasks.pump_batch": {"queue": PROBE_QUEUE},
+    "tasks.ingest_book": {"queue": PROBE_QUEUE},
+}
 
 
 def _build_celery_app() -> Celery:
@@ -17,9 +42,32 @@ def _build_celery_app() -> Celery:
         enable_utc=True,
         task_track_started=True,
         broker_connection_retry_on_startup=True,
-        imports=("tasks.conversion_tasks",),
+        imports=("tasks.conversion_tasks", "tasks.batch_tasks", "tasks.ingest_tasks"),
+        task_queues=[
+            Queue(name)
+            for name in (REMUX_QUEUE, PROBE_QUEUE, ENCODE_QUEUE, FINALIZE_QUEUE)
+        ],
+        task_default_queue=REMUX_QUEUE,
+        task_routes=TASK_ROUTES,
+        task_default_priority=PRIORITY_STEPS // 2,
+        broker_transport_options={
+            "queue_order_strategy": "priority",
+            "priority_steps": list(range(PRIORITY_STEPS)),
+            "sep": ":",
+        },
+        # Encodes run for minutes: reserve one task at a time so queued work
+        # stays in the broker, where priorities and idle workers can take it
+        worker_prefetch_multiplier=1,
     )
     return app
 
 
 celery_app = _build_celery_app()
+
+
+@worker_process_init.connect
+def _reset_db_connections(**kwargs):
+    """Prefork children must not reuse SQLite connections opened by the parent"""
+    from models import dispose_engines
+
+    dispose_engines()
@@ -1,43 +1,227 @@
 import base64
 import json
 import os
+import shutil
 import subprocess
 import tempfile
+import uuid
 import zipfile
 
 import redis
-from celery import chord
 
 from config import logger
-from services import AAXProcessor, conversion_orchestrator, conversion_service
+from services import (
+    AAXProcessor,
+    ConversionHeartbeat,
+    conversion_orchestrator,
+    conversion_service,
+    create_scheduler,
+    ingest_pipeline,
+    output_cache,
+)
+from services.extract_activation_bytes import MP3_PROFILE, MP3_PROFILES
+from services.scratch import estimate_mp3_bytes, scratch_space
 
-from .celery_app import celery_app
+from .celery_app import PRIORITY_STEPS, celery_app
 
+# Encode priority drops one step per this many chapters in the book
+CHAPTERS_PER_PRIORITY_STEP = 10
 
-@celery_app.task(name="tasks.convert_m4b")
+
+def _fail_expired_job(job_id: str):
+    """Fail the conversion of a job the scheduler dropped as idle"""
+    spec = chapter_scheduler.store.load_spec(job_id)
+    chapter_scheduler.store.delete_job(job_id)
+    if spec is None:
+        return
+    conversion_service.complete_conversion(
+        filename=spec["filename"],
+        success=False,
+        error_message="MP3 chapters stopped reporting progress",
+        conversion_type="mp3_chapters",
+    )
+
+
+# Releases chapter encodes of all books in fair order, a few at a time
+chapter_scheduler = create_scheduler(on_expire=_fail_expired_job)
+
+
+def _resolve_activation_bytes(
+    filename: str, conversion_type: str, aax_file_path: str
+) -> str | None:
+    """First stage of every job: find the key that decrypts the book"""
+    conversion_service.update_progress(filename, 0, "resolving_key", conversion_type)
+    book = ingest_pipeline.current_book(aax_file_path)
+    if book is not None and book.activation_bytes:
+        return book.activation_bytes
+    try:
+        result = AAXProcessor().get_activation_bytes(aax_file_path)
+    except Exception as e:
+        result = {"error": str(e)}
+
+    if not result or "error" in result:
+        error = result.get("error") if result else "unknown error"
+        conversion_service.complete_conversion(
+            filename=filename,
+            success=False,
+            error_message=f"Could not get activation bytes: {error}",
+            conversion_type=conversion_type,
+        )
+        return None
+    return result["activation_bytes"]
+
+
+def _reuse_output(
+    filename: str, conversion_type: str, aax_file_path: str, result_path: str
+) -> bool:
+    """Finish a job from the output manifest if the same book was converted before"""
+    if not output_cache.reuse(aax_file_path, conversion_type, result_path):
+        return False
+    conversion_service.complete_conversion(
+        filename=filename,
+        success=True,
+        result_path=result_path,
+        conversion_type=conversion_type,
+    )
+    return True
+
+
+def _remux_task_id(task_id: str) -> str:
+    return f"{task_id}-remux"
+
+
+@celery_app.task(bind=True, name="tasks.prepare_m4b")
+def prepare_m4b_task(self, filename: str, aax_file_path: str, m4b_file_path: str):
+    """Resolve the activation key on the probe queue, then hand off to remux"""
+    with ConversionHeartbeat(filename, "m4b", self.request.id) as heartbeat:
+        if heartbeat.cancelled:
+            return
+        if _reuse_output(filename, "m4b", aax_file_path, m4b_file_path):
+            return
+        activation_bytes = _resolve_activation_bytes(filename, "m4b", aax_file_path)
+        if activation_bytes is None or heartbeat.check_cancelled():
+            return
+        # A stream copy: the M4B is about as large as the AAX file
+        try:
+            admitted = scratch_space.admit(
+                os.path.dirname(m4b_file_path) or ".",
+                os.path.getsize(aax_file_path),
+                cancelled=heartbeat.check_cancelled,
+                on_wait=lambda: conversion_service.update_progress(
+                    filename, 0, "waiting_for_space", "m4b"
+                ),
+            )
+        except OSError as e:
+            mark_queue_failure(filename, "m4b", str(e))
+            return
+        if not admitted:
+            return
+
+        try:
+            convert_m4b_task.apply_async(
+                args=(filename, aax_file_path, m4b_file_path, activation_bytes),
+                task_id=_remux_task_id(self.request.id),
+            )
+        except Exception as task_error:
+            mark_queue_failure(filename, "m4b", f"Queue error: {task_error}")
+
+
+@celery_app.task(bind=True, name="tasks.convert_m4b")
 def convert_m4b_task(
-    filename: str, aax_file_path: str, m4b_file_path: str, activation_bytes: str
+    self, filename: str, aax_file_path: str, m4b_file_path: str, activation_bytes: str
 ):
     logger.info(f"Running Celery M4B conversion task for {filename}")
-    conversion_orchestrator.convert_file_background(
-        filename=filename,
-        aax_file_path=aax_file_path,
-        m4b_file_path=m4b_file_path,
-        activation_bytes=activation_bytes,
-        start_tracking=False,
-    )
+    with ConversionHeartbeat(filename, "m4b", self.request.id) as heartbeat:
+        if not heartbeat.cancelled:
+            conversion_orchestrator.convert_file_background(
+                filename=filename,
+                aax_file_path=aax_file_path,
+                m4b_file_path=m4b_file_path,
+                activation_bytes=activation_bytes,
+                start_tracking=False,
+                process_callback=heartbeat.process_started,
+            )
 
+    if heartbeat.cancelled and os.path.exists(m4b_file_path):
+        # Drop the partial output of a cancelled conversion
+        os.remove(m4b_file_path)
 
-@celery_app.task(name="tasks.convert_mp3_chapters")
+
+@celery_app.task(bind=True, name="tasks.convert_mp3_chapters")
 def convert_mp3_chapters_task(
+    self,
     filename: str,
     aax_file_path: str,
     output_dir: str,
-    activation_bytes: str,
+    activation_bytes: str | None = None,
+    owner: str | None = None,
 ):
     logger.info(f"Preparing MP3 chapter tasks for {filename}")
 
+    with ConversionHeartbeat(filename, "mp3_chapters", self.request.id) as heartbeat:
+        base_name = os.path.splitext(os.path.basename(filename))[0]
+        zip_path = os.path.join(output_dir, f"{base_name}_chapters.zip")
+        if not heartbeat.cancelled and _reuse_output(
+            filename, "mp3_chapters", aax_file_path, zip_path
+        ):
+            return
+        if activation_bytes is None and not heartbeat.cancelled:
+            activation_bytes = _resolve_activation_bytes(
+                filename, "mp3_chapters", aax_file_path
+            )
+        if activation_bytes is not None and not heartbeat.check_cancelled():
+            _dispatch_mp3_chapters(
+                filename,
+                aax_file_path,
+                output_dir,
+                activation_bytes,
+                self.request.id,
+                heartbeat,
+                owner,
+            )
+
+
+def _chapter_task_id(task_id: str, chapter_index: int) -> str:
+    return f"{task_id}-chapter-{chapter_index}"
+
+
+def _finalize_task_id(task_id: str) -> str:
+    return f"{task_id}-finalize"
+
+
+def subtask_ids(task_id: str, subtask_count: int) -> list:
+    """Celery ids of the chapter and finalize tasks fanned out by a conversion task"""
+    ids = [_chapter_task_id(task_id, i) for i in range(subtask_count)]
+    if subtask_count:
+        ids.append(_finalize_task_id(task_id))
+    return ids
+
+
+def encode_priority(total_chapters: int) -> int:
+    """
+    Priority of a book's chapter encodes within the encode queue.
+
+    Books with fewer chapters go first, so a short book is not stuck behind
+    the backlog of a long one that was queued earlier.
+    """
+    return min(total_chapters // CHAPTERS_PER_PRIORITY_STEP, PRIORITY_STEPS - 1)
+
+
+def _progress_key(filename: str) -> str:
+    return f"mp3_progress:{filename}"
+
+
+def _dispatch_mp3_chapters(
+    filename: str,
+    aax_file_path: str,
+    output_dir: str,
+    activation_bytes: str,
+    task_id: str,
+    heartbeat: ConversionHeartbeat,
+    owner: str | None = None,
+):
     try:
+        conversion_service.update_progress(filename, 0, "probing", "mp3_chapters")
         metadata_cmd = [
             "ffprobe",
             "-activation_bytes",
@@ -93,8 +277,26 @@ def convert_mp3_chapters_task(
         except Exception:
             album_art_data = None
 
+        # Space for the chapters and the zip is reserved before any encode
+        # starts, so a full disk fails or delays the job now, not hours in
+        estimate = estimate_mp3_bytes(
+            float(format_info.get("duration") or 0),
+            MP3_PROFILES[MP3_PROFILE]["bitrate"],
+            len(chapters),
+        )
         base_name = os.path.splitext(os.path.basename(aax_file_path))[0]
-        temp_dir = tempfile.mkdtemp(prefix=f"{base_name}_mp3_")
+        temp_dir = scratch_space.reserve(
+            estimate,
+            prefix=f"{base_name}_mp3_",
+            output_dir=output_dir,
+            output_bytes=estimate,
+            cancelled=heartbeat.check_cancelled,
+            on_wait=lambda: conversion_service.update_progress(
+                filename, 0, "waiting_for_space", "mp3_chapters"
+            ),
+        )
+        if temp_dir is None:
+            return
         total_chapters = len(chapters)
         conversion_service.update_progress(filename, 0, "converting", "mp3_chapters")
 
@@ -102,37 +304,38 @@ def convert_mp3_chapters_task(
             os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
             decode_responses=True,
         )
-        progress_key = f"mp3_progress:{filename}"
+        progress_key = _progress_key(filename)
         progress_client.set(progress_key, 0, ex=60 * 60 * 12)
 
         album_art_b64 = (
             base64.b64encode(album_art_data).decode("ascii") if album_art_data else None
         )
 
-        chapter_sigs = [
-            convert_mp3_chapter_task.s(
-                filename=filename,
-                aax_file_path=aax_file_path,
-                activation_bytes=activation_bytes,
-                chapter_index=i,
-                chapter=chapter,
-                tags=tags,
-                temp_dir=temp_dir,
-                total_chapters=total_chapters,
-                album_art_b64=album_art_b64,
-                progress_key=progress_key,
-            )
-            for i, chapter in enumerate(chapters)
-        ]
+        conversion_service.record_subtasks(
+            filename, "mp3_chapters", temp_dir, total_chapters
+        )
+        if heartbeat.check_cancelled():
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            progress_client.delete(progress_key)
+            return
 
-        chord(chapter_sigs)(
-            finalize_mp3_chapters_task.s(
-                filename=filename,
-                output_dir=output_dir,
-                temp_dir=temp_dir,
-                total_chapters=total_chapters,
-                progress_key=progress_key,
-            )
+        # Chapters are not queued all at once: the scheduler releases them
+        # a few at a time, interleaved with the chapters of other books
+        spec = {
+            "filename": filename,
+            "aax_file_path": aax_file_path,
+            "activation_bytes": activation_bytes,
+            "chapters": chapters,
+            "tags": tags,
+            "temp_dir": temp_dir,
+            "output_dir": output_dir,
+            "total_chapters": total_chapters,
+            "album_art_b64": album_art_b64,
+            "progress_key": progress_key,
+            "priority": encode_priority(total_chapters),
+        }
+        _send_chapters(
+            chapter_scheduler.submit(task_id, total_chapters, owner=owner, spec=spec)
         )
     except Exception as task_error:
         conversion_service.complete_conversion(
@@ -143,8 +346,73 @@ def convert_mp3_chapters_task(
         )
 
 
-@celery_app.task(name="tasks.convert_mp3_chapter")
+def _send_chapters(released: list):
+    """Queue the chapter encodes released by the scheduler"""
+    specs = {}
+    for job_id, chapter_index in released:
+        if job_id not in specs:
+            specs[job_id] = chapter_scheduler.store.load_spec(job_id)
+        spec = specs[job_id]
+        if spec is None:
+            logger.warning(f"No spec for scheduled job {job_id}, dropping it")
+            _send_chapters(chapter_scheduler.cancel(job_id))
+            continue
+
+        # Subtask ids derive from the conversion task id, so a cancel can
+        # revoke every chapter from the tracked record alone
+        convert_mp3_chapter_task.apply_async(
+            kwargs={
+                "job_id": job_id,
+                "filename": spec["filename"],
+                "aax_file_path": spec["aax_file_path"],
+                "activation_bytes": spec["activation_bytes"],
+                "chapter_index": chapter_index,
+                "chapter": spec["chapters"][chapter_index],
+                "tags": spec["tags"],
+                "temp_dir": spec["temp_dir"],
+                "total_chapters": spec["total_chapters"],
+                "album_art_b64": spec["album_art_b64"],
+                "progress_key": spec["progress_key"],
+            },
+            task_id=_chapter_task_id(job_id, chapter_index),
+            priority=spec["priority"],
+        )
+
+
+def _chapter_done(job_id: str, chapter_index: int, result: dict):
+    """Report a finished chapter, release more work and finalize the last one"""
+    released, finished = chapter_scheduler.complete(job_id, chapter_index, result)
+    _send_chapters(released)
+    if not finished:
+        return
+
+    spec = chapter_scheduler.store.load_spec(job_id)
+    chapter_results = chapter_scheduler.store.get_results(job_id)
+    finalize_mp3_chapters_task.apply_async(
+        kwargs={
+            "chapter_results": chapter_results,
+            "filename": spec["filename"],
+            "output_dir": spec["output_dir"],
+            "temp_dir": spec["temp_dir"],
+            "total_chapters": spec["total_chapters"],
+            "progress_key": spec["progress_key"],
+            "aax_file_path": spec["aax_file_path"],
+        },
+        task_id=_finalize_task_id(job_id),
+    )
+    chapter_scheduler.store.delete_job(job_id)
+
+
+# Chapters are idempotent, so a chapter lost with its worker is redelivered
+@celery_app.task(
+    bind=True,
+    name="tasks.convert_mp3_chapter",
+    acks_late=True,
+    reject_on_worker_lost=True,
+)
 def convert_mp3_chapter_task(
+    self,
+    job_id: str,
     filename: str,
     aax_file_path: str,
     activation_bytes: str,
@@ -156,21 +424,64 @@ def convert_mp3_chapter_task(
     album_art_b64: str | None,
     progress_key: str,
 ):
+    result = _convert_mp3_chapter(
+        self.request.id,
+        filename,
+        aax_file_path,
+        activation_bytes,
+        chapter_index,
+        chapter,
+        tags,
+        temp_dir,
+        total_chapters,
+        album_art_b64,
+        progress_key,
+    )
+    try:
+        _chapter_done(job_id, chapter_index, result)
+    except Exception as schedule_error:
+        logger.error(
+            f"Could not schedule after chapter of {filename}: {schedule_error}"
+        )
+    return result
+
+
+def _convert_mp3_chapter(
+    task_id: str,
+    filename: str,
+    aax_file_path: str,
+    activation_bytes: str,
+    chapter_index: int,
+    chapter: dict,
+    tags: dict,
+    temp_dir: str,
+    total_chapters: int,
+    album_art_b64: str | None,
+    progress_key: str,
+) -> dict:
     try:
         processor = AAXProcessor()
         album_art_data = (
             base64.b64decode(album_art_b64.encode("ascii")) if album_art_b64 else None
         )
-        mp3_path = processor.convert_single_chapter_for_task(
-            chapter_index=chapter_index,
-            chapter=chapter,
-            tags=tags,
-            aax_file=aax_file_path,
-            activation_bytes=activation_bytes,
-            temp_dir=temp_dir,
-            album_art_data=album_art_data,
-            total_chapters=total_chapters,
-        )
+        with ConversionHeartbeat(filename, "mp3_chapters", task_id) as heartbeat:
+            mp3_path = None
+            if not heartbeat.cancelled:
+                mp3_path = processor.convert_single_chapter_for_task(
+                    chapter_index=chapter_index,
+                    chapter=chapter,
+                    tags=tags,
+                    aax_file=aax_file_path,
+                    activation_bytes=activation_bytes,
+                    temp_dir=temp_dir,
+                    album_art_data=album_art_data,
+                    total_chapters=total_chapters,
+                    process_callback=heartbeat.process_started,
+                )
+
+        if heartbeat.cancelled:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return {"success": False, "chapter_index": chapter_index}
 
         if not mp3_path:
             return {"success": False, "chapter_index": chapter_index}
@@ -196,14 +507,41 @@ def convert_mp3_chapter_task(
         return {"success": False, "chapter_index": chapter_index}
 
 
-@celery_app.task(name="tasks.finalize_mp3_chapters")
+@celery_app.task(bind=True, name="tasks.finalize_mp3_chapters")
 def finalize_mp3_chapters_task(
+    self,
     chapter_results: list,
     filename: str,
     output_dir: str,
     temp_dir: str,
     total_chapters: int,
     progress_key: str,
+    aax_file_path: str | None = None,
+):
+    with ConversionHeartbeat(filename, "mp3_chapters", self.request.id) as heartbeat:
+        if heartbeat.cancelled:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+        conversion_service.update_progress(filename, 90, "packaging", "mp3_chapters")
+        _finalize_mp3_chapters(
+            chapter_results,
+            filename,
+            output_dir,
+            temp_dir,
+            total_chapters,
+            progress_key,
+            aax_file_path or os.path.join("uploads", filename),
+        )
+
+
+def _finalize_mp3_chapters(
+    chapter_results: list,
+    filename: str,
+    output_dir: str,
+    temp_dir: str,
+    total_chapters: int,
+    progress_key: str,
+    aax_file_path: str,
 ):
     try:
         successful_paths = []
@@ -246,6 +584,11 @@ def finalize_mp3_chapters_task(
         base_name = os.path.splitext(os.path.basename(filename))[0]
         zip_filename = f"{base_name}_chapters.zip"
         zip_path = os.path.join(output_dir, zip_filename)
+        # Removed rather than truncated: it may be a hardlink shared with
+        # other books' outputs
+        output_cache.forget(zip_path)
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
 
         with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
             for mp3_path in successful_paths:
@@ -255,9 +598,10 @@ def finalize_mp3_chapters_task(
         for mp3_path in successful_paths:
             if os.path.exists(mp3_path):
                 os.remove(mp3_path)
-        if os.path.exists(temp_dir):
-            os.rmdir(temp_dir)
+        # Also releases the directory's scratch reservation
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
+        output_cache.remember(aax_file_path, "mp3_chapters", zip_path)
         conversion_service.complete_conversion(
             filename=filename,
             success=True,
@@ -273,6 +617,159 @@ def finalize_mp3_chapters_task(
         )
 
 
+@celery_app.task(name="tasks.cleanup_cancelled_conversion")
+def cleanup_cancelled_conversion_task(
+    filename: str, work_dir: str | None = None, clear_progress: bool = True
+):
+    """Remove what a cancelled or reaped conversion left behind on the worker side"""
+    if work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not clear_progress:
+        return
+    progress_client = redis.Redis.from_url(
+        os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+        decode_responses=True,
+    )
+    progress_client.delete(_progress_key(filename))
+
+
+def _release_scheduled_chapters(task_id: str):
+    """Drop a job's unreleased chapters, handing its slots to other books"""
+    try:
+        _send_chapters(chapter_scheduler.cancel(task_id))
+    except Exception as e:
+        logger.warning(f"Could not remove job {task_id} from the scheduler: {e}")
+
+
+def release_reaped_conversion(record: dict):
+    """
+    Free what a conversion whose worker was found dead still holds.
+
+    Its unreleased chapters leave the scheduler, and its scratch directory is
+    removed by a cleanup task on the workers, delayed like for a cancel so
+    steps still running elsewhere have seen the failed status and stopped.
+    The chapter progress counter is kept for a requeued attempt.
+    """
+    filename = record["filename"]
+    if record["conversion_type"] != "mp3_chapters":
+        return
+    if record.get("task_id"):
+        _release_scheduled_chapters(record["task_id"])
+    if record.get("work_dir"):
+        try:
+            cleanup_cancelled_conversion_task.apply_async(
+                args=(filename, record["work_dir"]),
+                kwargs={"clear_progress": False},
+                countdown=2,
+            )
+        except Exception as e:
+            logger.warning(f"Could not queue cleanup for {filename}: {e}")
+
+
+def cancel_conversion(filename: str, conversion_type: str) -> dict | None:
+    """
+    Cancel an active conversion.
+
+    Queued tasks of the job are revoked so no worker picks them up, while
+    running steps see the cancelled status through their heartbeat and kill
+    their ffmpeg process groups. Scratch files are removed by a cleanup task
+    on the workers, delayed so killed processes have exited first.
+
+    Returns:
+        dict: The cancelled record, or None if the conversion was not active
+    """
+    record = conversion_service.cancel_conversion(filename, conversion_type)
+    if record is None:
+        return None
+
+    task_id = record.get("task_id")
+    revoked = []
+    if task_id:
+        revoked = [task_id] + subtask_ids(task_id, record.get("subtask_count", 0))
+        if conversion_type == "m4b":
+            revoked.append(_remux_task_id(task_id))
+        try:
+            celery_app.control.revoke(revoked)
+        except Exception as e:
+            logger.warning(f"Could not revoke tasks of {filename}: {e}")
+        if conversion_type == "mp3_chapters":
+            _release_scheduled_chapters(task_id)
+
+    if conversion_type == "mp3_chapters":
+        try:
+            cleanup_cancelled_conversion_task.apply_async(
+                args=(filename, record.get("work_dir")), countdown=2
+            )
+        except Exception as e:
+            logger.warning(f"Could not queue cleanup for {filename}: {e}")
+
+    logger.info(f"Cancelled {conversion_type} conversion of {filename}")
+    return dict(record, revoked_tasks=revoked)
+
+
+def enqueue_conversion(
+    filename: str,
+    conversion_type: str,
+    owner: str | None = None,
+    attempt: int = 1,
+) -> str | None:
+    """
+    Claim a conversion and queue its first task.
+
+    The claim comes first so duplicates never reach Celery; the activation
+    key is resolved by the job itself.
+
+    Returns:
+        str: The new job's task id, or None if the conversion is already active
+    """
+    aax_file_path = os.path.join("uploads", filename)
+    task_id = str(uuid.uuid4())
+    if not conversion_service.start_conversion(
+        filename, conversion_type, task_id, attempt
+    ):
+        return None
+
+    base_name = os.path.splitext(filename)[0]
+    try:
+        if conversion_type == "m4b":
+            prepare_m4b_task.apply_async(
+                args=(
+                    filename,
+                    aax_file_path,
+                    os.path.join("uploads", f"{base_name}.m4b"),
+                ),
+                task_id=task_id,
+            )
+        else:
+            convert_mp3_chapters_task.apply_async(
+                args=(filename, aax_file_path, "uploads"),
+                kwargs={"owner": owner},
+                task_id=task_id,
+            )
+    except Exception as task_error:
+        mark_queue_failure(filename, conversion_type, f"Queue error: {task_error}")
+        raise
+    return task_id
+
+
+def requeue_conversion(record: dict):
+    """Queue a conversion again after its worker was found dead"""
+    filename = record["filename"]
+    conversion_type = record["conversion_type"]
+    aax_file_path = os.path.join("uploads", filename)
+    if not os.path.exists(aax_file_path):
+        logger.warning(f"Not requeueing {filename}: source file is gone")
+        return
+
+    attempt = record.get("attempts", 1) + 1
+    if enqueue_conversion(filename, conversion_type, attempt=attempt) is None:
+        return
+
+    logger.info(
+        f"Requeued {conversion_type} conversion of {filename} (attempt {attempt})"
+    )
+
+
 def mark_queue_failure(filename: str, conversion_type: str, error_message: str):
     conversion_service.complete_conversion(
         filename=filename,
@@ -0,0 +1,44 @@
+import os
+
+from config import logger
+from services import ingest_pipeline
+
+from .celery_app import celery_app
+
+
+def request_ingest(path: str) -> bool:
+    """
+    Queue an ingest job for a new or changed file.
+
+    The ingest daemon also picks up files it watches, so a broker failure
+    here is logged rather than failing the request.
+
+    Returns:
+        bool: True if a job was queued
+    """
+    if ingest_pipeline.register(path) is None:
+        return False
+    return queue_ingest(path)
+
+
+def queue_ingest(path: str) -> bool:
+    """Queue an ingest job for a file that is already registered as pending"""
+    try:
+        ingest_book_task.delay(path)
+    except Exception as e:
+        logger.warning(f"Could not queue ingest of {path}: {e}")
+        return False
+    return True
+
+
+@celery_app.task(name="tasks.ingest_book")
+def ingest_book_task(path: str):
+    """Compute and store everything the library pages need for one file"""
+    if ingest_pipeline.register(path) is None:
+        # Already ingested, or being ingested by the daemon
+        return
+    try:
+        ingest_pipeline.ingest(path)
+    except Exception as e:
+        logger.error(f"Ingest of {path} failed: {e}")
+        ingest_pipeline.store.fail_ingest(os.path.abspath(path), str(e))
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+# Set before any module reads its configuration at import time
+_DB_DIR = tempfile.mkdtemp(prefix="aax-converter-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_DB_DIR}/sqlite.db")
+os.environ.setdefault("CONVERSION_TRACKER_BACKEND", "memory")
+os.environ.setdefault("FAIR_SHARE_STORE", "memory")
+os.environ.setdefault("PROGRESS_EVENTS_BACKEND", "local")
+os.environ.setdefault("SCRATCH_DIR", os.path.join(_DB_DIR, "scratch"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # The thread manager logs at exit, after pytest has closed captured stderr
+    from loguru import logger
+
+    logger.remove()
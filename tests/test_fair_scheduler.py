@@ -0,0 +1,100 @@
+from services.fair_scheduler import FairShareScheduler, InMemorySchedulerStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(slots=2, **kwargs):
+    clock = Clock()
+    expired = []
+    scheduler = FairShareScheduler(
+        InMemorySchedulerStore(),
+        slots=slots,
+        idle_timeout=60,
+        clock=clock,
+        on_expire=expired.append,
+        **kwargs,
+    )
+    return scheduler, clock, expired
+
+
+def test_complete_releases_next_item_and_finishes_once():
+    scheduler, _, _ = make_scheduler(slots=1)
+    assert scheduler.submit("a", 2) == [("a", 0)]
+
+    released, finished = scheduler.complete("a", 0, {"chapter_index": 0})
+    assert released == [("a", 1)]
+    assert not finished
+
+    # A redelivered item is only counted once
+    assert scheduler.complete("a", 0) == ([], False)
+
+    released, finished = scheduler.complete("a", 1, {"chapter_index": 1})
+    assert released == []
+    assert finished
+    assert scheduler.store.get_results("a") == [
+        {"chapter_index": 0},
+        {"chapter_index": 1},
+    ]
+    assert scheduler.complete("a", 1) == ([], False)
+
+
+def test_jobs_are_interleaved_fairly():
+    scheduler, _, _ = make_scheduler(slots=1)
+    assert scheduler.submit("long", 10, owner="alice") == [("long", 0)]
+    scheduler.submit("short", 2, owner="bob")
+
+    order = []
+    job, index = "long", 0
+    for _ in range(4):
+        released, _ = scheduler.complete(job, index)
+        job, index = released[0]
+        order.append(job)
+    # Bob joins level with Alice instead of jumping ahead, then they alternate
+    assert order == ["long", "short", "long", "short"]
+
+
+def test_cancel_gives_slots_to_other_jobs():
+    scheduler, _, _ = make_scheduler(slots=1)
+    scheduler.submit("a", 3)
+    scheduler.submit("b", 1)
+    assert scheduler.cancel("a") == [("b", 0)]
+    assert scheduler.complete("a", 0) == ([], False)
+
+
+def test_jobs_waiting_for_slots_are_not_expired():
+    scheduler, clock, expired = make_scheduler(slots=1)
+    assert scheduler.submit("running", 2) == [("running", 0)]
+    scheduler.submit("waiting", 1)
+
+    for index in range(2):
+        clock.now += 50
+        released, finished = scheduler.complete("running", index)
+    assert finished
+    assert released == [("waiting", 0)]
+    assert expired == []
+
+
+def test_job_with_lost_report_is_expired_and_frees_its_slots():
+    scheduler, clock, expired = make_scheduler(slots=2)
+    assert scheduler.submit("lost", 3) == [("lost", 0), ("lost", 1)]
+    scheduler.submit("other", 1)
+    # The report of item 1 never arrives
+    assert scheduler.complete("lost", 0) == ([("lost", 2)], False)
+
+    clock.now += 30
+    assert scheduler.complete("lost", 2) == ([("other", 0)], False)
+    clock.now += 59
+    assert scheduler.complete("other", 0) == ([], True)
+    assert expired == []
+
+    clock.now += 2
+    assert scheduler.submit("next", 2) == [("next", 0), ("next", 1)]
+    assert expired == ["lost"]
+    assert "lost" not in scheduler.snapshot()
+    assert scheduler.complete("lost", 1) == ([], False)
@@ -0,0 +1,84 @@
+import subprocess
+
+import pytest
+
+from services.conversion_service import conversion_service
+from services.heartbeat import ConversionHeartbeat
+from tasks import conversion_tasks
+
+
+@pytest.fixture
+def sleeper():
+    process = subprocess.Popen(["sleep", "30"], start_new_session=True)
+    yield process
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def _heartbeat(filename):
+    # No background polling: the tests poll themselves
+    return ConversionHeartbeat(filename, "m4b", "task", interval=3600)
+
+
+def test_completed_conversion_is_not_stopped(sleeper):
+    assert conversion_service.start_conversion("done.aax", "m4b", "task")
+    with _heartbeat("done.aax") as heartbeat:
+        heartbeat.process_started(sleeper)
+        conversion_service.complete_conversion("done.aax", conversion_type="m4b")
+        assert not heartbeat.check_cancelled()
+    assert not heartbeat.cancelled
+    assert sleeper.poll() is None
+
+
+def test_reaped_conversion_stops_its_processes(sleeper):
+    assert conversion_service.start_conversion("reaped.aax", "m4b", "task")
+    with _heartbeat("reaped.aax") as heartbeat:
+        heartbeat.process_started(sleeper)
+        assert not heartbeat.check_cancelled()
+        assert [
+            r["filename"] for r in conversion_service.reap_expired_conversions(-60)
+        ] == ["reaped.aax"]
+        assert heartbeat.check_cancelled()
+    assert heartbeat.cancelled
+    assert sleeper.wait(timeout=5) is not None
+
+
+def test_superseded_attempt_stops_its_processes(sleeper):
+    assert conversion_service.start_conversion("requeued.aax", "m4b", "task")
+    with _heartbeat("requeued.aax") as heartbeat:
+        heartbeat.process_started(sleeper)
+        assert not heartbeat.check_cancelled()
+        conversion_service.reap_expired_conversions(-60)
+        assert conversion_service.start_conversion("requeued.aax", "m4b", "task2", 2)
+        assert heartbeat.check_cancelled()
+    assert sleeper.wait(timeout=5) is not None
+
+
+def test_release_reaped_mp3_job_frees_slots_and_scratch(monkeypatch, tmp_path):
+    queued = []
+    monkeypatch.setattr(
+        conversion_tasks.cleanup_cancelled_conversion_task,
+        "apply_async",
+        lambda **kwargs: queued.append(kwargs),
+    )
+    scheduler = conversion_tasks.chapter_scheduler
+    scheduler.submit("job", 3, spec={"filename": "book.aax"})
+
+    conversion_tasks.release_reaped_conversion(
+        {
+            "filename": "book.aax",
+            "conversion_type": "mp3_chapters",
+            "task_id": "job",
+            "work_dir": str(tmp_path),
+        }
+    )
+
+    assert "job" not in scheduler.snapshot()
+    assert queued == [
+        {
+            "args": ("book.aax", str(tmp_path)),
+            "kwargs": {"clear_progress": False},
+            "countdown": 2,
+        }
+    ]
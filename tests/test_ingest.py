@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from services import ingest
+from services.ingest import IngestDaemon, ingest_pipeline
+from services.reaper import StuckJobReaper
+from tasks.ingest_tasks import ingest_book_task
+
+
+@pytest.fixture
+def aax(tmp_path):
+    path = tmp_path / "book.aax"
+    path.write_bytes(b"aax")
+    return str(path)
+
+
+def test_failed_ingest_task_marks_book_as_error(aax, monkeypatch):
+    def ingest(path):
+        assert ingest_pipeline.store.claim_ingest(path)
+        raise RuntimeError("probe crashed")
+
+    monkeypatch.setattr(ingest_pipeline, "ingest", ingest)
+    ingest_book_task(aax)
+
+    book = ingest_pipeline.store.get_book(aax)
+    assert book.ingest_status == "error"
+    assert book.ingest_error == "probe crashed"
+
+
+def test_reaper_requeues_ingests_that_timed_out(aax):
+    ingest_pipeline.register(aax)
+    assert ingest_pipeline.store.claim_ingest(aax)
+
+    assert StuckJobReaper(ingest_timeout=3600).reset_stuck_ingests() == []
+    assert ingest_pipeline.store.get_book(aax).ingest_status == "ingesting"
+
+    time.sleep(0.01)
+    requeued = []
+    reaper = StuckJobReaper(ingest_timeout=0)
+    reaper._requeue_ingest = requeued.append
+    assert reaper.reset_stuck_ingests() == [aax]
+    assert requeued == [aax]
+    assert ingest_pipeline.store.get_book(aax).ingest_status == "pending"
+
+
+def test_daemon_leaves_running_ingests_alone(aax, tmp_path, monkeypatch):
+    ingest_pipeline.register(aax)
+    assert ingest_pipeline.store.claim_ingest(aax)
+    watched = tmp_path / "watched"
+    watched.mkdir()
+    daemon = IngestDaemon(pipeline=ingest_pipeline, directories=[str(watched)])
+
+    # A Celery ingest task may still be working on a recent claim
+    daemon.run_once()
+    assert ingest_pipeline.store.get_book(aax).ingest_status == "ingesting"
+
+    time.sleep(0.01)
+    monkeypatch.setattr(ingest, "INGEST_TIMEOUT_SECONDS", 0)
+    daemon.run_once()
+    assert ingest_pipeline.store.get_book(aax).ingest_status == "pending"
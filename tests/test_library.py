@@ -0,0 +1,74 @@
+import base64
+import json
+import os
+
+import pytest
+
+from services.ingest import ingest_pipeline
+from services.library import LibraryIndex
+
+
+@pytest.fixture
+def library(tmp_path):
+    for name in ("c.aax", "a.aax", "b.aax", "notes.txt"):
+        (tmp_path / name).write_bytes(b"aax")
+    return LibraryIndex(pipeline=ingest_pipeline, directory=str(tmp_path))
+
+
+def test_reconcile_registers_new_files_and_reports_them(library, tmp_path):
+    pending = []
+    counts = library.reconcile(on_pending=pending.append)
+
+    assert counts["registered"] == 3
+    assert sorted(os.path.basename(path) for path in pending) == [
+        "a.aax",
+        "b.aax",
+        "c.aax",
+    ]
+    # Nothing changed, nothing to queue
+    pending.clear()
+    assert library.reconcile(on_pending=pending.append)["registered"] == 0
+    assert pending == []
+
+    os.remove(tmp_path / "b.aax")
+    assert library.reconcile()["removed"] == 1
+
+
+def test_api_pages_continue_from_the_cursor(library):
+    library.reconcile()
+
+    first = library.api_page(sort="title", limit=2, fields="filename")
+    assert [book["filename"] for book in first["books"]] == ["a.aax", "b.aax"]
+    second = library.api_page(
+        sort="title", limit=2, cursor=first["next_cursor"], fields="filename"
+    )
+    assert [book["filename"] for book in second["books"]] == ["c.aax"]
+    assert second["next_cursor"] is None
+
+    with pytest.raises(ValueError):
+        library.api_page(cursor="not a cursor")
+
+
+@pytest.mark.parametrize(
+    "after", [7, {"title": "a"}, ["a"], ["a", "1"], [{"x": 1}, 1], "ab"]
+)
+def test_tampered_cursor_is_rejected(library, after):
+    cursor = base64.urlsafe_b64encode(
+        json.dumps({"sort": ["title", "asc"], "after": after}).encode()
+    ).decode()
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        library.api_page(sort="title", cursor=cursor)
+
+
+def test_library_requests_do_not_reconcile(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    def reconcile(*args, **kwargs):
+        raise AssertionError("reconciled in a request")
+
+    monkeypatch.setattr(main.library_index, "reconcile", reconcile)
+    client = TestClient(main.app)
+    assert client.get("/api/books").status_code == 200
+    assert client.get("/").status_code == 200
@@ -0,0 +1,96 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import aax_convert
+from models import OutputManifest
+from services.output_cache import OutputCache
+
+
+class FakePipeline:
+    """Ingested books by path, as IngestPipeline.current_book returns them"""
+
+    def __init__(self, checksums):
+        self.checksums = checksums
+
+    def current_book(self, path):
+        checksum = self.checksums.get(os.path.abspath(path))
+        return SimpleNamespace(checksum=checksum) if checksum else None
+
+
+@pytest.fixture
+def books(tmp_path):
+    first, copy, other = (str(tmp_path / name) for name in ("a.aax", "b.aax", "c.aax"))
+    return first, copy, other
+
+
+@pytest.fixture
+def cache(tmp_path, books):
+    first, copy, other = books
+    cache = OutputCache(
+        manifest=OutputManifest(f"sqlite:///{tmp_path}/outputs.db"),
+        pipeline=FakePipeline({first: "same", copy: "same", other: "different"}),
+    )
+    cache._tool_version = "ffmpeg version test"
+    return cache
+
+
+def _convert(cache, aax, path, data=b"m4b data"):
+    with open(path, "wb") as f:
+        f.write(data)
+    cache.remember(aax, "m4b", path)
+    return path
+
+
+def test_reuse_links_output_of_same_content(cache, books, tmp_path):
+    first, copy, other = books
+    output = _convert(cache, first, str(tmp_path / "a.m4b"))
+    destination = str(tmp_path / "b.m4b")
+
+    assert cache.reuse(copy, "m4b", destination)
+    assert os.path.samefile(output, destination)
+    assert cache.is_current(copy, "m4b", destination)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".partial")] == []
+
+    assert cache.reuse(first, "m4b", output)
+    assert not cache.reuse(other, "m4b", str(tmp_path / "c.m4b"))
+    assert not cache.reuse(first, "mp3_chapters", str(tmp_path / "a_chapters.zip"))
+    assert not cache.reuse(str(tmp_path / "new.aax"), "m4b", str(tmp_path / "n.m4b"))
+
+
+def test_reuse_skips_changed_outputs_and_settings(cache, books, tmp_path):
+    first, copy, _ = books
+    output = _convert(cache, first, str(tmp_path / "a.m4b"))
+    with open(output, "ab") as f:
+        f.write(b" truncated or replaced")
+
+    assert not cache.reuse(copy, "m4b", str(tmp_path / "b.m4b"))
+    assert cache.manifest.get(output) is None
+
+    _convert(cache, first, output)
+    cache._tool_version = "ffmpeg version newer"
+    assert not cache.reuse(copy, "m4b", str(tmp_path / "b.m4b"))
+    assert not cache.is_current(first, "m4b", output)
+
+
+def test_cli_skips_outputs_in_the_manifest(cache, books, tmp_path, monkeypatch):
+    first, copy, _ = books
+    monkeypatch.setattr(aax_convert, "output_cache", cache)
+    output = _convert(cache, first, str(tmp_path / "a.m4b"))
+
+    assert aax_convert.is_up_to_date(first, "m4b", output, "same", "voice")
+    destination = str(tmp_path / "b.m4b")
+    assert aax_convert.is_up_to_date(copy, "m4b", destination, "same", "voice")
+    assert os.path.samefile(output, destination)
+
+    # Newer than the book, but not known to come from it
+    assert not aax_convert.is_up_to_date(first, "m4b", output, None, "voice")
+    chapters = str(tmp_path / "a_chapters.zip")
+    with open(chapters, "wb") as f:
+        f.write(b"zip data")
+    cache.remember(first, "mp3_chapters", chapters, mp3_profile="voice")
+    assert aax_convert.is_up_to_date(first, "mp3_chapters", chapters, "same", "voice")
+    assert not aax_convert.is_up_to_date(
+        first, "mp3_chapters", chapters, "same", "high"
+    )
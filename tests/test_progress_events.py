@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from services.progress_events import ProgressEventBus
+
+
+@pytest.mark.parametrize(
+    "broker, tracker, expected",
+    [
+        ("redis://redis:6379/0", "sql", True),
+        ("rediss://cache:6380/0", "memory", True),
+        ("amqp://rabbit//", "sql", False),
+        ("amqp://rabbit//", "redis", True),
+        (None, "sql", False),
+    ],
+)
+def test_redis_bridge_follows_the_broker(monkeypatch, broker, tracker, expected):
+    monkeypatch.delenv("PROGRESS_EVENTS_BACKEND", raising=False)
+    if broker is None:
+        monkeypatch.delenv("CELERY_BROKER_URL", raising=False)
+    else:
+        monkeypatch.setenv("CELERY_BROKER_URL", broker)
+    monkeypatch.setenv("CONVERSION_TRACKER_BACKEND", tracker)
+    assert ProgressEventBus._use_redis() is expected
+
+
+def test_redis_bridge_can_be_chosen_without_a_broker(monkeypatch):
+    monkeypatch.delenv("CELERY_BROKER_URL", raising=False)
+    monkeypatch.delenv("TRACKER_REDIS_URL", raising=False)
+    monkeypatch.setenv("CONVERSION_TRACKER_BACKEND", "sql")
+    monkeypatch.setenv("PROGRESS_EVENTS_BACKEND", "redis")
+    assert ProgressEventBus._use_redis()
+    assert ProgressEventBus()._redis_url == "redis://redis:6379/0"
+
+
+def test_local_bus_delivers_changes_once():
+    async def run():
+        bus = ProgressEventBus()
+        events = bus.subscribe("book.aax", "m4b", timeout=0.05)
+        everything = bus.subscribe(timeout=0.05)
+        bus.publish("book.aax", "m4b", {"status": "converting", "progress": 10})
+        bus.publish("book.aax", "m4b", {"status": "converting", "progress": 10})
+        bus.publish("other.aax", "m4b", {"status": "converting", "progress": 5})
+        first = await events.__anext__()
+        assert (first["filename"], first["progress"]) == ("book.aax", 10)
+        assert await events.__anext__() is None
+        assert [(await everything.__anext__())["filename"] for _ in range(2)] == [
+            "book.aax",
+            "other.aax",
+        ]
+        events.close()
+        everything.close()
+
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+import errno
+import os
+import shutil
+from collections import namedtuple
+
+import pytest
+
+from services.scratch import ScratchRoot, ScratchSpace, parse_scratch_roots
+
+MB = 1024 * 1024
+Usage = namedtuple("Usage", "total used free")
+
+
+@pytest.fixture
+def disk(monkeypatch):
+    """Pretend every filesystem is 100 MB with free MB free"""
+    usage = {"free": 100 * MB}
+    monkeypatch.setattr(
+        shutil,
+        "disk_usage",
+        lambda path: Usage(100 * MB, 100 * MB - usage["free"], usage["free"]),
+    )
+    return usage
+
+
+def _space(*roots, **kwargs):
+    kwargs.setdefault("headroom_bytes", 0)
+    kwargs.setdefault("wait_seconds", 0)
+    kwargs.setdefault("poll_seconds", 0)
+    return ScratchSpace(list(roots), **kwargs)
+
+
+def test_parse_scratch_roots():
+    assert parse_scratch_roots("/dev/shm/a=512, /mnt/b,") == [
+        ScratchRoot("/dev/shm/a", 512 * MB),
+        ScratchRoot("/mnt/b", None),
+    ]
+
+
+def test_outstanding_counts_reserved_bytes_not_yet_written(tmp_path, disk):
+    space = _space(ScratchRoot(str(tmp_path), None))
+    directory = space.reserve(30 * MB, prefix="book_")
+    assert os.path.basename(directory).startswith("book_")
+    # Less the few bytes of the reservation file itself
+    assert space.outstanding(str(tmp_path)) == pytest.approx(30 * MB, abs=64)
+
+    with open(os.path.join(directory, "chapter.mp3"), "wb") as f:
+        f.write(b"\0" * MB)
+    assert space.outstanding(str(tmp_path)) == pytest.approx(29 * MB, abs=64)
+
+    shutil.rmtree(directory)
+    assert space.outstanding(str(tmp_path)) == 0
+    assert space.outstanding(str(tmp_path / "missing")) == 0
+
+
+def test_reserve_waits_for_earlier_reservations(tmp_path, disk):
+    space = _space(ScratchRoot(str(tmp_path), None), wait_seconds=0.01)
+    first = space.reserve(60 * MB)
+    waits = []
+
+    with pytest.raises(OSError) as raised:
+        space.reserve(60 * MB, on_wait=lambda: waits.append(True))
+    assert raised.value.errno == errno.ENOSPC
+    assert waits == [True]
+
+    assert space.reserve(60 * MB, cancelled=lambda: True) is None
+
+    shutil.rmtree(first)
+    assert space.reserve(60 * MB) is not None
+
+
+def test_reserve_rejects_jobs_that_could_never_fit(tmp_path, disk):
+    space = _space(ScratchRoot(str(tmp_path), None), wait_seconds=60)
+    with pytest.raises(OSError) as raised:
+        space.reserve(200 * MB, on_wait=pytest.fail)
+    assert raised.value.errno == errno.ENOSPC
+    assert os.listdir(tmp_path) == []
+
+
+def test_reserve_uses_first_root_that_takes_the_size(tmp_path, disk):
+    small, large = tmp_path / "shm", tmp_path / "nvme"
+    space = _space(ScratchRoot(str(small), 10 * MB), ScratchRoot(str(large), None))
+
+    assert os.path.dirname(space.reserve(5 * MB)) == str(small)
+    assert os.path.dirname(space.reserve(20 * MB)) == str(large)
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+from models.conversion import ConversionTracker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_services_has_no_side_effects(tmp_path):
+    db = tmp_path / "cli.db"
+    script = (
+        "import signal, aax_convert, services\n"
+        "assert signal.getsignal(signal.SIGINT) is signal.default_int_handler\n"
+        "assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL\n"
+    )
+    env = dict(
+        os.environ, DATABASE_URL=f"sqlite:///{db}", CONVERSION_TRACKER_BACKEND="sql"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, check=True)
+    assert not db.exists()
+
+
+def test_cli_leaves_server_conversions_alone(tmp_path):
+    database = f"sqlite:///{tmp_path}/server.db"
+    tracker = ConversionTracker(database)
+    assert tracker.claim_conversion("book.aax", "m4b")
+    (tmp_path / "books").mkdir()
+
+    env = dict(os.environ, DATABASE_URL=database, CONVERSION_TRACKER_BACKEND="sql")
+    subprocess.run(
+        [sys.executable, "-m", "aax_convert", str(tmp_path / "books")],
+        cwd=ROOT,
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+
+    assert tracker.get_progress("book.aax", "m4b")["status"] == "starting"
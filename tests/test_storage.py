@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+from services import storage
+from services.storage import StorageManager
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    directories = [
+        tmp_path / name for name in ("uploads", "streams", "covers", "scratch")
+    ]
+    for directory in directories:
+        directory.mkdir()
+    return directories
+
+
+def _write(path, size, age):
+    path.write_bytes(b"\0" * size)
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return str(path)
+
+
+def _manager(dirs, active=(), **kwargs):
+    upload_dir, stream_dir, covers_dir, scratch_dir = dirs
+    manager = StorageManager(
+        upload_dir=str(upload_dir),
+        stream_cache_dir=str(stream_dir),
+        covers_dir=str(covers_dir),
+        scratch_dirs=[str(scratch_dir)],
+        **kwargs,
+    )
+    manager._active_conversions = lambda: list(active)
+    return manager
+
+
+def test_enforce_quota_evicts_least_recently_used_outputs(dirs, monkeypatch):
+    upload_dir, stream_dir, covers_dir, _ = dirs
+    forgotten = []
+    monkeypatch.setattr(storage.output_cache, "forget", forgotten.append)
+    oldest = _write(upload_dir / "old.m4b", 40, age=300)
+    linked = str(upload_dir / "copy.m4b")
+    os.link(oldest, linked)
+    older = _write(upload_dir / "older_chapters.zip", 40, age=200)
+    recent = _write(upload_dir / "new.m4b", 40, age=100)
+    _write(upload_dir / "book.aax", 1000, age=500)
+    writing = _write(upload_dir / "busy.m4b", 40, age=600)
+    # Counted, but evicted by the stream cache or kept
+    stream = _write(stream_dir / "chapter_1.mp3", 20, age=900)
+    _write(stream_dir / "chapter_2.mp3.partial", 500, age=900)
+    cover = _write(covers_dir / "1.jpg", 20, age=900)
+    active = [{"filename": "busy.aax", "conversion_type": "m4b"}]
+
+    manager = _manager(dirs, active, quota_bytes=90)
+    assert manager.kept_bytes() == 40
+    assert manager.enforce_quota() == (2, 80)
+
+    assert not os.path.exists(oldest) and not os.path.exists(linked)
+    assert not os.path.exists(older)
+    assert sorted(forgotten) == sorted([oldest, linked, older])
+    for path in (recent, writing, stream, cover, str(upload_dir / "book.aax")):
+        assert os.path.exists(path)
+
+    assert manager.enforce_quota() == (0, 0)
+    assert _manager(dirs, quota_bytes=0).enforce_quota() == (0, 0)
+
+
+def test_collect_scratch_keeps_claimed_and_recent_dirs(dirs, monkeypatch):
+    scratch_dir = dirs[-1]
+    for name, age in (("crashed", 7200), ("running", 7200), ("fresh", 10)):
+        (scratch_dir / name).mkdir()
+        _write(scratch_dir / name / "part.mp3", 1, age)
+        os.utime(scratch_dir / name, (time.time() - age,) * 2)
+    active = [{"filename": "running.aax", "conversion_type": "mp3_chapters"}]
+    monkeypatch.setattr(
+        storage.conversion_service,
+        "get_progress",
+        lambda filename, conversion_type: {"work_dir": str(scratch_dir / "running")},
+    )
+
+    assert _manager(dirs, active, orphan_seconds=3600).collect_scratch() == 1
+    assert sorted(os.listdir(scratch_dir)) == ["fresh", "running"]
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+
+from models.conversion import ConversionTracker
+from services import reaper
+from services.tracker_backends import (
+    REAPED_ERROR,
+    InMemoryTrackerBackend,
+    RedisTrackerBackend,
+    SQLTrackerBackend,
+)
+
+
+@pytest.fixture(params=["memory", "sql", "redis"])
+def backend(request, tmp_path):
+    sql = SQLTrackerBackend(ConversionTracker(f"sqlite:///{tmp_path}/tracker.db"))
+    if request.param == "memory":
+        return InMemoryTrackerBackend()
+    if request.param == "sql":
+        return sql
+    return RedisTrackerBackend(
+        client=fakeredis.FakeRedis(decode_responses=True), history=sql
+    )
+
+
+def _future():
+    return datetime.utcnow() + timedelta(minutes=1)
+
+
+def test_claim_is_exclusive_while_active(backend):
+    assert backend.claim_conversion("book.aax", "m4b", task_id="t1")
+    assert not backend.claim_conversion("book.aax", "m4b", task_id="t2")
+    assert backend.claim_conversion("book.aax", "mp3_chapters")
+
+    assert backend.update_progress("book.aax", 0, "waiting_for_space", "m4b")
+    assert backend.is_conversion_active("book.aax", "m4b")
+    assert not backend.claim_conversion("book.aax", "m4b", task_id="t3")
+
+    assert backend.update_progress("book.aax", 40.0, "converting", "m4b")
+    progress = backend.get_progress("book.aax", "m4b")
+    assert progress["status"] == "converting"
+    assert float(progress["progress"]) == 40.0
+    assert {c["conversion_type"] for c in backend.get_all_active_conversions()} == {
+        "m4b",
+        "mp3_chapters",
+    }
+
+
+def test_completed_conversion_is_terminal(backend):
+    assert backend.claim_conversion("book.aax", "m4b")
+    assert backend.complete_conversion("book.aax", result_path="/out/book.m4b")
+    backend.flush()
+
+    progress = backend.get_progress("book.aax", "m4b")
+    assert progress["status"] == "completed"
+    assert float(progress["progress"]) == 100.0
+    assert not backend.update_progress("book.aax", 50.0)
+    assert not backend.complete_conversion("book.aax", success=False)
+    assert backend.get_all_active_conversions() == []
+    assert backend.claim_conversion("book.aax", "m4b", attempt=2)
+
+
+def test_only_leased_conversions_are_reaped(backend):
+    assert backend.claim_conversion("queued.aax")
+    assert backend.claim_conversion("leased.aax")
+    assert backend.claim_conversion("released.aax")
+    backend.record_heartbeat("leased.aax", "m4b", "host:1", "t1", 4321, 1)
+    backend.record_heartbeat("released.aax", "m4b", "host:2", "t2", None, 1)
+    backend.record_heartbeat("released.aax", "m4b", "host:2", "t2", None, -1)
+
+    assert (
+        backend.reap_expired_conversions(datetime.utcnow() - timedelta(hours=1)) == []
+    )
+    reaped = backend.reap_expired_conversions(_future())
+    backend.flush()
+
+    assert [record["filename"] for record in reaped] == ["leased.aax"]
+    assert reaped[0]["worker_id"] == "host:1"
+    progress = backend.get_progress("leased.aax", "m4b")
+    assert progress["status"] == "error"
+    assert progress["error"] == REAPED_ERROR
+    assert backend.is_conversion_active("queued.aax", "m4b")
+    assert backend.is_conversion_active("released.aax", "m4b")
+    assert backend.reap_expired_conversions(_future()) == []
+
+
+def test_cancel_ends_conversion_once(backend):
+    assert backend.claim_conversion("book.aax")
+    backend.record_heartbeat("book.aax", "m4b", "host:1", lease_delta=1)
+
+    record = backend.cancel_conversion("book.aax")
+    backend.flush()
+
+    assert record["filename"] == "book.aax"
+    assert backend.get_progress("book.aax", "m4b")["status"] == "cancelled"
+    assert backend.cancel_conversion("book.aax") is None
+    assert backend.reap_expired_conversions(_future()) == []
+    assert not backend.update_progress("book.aax", 10.0)
+
+
+def test_reaper_releases_and_requeues_without_signalling_recorded_pid(monkeypatch):
+    record = {
+        "filename": "book.aax",
+        "conversion_type": "m4b",
+        "worker_id": "host:1",
+        "ffmpeg_pid": 4321,
+        "attempts": 1,
+    }
+    monkeypatch.setattr(
+        reaper.conversion_service, "reap_expired_conversions", lambda _: [record]
+    )
+    monkeypatch.setattr(
+        reaper.os, "killpg", lambda *_: pytest.fail("reaper signalled a process")
+    )
+    released, requeued = [], []
+    stuck_job_reaper = reaper.StuckJobReaper(max_attempts=2)
+    stuck_job_reaper._release = released.append
+    stuck_job_reaper._requeue = requeued.append
+
+    assert stuck_job_reaper.run_once() == [record]
+    assert released == requeued == [record]
+
+    record["attempts"] = 2
+    released.clear()
+    requeued.clear()
+    stuck_job_reaper.run_once()
+    # Out of attempts, but what it holds is still released
+    assert released == [record]
+    assert requeued == []
+
+
+def test_redis_history_is_kept_in_redis_until_flushed(tmp_path):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    web = SQLTrackerBackend(ConversionTracker(f"sqlite:///{tmp_path}/web.db"))
+    worker = RedisTrackerBackend(
+        client=client,
+        history=SQLTrackerBackend(ConversionTracker(f"sqlite:///{tmp_path}/w.db")),
+    )
+    assert worker.claim_conversion("done.aax")
+    assert worker.complete_conversion("done.aax", result_path="/out/done.m4b")
+    assert worker.claim_conversion("lost.aax")
+    worker.record_heartbeat("lost.aax", "m4b", "host:1", lease_delta=1)
+    assert len(worker.reap_expired_conversions(_future())) == 1
+    assert client.llen(RedisTrackerBackend.HISTORY_KEY) == 2
+
+    # Whatever process finished them, the web process persists them
+    RedisTrackerBackend(client=client, history=web).flush()
+    assert client.llen(RedisTrackerBackend.HISTORY_KEY) == 0
+    assert web.get_progress("done.aax", "m4b")["status"] == "completed"
+    assert web.get_progress("lost.aax", "m4b")["error"] == REAPED_ERROR
+    assert worker.history.get_progress("done.aax", "m4b")["status"] == "not_started"